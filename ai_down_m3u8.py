@@ -1,10 +1,14 @@
 # python
 import requests
 from multiprocessing import Pool
-import re
 import os
+import shutil
 from tqdm import tqdm
-from Crypto.Cipher import AES
+
+from download_metrics import metrics
+from hls_crypto import decrypt_cbc, sequence_iv, unpad_view
+from hls_playlist import MasterPlaylist, download_hls, parse_playlist
+from segment_downloader import download_segments, stream_segments
 
 # 创建临时文件夹
 dirs = 'ts_list_need_to_merge/'
@@ -29,57 +33,28 @@ headers = {
 def parse_m3u8_text(m3u8_text):
     """
     返回: method, key_uri, ts_list, media_sequence (int), iv_hex_or_None
+    只取第一个密钥；分段级密钥/IV、字节范围、主播放列表请用 hls_playlist.parse_playlist
     """
-    lines = [line.strip() for line in m3u8_text.splitlines() if line.strip() != '']
-    # 媒体序号（可选）
-    media_seq = 0
-    for line in lines:
-        if line.startswith('#EXT-X-MEDIA-SEQUENCE'):
-            try:
-                media_seq = int(line.split(':', 1)[1])
-            except Exception:
-                media_seq = 0
-            break
-
-    # 找到 KEY 行
-    key_lines = [line for line in lines if line.startswith('#EXT-X-KEY:')]
-    if not key_lines:
+    playlist = parse_playlist(m3u8_text)
+    if isinstance(playlist, MasterPlaylist):
+        raise Exception('解析失败: 这是主播放列表，请先选择码率')
+    keys = playlist.keys
+    if not keys:
         raise Exception('解析失败: 找不到 #EXT-X-KEY')
-    key_line = key_lines[0][len('#EXT-X-KEY:'):]
-    # 解析属性，形如 METHOD=AES-128,URI="...",IV=0x...
-    attrs = {}
-    for part in re.split(r',(?=(?:[^"]*"[^"]*")*[^"]*$)', key_line):
-        if '=' in part:
-            k, v = part.split('=', 1)
-            attrs[k.strip()] = v.strip().strip('"')
-    method = attrs.get('METHOD')
-    key_uri = attrs.get('URI')
-    iv = attrs.get('IV')  # 例如 0x1234...
-    # 收集 ts 列表（不包含注释）
-    ts_list = [line for line in lines if not line.startswith('#') and line.endswith('.ts')]
-    if not method or not key_uri or not ts_list:
+    key = keys[0]
+    ts_list = [seg.uri for seg in playlist.segments]
+    if not key.method or not key.uri or not ts_list:
         raise Exception('解析失败: 缺少 METHOD/URI/TS 列表')
-    return method, key_uri, ts_list, media_seq, iv
+    return key.method, key.uri, ts_list, playlist.media_sequence, '0x' + key.iv.hex() if key.iv else None
 
 
 def pkcs7_unpad(data: bytes) -> bytes:
-    if not data:
-        return data
-    pad_len = data[-1]
-    if 1 <= pad_len <= AES.block_size and data[-pad_len:] == bytes([pad_len]) * pad_len:
-        return data[:-pad_len]
-    return data
+    return bytes(unpad_view(data))
 
 
 def decrypt_content_and_save_file(filename, content, key, iv):
-    try:
-        decrypter = AES.new(key, AES.MODE_CBC, iv=iv)
-    except Exception as e:
-        raise
-    # content 长度应该是 16 的倍数，若不是尝试不报错直接解密（依赖库）
-    decrypted = decrypter.decrypt(content)
-    # 去 PKCS7 填充（如果有）
-    decrypted = pkcs7_unpad(decrypted)
+    # content 长度应该是 16 的倍数；解密进预分配缓冲区，去 PKCS7 填充不复制
+    decrypted = decrypt_cbc(key, iv, content)
     with open(filename, mode='wb') as f:
         f.write(decrypted)
 
@@ -88,7 +63,7 @@ def merge_ts_to_mp4(filename, ts_file_list):
     with open(filename, mode='ab') as f1:
         for ts_file in ts_file_list:
             with open(ts_file, mode='rb') as f2:
-                f1.write(f2.read())
+                shutil.copyfileobj(f2, f1, 1024 * 1024)
     print(filename, '完成！')
 
 
@@ -149,46 +124,31 @@ def download_method_2(ts_list, key, media_sequence=0, processes_nums=2):
     return [dirs + os.path.split(ts_url)[-1] for ts_url in ts_list]
 
 
+def download_method_3(ts_list, key, media_sequence=0, workers=10):
+    """线程池 + keep-alive 连接池下载并解密，dirs 下的 manifest.json 记录已完成分段，中断后重跑只补缺的段"""
+    def decrypt(idx, content):
+        return decrypt_cbc(key, sequence_iv(media_sequence + idx), content)
+
+    filenames = [os.path.split(ts_url)[-1] for ts_url in ts_list]
+    return download_segments(ts_list, dirs, filenames=filenames, transform=decrypt, headers=headers,
+                             workers=workers)
+
+
+def download_and_merge(ts_list, key, filename, media_sequence=0, workers=10, buffer_segments=None, decrypt_workers=2):
+    """并发下载、按顺序解密后直接追加到 filename，不落每段的临时文件；中断后重跑从断点续写
+    解密在单独的 decrypt_workers 个线程里做，与网络下载重叠
+    """
+    def decrypt(idx, content):
+        return decrypt_cbc(key, sequence_iv(media_sequence + idx), content)
+
+    stream_segments(ts_list, filename, transform=decrypt, headers=headers, workers=workers,
+                    buffer_segments=buffer_segments, transform_workers=decrypt_workers)
+    print(filename, '完成！')
+    return filename
+
+
 if __name__ == "__main__":
     m3u8_url = 'https://play.bo262626.com/20231108/xV1bY9Cn/700kb/hls/index.m3u8'
-    response = requests.get(m3u8_url, headers=headers)
-    response.raise_for_status()
-    m3u8 = response.text
-    method, key_url, ts_list, media_seq, iv_hex = parse_m3u8_text(m3u8)
-
-    # 处理 key_url 和 ts_list 的相对路径（根据实际 m3u8 调整）
-    if key_url.startswith('/'):
-        base = re.match(r'^(https?://[^/]+)', m3u8_url)
-        if base:
-            key_url = base.group(1) + key_url
-    if not key_url.startswith('http'):
-        # 尝试与 m3u8 同域拼接
-        base = re.match(r'^(https?://.*/)', m3u8_url)
-        if base:
-            key_url = base.group(1) + key_url
-
-    ts_list_full = []
-    for item in ts_list:
-        if item.startswith('http'):
-            ts_list_full.append(item)
-        elif item.startswith('/'):
-            base = re.match(r'^(https?://[^/]+)', m3u8_url)
-            ts_list_full.append((base.group(1) + item) if base else item)
-        else:
-            base = re.match(r'^(https?://.*/)', m3u8_url)
-            ts_list_full.append((base.group(1) + item) if base else item)
-
-    key_resp = requests.get(key_url, headers=headers)
-    key_resp.raise_for_status()
-    key = key_resp.content
-    if isinstance(iv_hex, str) and iv_hex.startswith('0x'):
-        iv = bytes.fromhex(iv_hex[2:])
-        if len(iv) < 16:
-            iv = (b'\x00' * (16 - len(iv))) + iv
-    else:
-        iv = None  # 不直接使用此 iv，改用每段序号生成 iv
-
-    # 使用多进程下载并解密，每段用序号生成 IV（若 m3u8 提供了 IV，也可改为使用固定 iv）
-    ts_file_list = download_method_2(ts_list_full, key=key, media_sequence=media_seq, processes_nums=10)
-
-    merge_ts_to_mp4('test.mp4', ts_file_list)
+    # 解析播放列表(主播放列表按带宽选码率，每段自己的密钥/IV/字节范围)，并发下载并按序解密直接写入最终文件
+    download_hls(m3u8_url, 'test.mp4', headers=headers, workers=10)
+    metrics.report()
@@ -21,11 +21,21 @@ import time
 import json
 import shutil
 import subprocess
-from urllib.parse import urljoin, urlparse
+from html.parser import HTMLParser
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse
 from pathlib import Path
 
 import requests
-from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree as lxml_etree  # 可选：有 lxml 时用 C 实现的流式解析，快数倍
+except ImportError:
+    lxml_etree = None
+
+from download_metrics import metrics
+from hls_playlist import UnsupportedPlaylist, download_hls
+from rate_limiter import get_limiter
 
 # ---------------------------- 配置项 ----------------------------
 DEFAULT_UA = (
@@ -35,7 +45,22 @@ DEFAULT_UA = (
 SUPPORTED_DIRECT_EXT = {".mp4", ".webm", ".mov", ".mkv", ".flv", ".ts"}
 REQUEST_TIMEOUT = 20
 CHUNK_SIZE = 1024 * 1024  # 1MB
-DELAY_BETWEEN_DOWNLOADS = 1.0  # 秒，防止过快请求
+HLS_WORKERS = 8  # 原生 HLS 下载并发分段数
+DIRECT_WORKERS = 4  # 同时进行的直链下载数
+STREAM_WORKERS = 2  # 同时进行的 HLS/DASH 任务数(ffmpeg 或原生 HLS，各自占用较多连接/CPU)
+HOST_RATE = 2.0  # 每个主机每秒最多开始的下载数，防止过快请求(不同主机互不影响)
+HOST_BURST = 4
+# 去重时忽略的易变查询参数(签名、过期时间、时间戳、统计)，其余参数视为媒体标识
+VOLATILE_PARAMS = {"sign", "signature", "sig", "token", "auth_key", "auth", "key", "policy", "expires", "expire",
+                   "deadline", "e", "t", "ts", "timestamp", "_", "nonce", "rand", "spm", "spm_id_from",
+                   "vd_source", "from", "ref", "source", "x-amz-signature", "x-amz-date", "x-amz-expires",
+                   "x-amz-credential", "x-amz-security-token", "x-amz-signedheaders", "x-amz-algorithm"}
+VOLATILE_PREFIXES = ("utm_",)
+# 文本/脚本里的媒体链接：m3u8、mpd 与直链合并成一个预编译正则，只扫一遍
+MEDIA_URL_RE = re.compile(r"https?://[^\s'\"<>]+?\.(?:m3u8|mpd|mp4|webm|mov|mkv|flv|ts)[^\s'\"<>]*", re.IGNORECASE)
+MEDIA_TAGS = {"video", "source"}
+FIXTURE_PAGES_DIR = Path(__file__).resolve().parent / "fixtures" / "pages"  # 提取基准用的保存网页
+LAZY_SRC_ATTRS = ("data-src", "data-url", "data-video", "data-mp4")
 
 
 # ---------------------------- 工具函数 ----------------------------
@@ -57,27 +82,128 @@ def make_header_string(headers: dict) -> str:
     return "\r\n".join(f"{k}: {v}" for k, v in headers.items()) + "\r\n"
 
 
+def unique_name(name: str, taken: set) -> str:
+    """按去掉扩展名的主名去重(HLS 会自己补 .ts/.mp4)，重名时加 _1、_2 ..."""
+    stem, ext = os.path.splitext(name)
+    candidate, i = stem, 1
+    while candidate.lower() in taken:
+        candidate = f"{stem}_{i}"
+        i += 1
+    taken.add(candidate.lower())
+    return candidate + ext
+
+
+def media_key(url: str) -> tuple:
+    """同一媒体的判定键：主机 + 路径 + 去掉易变参数(签名、过期、时间戳、统计)后的查询串，忽略片段
+    其余参数保留，play.m3u8?vid=1 与 play.m3u8?vid=2 仍算两个媒体
+    """
+    parsed = urlparse(url)
+    params = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+                    if k.lower() not in VOLATILE_PARAMS and not k.lower().startswith(VOLATILE_PREFIXES))
+    return parsed.netloc.lower(), parsed.path, urlencode(params)
+
+
+def dedupe_media(found: dict) -> dict:
+    """去掉只在易变参数(见 VOLATILE_PARAMS)上不同的重复链接，跨 direct/m3u8/mpd 分类也只保留第一次出现的"""
+    seen = set()
+    result = {}
+    for kind in ("direct", "m3u8", "mpd"):
+        kept = []
+        for url in found.get(kind, []):
+            key = media_key(url)
+            if key not in seen:
+                seen.add(key)
+                kept.append(url)
+        result[kind] = kept
+    return result
+
+
 def request_get(url: str, headers: dict) -> requests.Response:
-    r = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
-    r.raise_for_status()
+    with metrics.request(url) as rec:
+        r = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        rec.response(r)
+        r.raise_for_status()
+        rec.add_bytes(len(r.content))
     return r
 
 
 # ---------------------------- 解析网页 ----------------------------
 
-def extract_media_urls(page_url: str, html: str) -> dict:
+class _MediaCollector:
+    """流式解析回调，不建 DOM 树：
+    - <video>/<source> 的 src 与懒加载属性、<a href> 直接取
+    - 连续的文本(含 <script> 内容，不含 <style> 与注释)攒成一段，遇到标签边界时就地跑一次正则
+    """
+
+    def __init__(self, add_url):
+        self.add_url = add_url
+        self._text = []
+        self._in_style = 0
+
+    def start(self, tag, attrs: dict):
+        self.flush()
+        tag = tag.lower()
+        if tag in MEDIA_TAGS:
+            self.add_url(attrs.get("src"))
+            for key in LAZY_SRC_ATTRS:
+                self.add_url(attrs.get(key))
+        elif tag == "a":
+            self.add_url(attrs.get("href"))
+        elif tag == "style":
+            self._in_style += 1
+
+    def end(self, tag):
+        self.flush()
+        if tag.lower() == "style" and self._in_style:
+            self._in_style -= 1
+
+    def data(self, text: str):
+        if not self._in_style:
+            self._text.append(text)
+
+    def flush(self):
+        if self._text:
+            text = "".join(self._text)
+            self._text.clear()
+            for m in MEDIA_URL_RE.findall(text):
+                self.add_url(m)
+
+    def close(self):
+        self.flush()
+
+
+class _StdlibMediaParser(HTMLParser):
+    """没有 lxml 时的回退：标准库分词器驱动同一个回调"""
+
+    def __init__(self, collector: _MediaCollector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, dict(attrs))
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def extract_media_urls(page_url: str, html: str, use_lxml: bool = True) -> dict:
     """从 HTML 中提取可能的视频链接，返回 dict 分类结果。"""
-    soup = BeautifulSoup(html, "html.parser")
     base = page_url
 
     direct_files = set()
     m3u8_list = set()
     mpd_list = set()
+    seen = set()
 
     def add_url(u: str):
-        if not u:
+        # 同一原始串只处理一次；正则取到的已是绝对地址，省掉 urljoin
+        if not u or u in seen:
             return
-        abs_u = urljoin(base, u)
+        seen.add(u)
+        abs_u = u if u.startswith(("http://", "https://")) else urljoin(base, u)
         lower = abs_u.split("?")[0].lower()
         if lower.endswith(".m3u8"):
             m3u8_list.add(abs_u)
@@ -89,27 +215,16 @@ def extract_media_urls(page_url: str, html: str) -> dict:
             if ext in SUPPORTED_DIRECT_EXT:
                 direct_files.add(abs_u)
 
-    # 1) <video src>, <source src>
-    for tag in soup.find_all(["video", "source"]):
-        add_url(tag.get("src"))
-        # data-src 等懒加载
-        for key in ["data-src", "data-url", "data-video", "data-mp4"]:
-            add_url(tag.get(key))
-
-    # 2) <a href> 中的直链
-    for a in soup.find_all("a"):
-        add_url(a.get("href"))
-
-    # 3) 文本与脚本里的直链（正则）
-    text = soup.get_text("\n") + "\n".join(s.get_text("\n") for s in soup.find_all("script") if s)
-    # 通用匹配 .m3u8/.mpd/直链
-    for pat in [
-        r"https?://[^\s'\"<>]+?\.m3u8[^\s'\"<>]*",
-        r"https?://[^\s'\"<>]+?\.mpd[^\s'\"<>]*",
-        r"https?://[^\s'\"<>]+?\.(?:mp4|webm|mov|mkv|flv|ts)(?:[^\s'\"<>]*)",
-    ]:
-        for m in re.findall(pat, text, flags=re.IGNORECASE):
-            add_url(m)
+    collector = _MediaCollector(add_url)
+    if use_lxml and lxml_etree is not None:
+        parser = lxml_etree.HTMLParser(target=collector)
+        parser.feed(html)
+        parser.close()
+    else:
+        parser = _StdlibMediaParser(collector)
+        parser.feed(html)
+        parser.close()
+        collector.close()
 
     return {
         "direct": sorted(direct_files),
@@ -118,25 +233,109 @@ def extract_media_urls(page_url: str, html: str) -> dict:
     }
 
 
+def _bench_extract(paths=None, repeat: int = 3):
+    """比较原 BeautifulSoup 写法与流式提取的耗时并核对结果
+    paths 为保存下来的网页；不给时用 FIXTURE_PAGES_DIR 下的样例页面，再加一个生成的脚本很多的大页面
+    命令行: python all_video.py --bench-extract [页面 ...]
+    """
+    from bs4 import BeautifulSoup
+
+    def soup_extract(page_url, html):
+        soup = BeautifulSoup(html, "html.parser")
+        found = {"direct": set(), "m3u8": set(), "mpd": set()}
+
+        def add_url(u):
+            if not u:
+                return
+            abs_u = urljoin(page_url, u)
+            lower = abs_u.split("?")[0].lower()
+            if lower.endswith(".m3u8"):
+                found["m3u8"].add(abs_u)
+            elif lower.endswith(".mpd"):
+                found["mpd"].add(abs_u)
+            elif os.path.splitext(urlparse(abs_u).path)[1].lower() in SUPPORTED_DIRECT_EXT:
+                found["direct"].add(abs_u)
+
+        for tag in soup.find_all(["video", "source"]):
+            add_url(tag.get("src"))
+            for key in LAZY_SRC_ATTRS:
+                add_url(tag.get(key))
+        for a in soup.find_all("a"):
+            add_url(a.get("href"))
+        text = soup.get_text("\n") + "\n".join(s.get_text("\n") for s in soup.find_all("script") if s)
+        for pat in [
+            r"https?://[^\s'\"<>]+?\.m3u8[^\s'\"<>]*",
+            r"https?://[^\s'\"<>]+?\.mpd[^\s'\"<>]*",
+            r"https?://[^\s'\"<>]+?\.(?:mp4|webm|mov|mkv|flv|ts)(?:[^\s'\"<>]*)",
+        ]:
+            for m in re.findall(pat, text, flags=re.IGNORECASE):
+                add_url(m)
+        return {k: sorted(v) for k, v in found.items()}
+
+    pages = []
+    for path in paths or sorted(FIXTURE_PAGES_DIR.glob("*.html")):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            pages.append((str(path), f.read()))
+    if not paths:
+        chunks = ["<html><head><style>.x{background:url(http://cdn.example.com/bg.mp4)}</style></head><body>"]
+        for i in range(3000):
+            chunks.append(f'<div class="item"><a href="/v/{i}.mp4">第 {i} 集</a><p>{"说明文字 " * 20}</p></div>')
+            if i % 10 == 0:
+                chunks.append(f'<video src="/media/{i}.webm" data-src="/lazy/{i}.mp4"></video>')
+            if i % 50 == 0:
+                chunks.append("<script>var cfg = {" + ", ".join(
+                    f'"k{j}": "https://s{j % 7}.example.com/a/{i}_{j}.{("m3u8", "mpd", "js", "ts")[j % 4]}?t={j}"'
+                    for j in range(400)) + "};</script>")
+        chunks.append("</body></html>")
+        pages.append(("<生成页面>", "".join(chunks)))
+
+    variants = [("BeautifulSoup + 3 个正则(原写法)", soup_extract)]
+    if lxml_etree is not None:
+        variants.append(("lxml 流式 + 合并正则", lambda u, h: extract_media_urls(u, h, use_lxml=True)))
+    variants.append(("html.parser 流式 + 合并正则", lambda u, h: extract_media_urls(u, h, use_lxml=False)))
+
+    for name, html in pages:
+        print(f"{name}: {len(html) / 1024:.0f} KB")
+        results = []
+        for label, func in variants:
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                found = func("https://www.example.com/page", html)
+            elapsed = (time.perf_counter() - t0) / repeat
+            results.append(found)
+            print(f"  {label:32s} {elapsed * 1000:8.1f} ms  {sum(len(v) for v in found.values())} 个链接")
+        assert all(r == results[0] for r in results), "提取结果与原写法不一致"
+
+
 # ---------------------------- 下载方法 ----------------------------
 
-def download_direct(url: str, out_dir: Path, headers: dict) -> Path:
-    local_name = sanitize_filename(os.path.basename(urlparse(url).path) or "video.mp4")
-    out_path = out_dir / local_name
-    with requests.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as r:
+def direct_name(url: str) -> str:
+    return sanitize_filename(os.path.basename(urlparse(url).path) or "video.mp4")
+
+
+def stream_name(url: str) -> str:
+    return sanitize_filename(os.path.basename(urlparse(url).path)) or "stream"
+
+
+def download_direct(url: str, out_dir: Path, headers: dict, filename: str = None) -> Path:
+    out_path = out_dir / (filename or direct_name(url))
+    with metrics.request(url) as rec, requests.get(url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT) as r:
+        rec.response(r)
         r.raise_for_status()
         with open(out_path, "wb") as f:
             for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
                 if chunk:
                     f.write(chunk)
+                    rec.add_bytes(len(chunk))
     print(f"[OK] 已下载直链: {out_path}")
     return out_path
 
 
-def download_stream_with_ffmpeg(stream_url: str, out_dir: Path, headers: dict, prefer_mp4=True) -> Path:
+def download_stream_with_ffmpeg(stream_url: str, out_dir: Path, headers: dict, prefer_mp4=True,
+                                filename: str = None) -> Path:
     ffmpeg = ensure_ffmpeg()
     # 输出文件名
-    base_name = sanitize_filename(os.path.basename(urlparse(stream_url).path)) or "stream"
+    base_name = filename or stream_name(stream_url)
     if prefer_mp4 and not base_name.lower().endswith(".mp4"):
         base_name += ".mp4"
     out_path = out_dir / base_name
@@ -154,7 +353,8 @@ def download_stream_with_ffmpeg(stream_url: str, out_dir: Path, headers: dict, p
     ]
     print("运行:", " ".join([c if "\n" not in c else "<headers>" for c in cmd]))
     try:
-        subprocess.run(cmd, check=True)
+        with metrics.stage("ffmpeg", out_path.name):
+            subprocess.run(cmd, check=True)
     except subprocess.CalledProcessError as e:
         # 简单识别 DRM/加密
         print("[WARN] ffmpeg 下载失败，可能为加密流或受 DRM 保护: ", e)
@@ -163,6 +363,27 @@ def download_stream_with_ffmpeg(stream_url: str, out_dir: Path, headers: dict, p
     return out_path
 
 
+def download_hls_native(stream_url: str, out_dir: Path, headers: dict, filename: str = None) -> Path:
+    """原生解析 m3u8(主播放列表选最高码率、分段密钥/字节范围)并发下载，不依赖 ffmpeg
+    不支持的流(DRM、直播等)抛 UnsupportedPlaylist；filename 不带扩展名，按容器自动补 .ts/.mp4
+    """
+    base_name = filename or os.path.splitext(stream_name(stream_url))[0] or "stream"
+    out_path = download_hls(stream_url, str(out_dir / base_name), headers=headers, workers=HLS_WORKERS)
+    print(f"[OK] 已保存流媒体: {out_path}")
+    return Path(out_path)
+
+
+def download_hls_stream(stream_url: str, out_dir: Path, headers: dict, filename: str = None) -> Path:
+    """先走原生并发下载，不支持或失败时回退 ffmpeg"""
+    try:
+        return download_hls_native(stream_url, out_dir, headers, filename=filename)
+    except UnsupportedPlaylist as e:
+        print(f"[INFO] 原生下载不支持({e})，改用 ffmpeg")
+    except Exception as e:
+        print(f"[WARN] 原生下载失败({e})，改用 ffmpeg")
+    return download_stream_with_ffmpeg(stream_url, out_dir, headers, filename=filename)
+
+
 # ---------------------------- 可选：浏览器抓取 ----------------------------
 
 def try_browser_capture(page_url: str, headers: dict, duration_sec: int = 10) -> dict:
@@ -204,6 +425,68 @@ def try_browser_capture(page_url: str, headers: dict, duration_sec: int = 10) ->
     return {"direct": sorted(direct), "m3u8": sorted(m3u8s), "mpd": sorted(mpds)}
 
 
+# ---------------------------- 并发调度 ----------------------------
+
+def run_downloads(found: dict, out_dir: Path, headers: dict, direct_workers: int = DIRECT_WORKERS,
+                  stream_workers: int = STREAM_WORKERS, host_rate: float = HOST_RATE) -> list:
+    """直链与 HLS/DASH 分两个池并发下载，各自限制并发数；每个主机按令牌桶限速开始新的下载
+    限速在提交前检查：只有池里有空位且该主机有令牌的任务才提交，等令牌的任务不占工作线程，
+    其他主机的链接不会排在它后面
+    输出文件名预先分配、互不重名。返回成功的输出路径(按 found 中的顺序)
+    """
+    taken = set()
+    jobs = []
+    for url in found["direct"]:
+        jobs.append(("direct", "直链", download_direct, url, unique_name(direct_name(url), taken)))
+    for url in found["m3u8"]:
+        jobs.append(("stream", "m3u8", download_hls_stream, url,
+                     unique_name(os.path.splitext(stream_name(url))[0], taken)))
+    for url in found["mpd"]:
+        name = stream_name(url)
+        if not name.lower().endswith(".mp4"):
+            name += ".mp4"
+        jobs.append(("stream", "mpd", download_stream_with_ffmpeg, url, unique_name(name, taken)))
+
+    results = [None] * len(jobs)
+    workers = {"direct": direct_workers, "stream": stream_workers}
+    running = {"direct": 0, "stream": 0}
+    waiting = list(enumerate(jobs))
+    with ThreadPoolExecutor(max_workers=direct_workers) as direct_pool, \
+            ThreadPoolExecutor(max_workers=stream_workers) as stream_pool:
+        pools = {"direct": direct_pool, "stream": stream_pool}
+        futures = {}
+        while waiting or futures:
+            # 按顺序提交所有能立即开始的任务；主机没有令牌的留在 waiting 里，记下最早可用的时间
+            next_token = None
+            still_waiting = []
+            for i, job in waiting:
+                pool_name, label, func, url, filename = job
+                if running[pool_name] >= workers[pool_name]:
+                    still_waiting.append((i, job))
+                    continue
+                delay = get_limiter(urlparse(url).netloc.lower(), host_rate, HOST_BURST).try_acquire()
+                if delay > 0:
+                    next_token = delay if next_token is None else min(next_token, delay)
+                    still_waiting.append((i, job))
+                    continue
+                running[pool_name] += 1
+                futures[pools[pool_name].submit(func, url, out_dir, headers, filename=filename)] = (i, pool_name,
+                                                                                                   label, url)
+            waiting = still_waiting
+            if not futures:
+                time.sleep(next_token or 0)
+                continue
+            done, _ = wait(futures, timeout=next_token, return_when=FIRST_COMPLETED)
+            for future in done:
+                i, pool_name, label, url = futures.pop(future)
+                running[pool_name] -= 1
+                try:
+                    results[i] = str(future.result())
+                except Exception as e:
+                    print(f"[ERR] {label} 下载失败 {url}: {e}")
+    return [path for path in results if path]
+
+
 # ---------------------------- 主流程 ----------------------------
 
 def fetch_all_videos(page_url: str, out_dir: Path, headers: dict, use_browser: bool = False):
@@ -223,41 +506,17 @@ def fetch_all_videos(page_url: str, out_dir: Path, headers: dict, use_browser: b
         for key in ["direct", "m3u8", "mpd"]:
             found[key] = sorted({*found[key], *captured.get(key, [])})
 
+    # 只在签名/时间戳等易变参数上不同的链接视为同一媒体
+    found = dedupe_media(found)
     print(json.dumps(found, ensure_ascii=False, indent=2))
 
-    # 4) 逐类下载
-    downloaded = []
-
-    # 直链
-    for url in found["direct"]:
-        try:
-            path = download_direct(url, out_dir, headers)
-            downloaded.append(str(path))
-            time.sleep(DELAY_BETWEEN_DOWNLOADS)
-        except Exception as e:
-            print(f"[ERR] 直链下载失败 {url}: {e}")
-
-    # HLS
-    for url in found["m3u8"]:
-        try:
-            path = download_stream_with_ffmpeg(url, out_dir, headers)
-            downloaded.append(str(path))
-            time.sleep(DELAY_BETWEEN_DOWNLOADS)
-        except Exception as e:
-            print(f"[ERR] m3u8 下载失败 {url}: {e}")
-
-    # DASH
-    for url in found["mpd"]:
-        try:
-            path = download_stream_with_ffmpeg(url, out_dir, headers)
-            downloaded.append(str(path))
-            time.sleep(DELAY_BETWEEN_DOWNLOADS)
-        except Exception as e:
-            print(f"[ERR] mpd 下载失败 {url}: {e}")
+    # 4) 直链与流媒体并发下载(分别限并发，按主机限速)
+    downloaded = run_downloads(found, out_dir, headers)
 
     print("\n[完成] 输出文件:")
     for p in downloaded:
         print(" -", p)
+    metrics.report()
 
 
 def build_headers(args) -> dict:
@@ -272,14 +531,19 @@ def build_headers(args) -> dict:
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("url", nargs="https://www.bilibili.com/video/BV1ieNXzBEZC/?spm_id_from=333.1007.tianma.4-1-11.click&vd_source=8717dbc54e2861596ea522ce66955e88", help="视频页面的URL")
+    parser.add_argument("url", nargs="?", default="https://www.bilibili.com/video/BV1ieNXzBEZC/?spm_id_from=333.1007.tianma.4-1-11.click&vd_source=8717dbc54e2861596ea522ce66955e88", help="视频页面的URL")
     parser.add_argument("--out", default="./downloads", help="输出目录")
     parser.add_argument("--ua", help="User-Agent")
     parser.add_argument("--referer", help="Referer")
     parser.add_argument("--cookie", help="Cookie")
     parser.add_argument("--browser", action="store_true", help="是否使用浏览器cookie")
+    parser.add_argument("--bench-extract", nargs="*", metavar="PAGE",
+                        help="只跑链接提取基准(与原 BeautifulSoup 写法对比)，不给页面时用 fixtures/pages 下的样例")
 
     args = parser.parse_args()
+    if args.bench_extract is not None:
+        _bench_extract(args.bench_extract)
+        return
     out_dir = Path(args.out).resolve()
     headers = build_headers(args)
 
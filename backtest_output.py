@@ -0,0 +1,204 @@
+"""
+回测结果输出后端：按"表名 -> DataFrame"逐个写出，写完一张即落盘/释放。
+
+    xlsx         pd.ExcelWriter(openpyxl)，整本工作簿在内存里，适合少量股票的人工查看报表
+    xlsx_stream  openpyxl 只写模式逐行流式写入，内存占用与股票数无关
+    parquet      目录下每张表一个 .parquet(需要 pyarrow)
+    feather      目录下每张表一个 .feather(需要 pyarrow)
+    csv.gz       目录下每张表一个 .csv.gz
+
+目录型后端的目录名取文件名去掉扩展名，如 回测结果.parquet -> 回测结果/600104.parquet
+直接运行本文件: 各后端写同一批数据并测速
+"""
+import os
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+BACKENDS = ('xlsx', 'xlsx_stream', 'parquet', 'feather', 'csv.gz')
+
+_SUFFIX_BACKEND = {'.xlsx': 'xlsx', '.parquet': 'parquet', '.feather': 'feather', '.csv.gz': 'csv.gz'}
+
+
+def infer_backend(filename: str) -> str:
+    """按扩展名推断后端，无法识别时用 xlsx"""
+    lower = filename.lower()
+    for suffix, backend in _SUFFIX_BACKEND.items():
+        if lower.endswith(suffix):
+            return backend
+    return 'xlsx'
+
+
+class BacktestWriter(ABC):
+    """输出后端基类，支持 with 语句；write(name, df) 写一张表，close() 收尾"""
+
+    def __init__(self, filename: str):
+        self.path = filename
+        self.names = []
+
+    def write(self, name: str, df: pd.DataFrame):
+        self._write(str(name), df)
+        self.names.append(str(name))
+
+    @abstractmethod
+    def _write(self, name: str, df: pd.DataFrame):
+        """写一张表，由各后端实现"""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ExcelBacktestWriter(BacktestWriter):
+    def __init__(self, filename: str):
+        super().__init__(filename)
+        self._writer = pd.ExcelWriter(filename, engine="openpyxl")
+
+    def _write(self, name, df):
+        df.to_excel(self._writer, sheet_name=name, index=False)
+
+    def close(self):
+        if not self.names:
+            # openpyxl 不能保存没有 sheet 的工作簿
+            pd.DataFrame().to_excel(self._writer, sheet_name="Sheet1", index=False)
+        self._writer.close()
+
+
+class StreamingExcelWriter(BacktestWriter):
+    """openpyxl write_only: 行直接写进临时文件，保存时再打包，不在内存里保留单元格对象"""
+
+    def __init__(self, filename: str):
+        import openpyxl
+        super().__init__(filename)
+        self._wb = openpyxl.Workbook(write_only=True)
+
+    def _write(self, name, df):
+        ws = self._wb.create_sheet(title=name)
+        ws.append([str(c) for c in df.columns])
+        # 按列 tolist 得到 Python 标量；NaN/NaT 写成空单元格(与 to_excel 一致)
+        columns = []
+        for _, col in df.items():
+            values = col.tolist()
+            if col.hasnans:
+                values = [None if missing else v for v, missing in zip(values, col.isna().tolist())]
+            columns.append(values)
+        for row in zip(*columns):
+            ws.append(row)
+
+    def close(self):
+        if not self.names:
+            self._wb.create_sheet(title="Sheet1")
+        self._wb.save(self.path)
+
+
+class DirectoryWriter(BacktestWriter):
+    """每张表一个文件的列式/压缩文本后端"""
+    suffix = ''
+
+    def __init__(self, filename: str):
+        root = self.root_for(filename)
+        super().__init__(root)
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def root_for(filename: str) -> str:
+        """输出目录：文件名去掉后端扩展名"""
+        for suffix in _SUFFIX_BACKEND:
+            if filename.lower().endswith(suffix):
+                return filename[:-len(suffix)]
+        return filename
+
+    def file_for(self, name: str) -> str:
+        return os.path.join(self.path, name.replace(os.sep, '_') + self.suffix)
+
+
+class ParquetWriter(DirectoryWriter):
+    suffix = '.parquet'
+
+    def _write(self, name, df):
+        df.to_parquet(self.file_for(name), index=False)
+
+
+class FeatherWriter(DirectoryWriter):
+    suffix = '.feather'
+
+    def _write(self, name, df):
+        df.reset_index(drop=True).to_feather(self.file_for(name))
+
+
+class CsvGzWriter(DirectoryWriter):
+    suffix = '.csv.gz'
+
+    def _write(self, name, df):
+        df.to_csv(self.file_for(name), index=False, encoding='utf-8-sig', compression='gzip')
+
+
+_WRITERS = {
+    'xlsx': ExcelBacktestWriter,
+    'xlsx_stream': StreamingExcelWriter,
+    'parquet': ParquetWriter,
+    'feather': FeatherWriter,
+    'csv.gz': CsvGzWriter,
+}
+
+
+def open_writer(filename: str, backend: str = None) -> BacktestWriter:
+    """按 backend(None 时按扩展名推断)打开输出后端"""
+    backend = backend or infer_backend(filename)
+    if backend not in _WRITERS:
+        raise ValueError(f"未知的输出后端: {backend}，可选 {', '.join(BACKENDS)}")
+    return _WRITERS[backend](filename)
+
+
+def read_tables(path: str, backend: str = None) -> dict:
+    """读回 open_writer 写出的全部表，返回 {表名: DataFrame}"""
+    backend = backend or infer_backend(path)
+    if backend in ('xlsx', 'xlsx_stream'):
+        return pd.read_excel(path, sheet_name=None)
+    if backend not in _WRITERS:
+        raise ValueError(f"未知的输出后端: {backend}，可选 {', '.join(BACKENDS)}")
+    writer_cls = _WRITERS[backend]
+    root = writer_cls.root_for(path)
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"输出目录不存在: {root}")
+    readers = {'parquet': pd.read_parquet, 'feather': pd.read_feather,
+               'csv.gz': lambda f: pd.read_csv(f, encoding='utf-8-sig')}
+    return {f[:-len(writer_cls.suffix)]: readers[backend](os.path.join(root, f))
+            for f in sorted(os.listdir(root)) if f.endswith(writer_cls.suffix)}
+
+
+def _bench(n_tables=100, n_days=1250):
+    """写 n_tables 张(每张 n_days 行)交易明细，比较各后端耗时"""
+    import tempfile
+    import time
+
+    import numpy as np
+
+    rng = np.random.default_rng(3)
+    dates = pd.bdate_range('2020-01-01', periods=n_days)
+    tables = {}
+    for i in range(n_tables):
+        close = 20 * np.exp(np.cumsum(rng.normal(0, 0.02, n_days)))
+        tables[f"{600000 + i}"] = pd.DataFrame({
+            "日期": dates, "收盘价": close, "10日均值": close, "操作": np.where(rng.random(n_days) < 0.1, "止跌补仓", ""),
+            "详情": "", "投入本金": close * 100, "股票市值": close * 200, "账户现金": 0.0, "账户总市值": close * 200,
+        })
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in BACKENDS:
+            try:
+                t0 = time.perf_counter()
+                with open_writer(os.path.join(tmp, f"bench.{backend}"), backend) as writer:
+                    for name, df in tables.items():
+                        writer.write(name, df)
+                print(f"{backend:12s} {time.perf_counter() - t0:7.2f}s")
+            except ImportError as e:
+                print(f"{backend:12s} 跳过({e})")
+
+
+if __name__ == '__main__':
+    _bench()
@@ -0,0 +1,151 @@
+"""
+本地日线行情仓库：按 (复权方式, 股票代码) 存为结构化 .npy（读取时内存映射），
+只向数据源补取缺失的首尾日期，重复运行几乎不再走网络。
+
+目录结构: <root>/<adjust>/<symbol>.npy + <symbol>.json(覆盖区间元数据)
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# 数值列 -> 文件内字段名(npy 结构化字段用 ASCII 名)，数据源缺少的列自动跳过
+BAR_COLUMNS = {'开盘': 'open', '收盘': 'close', '最高': 'high', '最低': 'low', '成交量': 'volume',
+               '成交额': 'amount', '振幅': 'amplitude', '涨跌幅': 'pct_chg', '涨跌额': 'chg', '换手率': 'turnover'}
+_FIELD_TO_COLUMN = {v: k for k, v in BAR_COLUMNS.items()}
+# 收盘后多久视为当日数据已定型
+SESSION_CLOSE = (15, 30)
+
+
+def _to_day(val) -> str:
+    return pd.to_datetime(val).strftime('%Y-%m-%d')
+
+
+def _completed_through(end_day: str, now: datetime = None) -> str:
+    """本次取数可以确认完整的最后日期：当日未收盘的 bar 视为临时数据"""
+    now = now or datetime.now()
+    today = now.strftime('%Y-%m-%d')
+    if end_day < today:
+        return end_day
+    if now.weekday() >= 5 or (now.hour, now.minute) >= SESSION_CLOSE:
+        return today
+    return (now - timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+class BarStore:
+    """日线仓库
+    fetch_func(symbol, start_date 'YYYYMMDD', end_date 'YYYYMMDD', adjust) -> DataFrame(含 '日期' 列)
+    """
+
+    def __init__(self, root: str, fetch_func):
+        self.root = root
+        self.fetch_func = fetch_func
+        self.fetch_count = 0
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _paths(self, symbol, adjust):
+        folder = os.path.join(self.root, adjust or 'none')
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f'{symbol}.npy'), os.path.join(folder, f'{symbol}.json')
+
+    def _load(self, symbol, adjust):
+        data_path, meta_path = self._paths(symbol, adjust)
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return pd.DataFrame(), {}
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            arr = np.load(data_path, mmap_mode='r')
+        except Exception:
+            return pd.DataFrame(), {}
+        df = pd.DataFrame({_FIELD_TO_COLUMN.get(name, '日期'): np.asarray(arr[name]) for name in arr.dtype.names})
+        df['日期'] = pd.to_datetime(df['日期']).dt.strftime('%Y-%m-%d')
+        return df, meta
+
+    def _save(self, symbol, adjust, df, meta):
+        data_path, meta_path = self._paths(symbol, adjust)
+        cols = [c for c in BAR_COLUMNS if c in df.columns]
+        dtype = [('date', 'datetime64[D]')] + [(BAR_COLUMNS[c], 'f8') for c in cols]
+        arr = np.empty(len(df), dtype=dtype)
+        arr['date'] = pd.to_datetime(df['日期']).values.astype('datetime64[D]')
+        for c in cols:
+            arr[BAR_COLUMNS[c]] = pd.to_numeric(df[c], errors='coerce').to_numpy(dtype='f8')
+        # 先写临时文件再替换，避免中途崩溃留下半个文件
+        tmp_data = data_path + '.tmp.npy'
+        np.save(tmp_data, arr)
+        os.replace(tmp_data, data_path)
+        tmp_meta = meta_path + '.tmp'
+        with open(tmp_meta, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_meta, meta_path)
+
+    def _fetch(self, symbol, start_day, end_day, adjust):
+        self.fetch_count += 1
+        df = self.fetch_func(symbol, start_day.replace('-', ''), end_day.replace('-', ''), adjust)
+        if df is None or df.empty or '日期' not in df.columns:
+            return pd.DataFrame()
+        df = df.copy()
+        df['日期'] = df['日期'].map(_to_day)
+        return df
+
+    def get(self, symbol: str, start_date, end_date, adjust: str = 'qfq') -> pd.DataFrame:
+        """返回 [start_date, end_date] 区间的日线，只补取本地没有覆盖到的部分"""
+        start_day, end_day = _to_day(start_date), _to_day(end_date)
+        with self._lock((symbol, adjust)):
+            df, meta = self._load(symbol, adjust)
+            covered_from = meta.get('covered_from')
+            complete_through = meta.get('complete_through')
+            changed = False
+            done = complete_through
+            try:
+                if df.empty or not covered_from:
+                    fetched = self._fetch(symbol, start_day, end_day, adjust)
+                    if fetched.empty:
+                        return fetched
+                    df, covered_from, changed = fetched, start_day, True
+                    done = _completed_through(end_day)
+                else:
+                    # 取数失败(返回空)时不改动覆盖范围，下次仍会补取这些日期
+                    if start_day < covered_from:
+                        head = self._fetch(symbol, start_day, covered_from, adjust)
+                        if not head.empty:
+                            df = pd.concat([head, df], ignore_index=True)
+                            covered_from, changed = start_day, True
+                    if end_day > complete_through:
+                        # 与本地最后一根 bar 重叠取数，用于检查复权因子是否变化
+                        last_day = df['日期'].iloc[-1]
+                        tail = self._fetch(symbol, last_day, end_day, adjust)
+                        if not tail.empty:
+                            overlap = df[df['日期'].isin(tail['日期'])].set_index('日期')['收盘']
+                            fresh = tail.set_index('日期')['收盘'].reindex(overlap.index)
+                            if not np.allclose(overlap.values, fresh.values, rtol=1e-6, equal_nan=True):
+                                print(f"{symbol} 复权价格变化，重新拉取 {covered_from} 起的全部数据")
+                                refetched = self._fetch(symbol, covered_from, end_day, adjust)
+                                if not refetched.empty:
+                                    df, changed = refetched, True
+                                    done = max(_completed_through(end_day), complete_through)
+                            else:
+                                df = pd.concat([df[df['日期'] < tail['日期'].iloc[0]], tail], ignore_index=True)
+                                changed = True
+                                done = max(_completed_through(end_day), complete_through)
+                if df.empty:
+                    return df
+                if changed:
+                    df = df.drop_duplicates('日期', keep='last').sort_values('日期').reset_index(drop=True)
+                    # 未收盘的当日 bar 只返回不落盘
+                    stored = df[df['日期'] <= done]
+                    if not stored.empty:
+                        self._save(symbol, adjust, stored, {'covered_from': covered_from, 'complete_through': done})
+            except Exception as e:
+                print(f"{symbol} 行情仓库更新失败，使用本地已有数据: {e}")
+            if df.empty:
+                return df
+            return df[(df['日期'] >= start_day) & (df['日期'] <= end_day)].reset_index(drop=True)
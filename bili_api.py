@@ -0,0 +1,141 @@
+"""
+B 站接口访问层：所有 API 调用共用一个带连接池和重试的 Session，分P列表和播放地址走 TTLCache(内存 + 磁盘)
+- pagelist 按 bvid 缓存，分P结构基本不变，保留 PAGELIST_MAX_AGE
+- playurl 按 bvid/cid/qn 缓存，有效期跟随签名地址里的 deadline 参数(提前 DEADLINE_MARGIN 秒失效)，
+  地址里没有 deadline 时按 PLAYURL_MAX_AGE
+- get_pagelists 并发批量解析多个 BV 号，只请求缓存未命中的
+重跑下了一半的批次时，元数据全部从缓存读出，不再重复请求接口
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import parse_qs, urlsplit
+
+from download_metrics import metrics
+from segment_downloader import make_session
+from stock_cache import DiskBackend, MemoryBackend, TTLCache
+
+PAGELIST_API = "https://api.bilibili.com/x/player/pagelist"
+PLAYURL_API = "https://api.bilibili.com/x/player/playurl"
+REQUEST_TIMEOUT = 20
+API_WORKERS = 4
+PAGELIST_MAX_AGE = 7 * 24 * 3600
+PLAYURL_MAX_AGE = 110 * 60      # 播放地址签名一般 2 小时内有效
+DEADLINE_MARGIN = 300           # 签名到期前 5 分钟就视为失效，留出下载时间
+
+
+def get_cache_dir():
+    cache_dir = os.environ.get('BILI_CACHE_DIR') or os.path.join(os.path.dirname(__file__), 'cache', 'bili')
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def make_cache(root: str = None) -> TTLCache:
+    policies = {
+        'pagelist': {'expire': 'never', 'max_age': PAGELIST_MAX_AGE},
+        'playurl': {'expire': 'never', 'max_age': PLAYURL_MAX_AGE},
+    }
+    return TTLCache([MemoryBackend(), DiskBackend(root or get_cache_dir())], policies)
+
+
+def url_deadline(url: str):
+    """签名地址里的 deadline(unix 秒)，没有时返回 None"""
+    values = parse_qs(urlsplit(url).query).get('deadline')
+    if values and values[0].isdigit():
+        return int(values[0])
+    return None
+
+
+class BiliAPI:
+    """带缓存的 pagelist / playurl 查询，线程间共享；calls 记录实际发出的接口请求数"""
+
+    def __init__(self, headers: dict = None, cache: TTLCache = None, session=None, qn: int = 80, auth=None):
+        if session is None:
+            session = make_session(headers, pool_size=API_WORKERS * 2)
+            session.auth = auth
+        self.session = session
+        self.cache = cache if cache is not None else make_cache()
+        self.qn = qn
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _get_json(self, api: str, params: dict):
+        with metrics.request(api) as rec:
+            resp = self.session.get(api, params=params, timeout=REQUEST_TIMEOUT)
+            with self._lock:
+                self.calls += 1
+            rec.response(resp)
+            resp.raise_for_status()
+            rec.add_bytes(len(resp.content))
+        data = resp.json()
+        if data["code"] != 0:
+            raise Exception(f"API请求失败: {data}")
+        return data["data"]
+
+    def get_pagelist(self, bvid: str) -> list:
+        pages = self.cache.get('pagelist', bvid)
+        if pages is None:
+            pages = self._get_json(PAGELIST_API, {"bvid": bvid, "jsonp": "jsonp"})
+            self.cache.set('pagelist', bvid, pages)
+        return pages
+
+    def get_pagelists(self, bvids, workers: int = API_WORKERS) -> dict:
+        """批量解析，返回 {bvid: 分P列表 或 异常}"""
+        results = {}
+        todo = []
+        for bvid in dict.fromkeys(bvids):
+            pages = self.cache.get('pagelist', bvid)
+            if pages is None:
+                todo.append(bvid)
+            else:
+                results[bvid] = pages
+        if todo:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(self.get_pagelist, bvid): bvid for bvid in todo}
+                for future in as_completed(futures):
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as e:
+                        results[futures[future]] = e
+        return results
+
+    def get_playurl(self, bvid: str, cid: int) -> tuple:
+        """返回 (video_url, audio_url 或 None)，老视频没有 DASH 时取 durl"""
+        key = f"{bvid}_{cid}_{self.qn}"
+        entry = self.cache.get('playurl', key)
+        if entry is not None and entry['expires'] > time.time():
+            return entry['video'], entry['audio']
+
+        data = self._get_json(PLAYURL_API, {"bvid": bvid, "cid": cid, "qn": self.qn, "fnval": 16})
+        try:
+            video_url = data["dash"]["video"][0]["baseUrl"]
+            audio_url = data["dash"]["audio"][0]["baseUrl"]
+        except (KeyError, IndexError, TypeError):
+            durl = data.get("durl")
+            if not durl:
+                raise Exception("无法解析到有效的视频下载地址")
+            video_url, audio_url = durl[0]["url"], None
+
+        deadline = url_deadline(video_url)
+        expires = deadline - DEADLINE_MARGIN if deadline else time.time() + PLAYURL_MAX_AGE
+        self.cache.set('playurl', key, {'video': video_url, 'audio': audio_url, 'expires': expires})
+        return video_url, audio_url
+
+    def close(self):
+        self.session.close()
+
+
+_apis = {}
+_apis_lock = threading.Lock()
+
+
+def get_api(headers: dict, auth=None) -> BiliAPI:
+    """同一组请求头(同一个 Cookie 或同一个认证钩子)在进程内共用一个 BiliAPI"""
+    key = (tuple(sorted((headers or {}).items())), auth)
+    with _apis_lock:
+        api = _apis.get(key)
+        if api is None:
+            api = BiliAPI(headers, auth=auth)
+            _apis[key] = api
+        return api
@@ -4,28 +4,12 @@ import requests
 from pathlib import Path
 import shutil
 import subprocess
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 
-# 使用 Selenium 自动获取 B 站 cookie
-def get_bilibili_cookie():
-    chrome_options = Options()
-    chrome_options.add_argument('--headless')  # 无头模式
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--no-sandbox')
-
-    driver = webdriver.Chrome(options=chrome_options)
-    driver.get('https://www.bilibili.com/')
-
-    # 等待页面加载完成，可根据网络情况适当增加时间
-    driver.implicitly_wait(5)
+from cookie_provider import get_provider
 
-    cookies = driver.get_cookies()
-    driver.quit()
-
-    # 拼接为 requests 可用的 cookie 字符串
-    cookie_str = '; '.join([f"{c['name']}={c['value']}" for c in cookies])
-    return cookie_str
+# 获取 B 站 cookie：与其他下载脚本共用本地 cookie 存储，只有没有可用 cookie 时才启动无头 Chrome
+def get_bilibili_cookie():
+    return get_provider().cookie_header()
 
 # 构建请求头
 def get_headers():
@@ -0,0 +1,188 @@
+"""
+B 站分P下载流水线：取播放地址 → 视频/音频并发下载 → ffmpeg 合并
+- 每个分P的视频和音频同时下载(各自再按 ranged_download 多连接分块)
+- 合并在单独的有界线程池里跑：某个分P交给 ffmpeg 后，下载线程马上去拉下一个分P，网络和合并重叠
+- 等待合并的分P数有上限，ffmpeg 跟不上时下载线程暂停，避免临时文件在磁盘上无限堆积
+- 音轨已是 AAC(B 站 DASH 音频一般是 mp4a.40.x)时 -c:a copy 直接复制，否则才转码为 AAC
+- download_batch: 多个视频的所有分P进同一个 JobQueue，按总连接预算调度，任务日志支持中断后续跑；
+  入队前先解析播放地址，按实际 CDN 主机限制每个主机的连接数
+"""
+import os
+import re
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from bili_api import API_WORKERS, get_api
+from download_metrics import metrics
+from job_queue import Job, JobQueue
+from ranged_download import CONNECTIONS
+
+PART_WORKERS = 3          # 同时在下载的分P数(PartPipeline 默认下载线程数为其 2 倍)
+MERGE_WORKERS = 2         # 同时运行的 ffmpeg 数
+MAX_PENDING_MERGES = 4    # 已下载完、排队等合并的分P上限
+CONNECTION_BUDGET = 24    # 批量下载时所有分P同时占用的连接总数(每个分P 视频 + 音频各 CONNECTIONS 个)
+HOST_LIMITS = {}          # {CDN 主机: 连接上限}，覆盖 DEFAULT_HOST_LIMIT
+DEFAULT_HOST_LIMIT = 16   # 未在 HOST_LIMITS 中列出的主机的连接上限(默认同一 CDN 主机最多 2 个分P同时下载)
+FALLBACK_HOST = "bilibili"  # 入队前解析播放地址失败的分P记在此名下，下载时再重新解析
+JOURNAL_FILE = "bili_jobs.jsonl"
+
+
+def safe_filename(name: str) -> str:
+    return re.sub(r'[\\/:*?"<>|]', '_', name)
+
+
+def audio_codec(path) -> str:
+    """用 ffprobe 读第一条音轨的编码名(如 'aac')，没有 ffprobe 或读取失败返回 None"""
+    ffprobe_path = shutil.which("ffprobe")
+    if ffprobe_path is None:
+        return None
+    cmd = [ffprobe_path, "-v", "error", "-select_streams", "a:0", "-show_entries", "stream=codec_name",
+           "-of", "default=noprint_wrappers=1:nokey=1", str(path)]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip() or None
+
+
+def audio_codec_args(audio_file) -> list:
+    """已是 AAC 就直接复制音轨，否则转码为 AAC"""
+    return ["-c:a", "copy"] if audio_codec(audio_file) == "aac" else ["-c:a", "aac"]
+
+
+class PartPipeline:
+    """下载池 + 有界合并池，可被多个视频的分P共用
+    download(url, filename, desc)；merge(video_file, audio_file, output_file)
+    """
+
+    def __init__(self, download, merge, download_workers: int = PART_WORKERS * 2, merge_workers: int = MERGE_WORKERS,
+                 max_pending_merges: int = MAX_PENDING_MERGES):
+        self.download = download
+        self.merge = merge
+        self._pending = threading.BoundedSemaphore(max(1, max_pending_merges))
+        self._download_pool = ThreadPoolExecutor(max_workers=download_workers)
+        self._merge_pool = ThreadPoolExecutor(max_workers=merge_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._download_pool.shutdown(wait=True)
+        self._merge_pool.shutdown(wait=True)
+
+    def _merge_part(self, video_file, audio_file, output_path):
+        try:
+            print(f"\n正在合并音视频: {output_path.name}")
+            with metrics.stage('ffmpeg', output_path.name):
+                self.merge(str(video_file), str(audio_file), str(output_path))
+            os.remove(video_file)
+            os.remove(audio_file)
+            print(f"合并完成并清理临时文件: {output_path.name}")
+        finally:
+            self._pending.release()
+
+    def fetch_part(self, page, output_dir, resolve):
+        """下载一个分P：无独立音轨时直接完成返回 None；否则视频/音频并发下载后把合并交给合并池，返回其 Future
+        resolve(cid) -> (video_url, audio_url 或 None)
+        """
+        output_dir = Path(output_dir)
+        cid = page["cid"]
+        safe_title = safe_filename(page["part"])
+        print(f"\n开始下载分P: {page['part']} (CID={cid})")
+        video_url, audio_url = resolve(cid)
+        output_path = output_dir / f"{safe_title}.mp4"
+
+        if not audio_url:
+            self.download(video_url, str(output_path), f"{safe_title}")
+            print(f"下载完成: {output_path.name}")
+            return None
+
+        video_file = output_dir / f"{safe_title}_video.mp4"
+        audio_file = output_dir / f"{safe_title}_audio.mp4"
+        downloads = [self._download_pool.submit(self.download, video_url, str(video_file), f"{safe_title} - 视频"),
+                     self._download_pool.submit(self.download, audio_url, str(audio_file), f"{safe_title} - 音频")]
+        for future in downloads:
+            future.result()
+
+        self._pending.acquire()
+        try:
+            return self._merge_pool.submit(self._merge_part, video_file, audio_file, output_path)
+        except BaseException:
+            self._pending.release()
+            raise
+
+
+def resolve_hosts(api, parts) -> dict:
+    """并发解析 parts([(bvid, cid)]) 的播放地址，返回 {(bvid, cid): 视频地址的主机}；
+    结果进 BiliAPI 缓存，下载时直接命中；解析失败的记为 FALLBACK_HOST
+    """
+    def host_of(part):
+        try:
+            video_url, _ = api.get_playurl(*part)
+            return urlsplit(video_url).netloc.lower() or FALLBACK_HOST
+        except Exception:
+            return FALLBACK_HOST
+
+    parts = list(parts)
+    with ThreadPoolExecutor(max_workers=API_WORKERS) as executor:
+        return dict(zip(parts, executor.map(host_of, parts)))
+
+
+def download_batch(bvids, headers, download, merge, budget: int = CONNECTION_BUDGET, host_limits: dict = None,
+                   journal: str = JOURNAL_FILE, priorities: dict = None, output_root=".",
+                   merge_workers: int = MERGE_WORKERS, auth=None) -> dict:
+    """
+    多个视频的所有分P放进同一个全局队列，总连接数不超过 budget
+    auth: 接口请求的 requests 认证钩子(如 CookieProvider.auth，按请求读取最新 Cookie)
+    priorities: {bvid: 优先级}，数字小的先下；未给出时按 bvids 顺序
+    journal: 任务日志路径，已完成且输出文件仍在的分P重跑时跳过
+    返回 {"bvid:cid": None(成功) 或 异常}，分P列表取不到的视频记为 {bvid: 异常}
+    """
+    api = get_api(headers, auth)
+    pagelists = api.get_pagelists(bvids)
+    priorities = priorities or {}
+    part_cost = 2 * CONNECTIONS
+    queue = JobQueue(budget, HOST_LIMITS if host_limits is None else host_limits,
+                     default_host_limit=DEFAULT_HOST_LIMIT, journal=journal)
+    results = {}
+    jobs = []
+
+    # 同时在下载的分P数最多 budget // part_cost，下载池按此配足线程
+    download_workers = 2 * max(1, budget // part_cost)
+    with PartPipeline(download, merge, download_workers, merge_workers) as pipeline:
+        for order, bvid in enumerate(dict.fromkeys(bvids)):
+            pages = pagelists.get(bvid)
+            if isinstance(pages, Exception):
+                print(f"获取 {bvid} 的分P列表失败: {pages}")
+                results[bvid] = pages
+                continue
+            output_dir = Path(output_root) / bvid
+            output_dir.mkdir(parents=True, exist_ok=True)
+
+            def resolve(cid, bvid=bvid):
+                return api.get_playurl(bvid, cid)
+
+            for page in pages:
+                output_path = output_dir / f"{safe_filename(page['part'])}.mp4"
+                jobs.append(((bvid, page['cid']),
+                             Job(f"{bvid}:{page['cid']}",
+                                 lambda page=page, output_dir=output_dir, resolve=resolve:
+                                 pipeline.fetch_part(page, output_dir, resolve),
+                                 priority=priorities.get(bvid, order), cost=part_cost,
+                                 output=str(output_path), desc=f"{bvid} {page['part']}")))
+
+        # 已完成的分P不解析地址，直接交给 submit 跳过
+        hosts = resolve_hosts(api, [part for part, job in jobs if not queue.is_done(job)])
+        for part, job in jobs:
+            job.host = hosts.get(part, FALLBACK_HOST)
+            queue.submit(job)
+        if queue.skipped:
+            print(f"任务日志中已完成 {len(queue.skipped)} 个分P，跳过。")
+        results.update(queue.run())
+    return results
@@ -0,0 +1,239 @@
+"""
+B 站 Cookie 提供者：各下载脚本共用一个本地 cookie 存储，尽量不在每次运行时启动浏览器
+- 存储按每个 cookie 自己的过期时间(浏览器给出的 expiry)判断是否可用；会话 cookie 没有 expiry，按 SESSION_COOKIE_TTL 计；
+  是否需要刷新只看 REQUIRED_COOKIES 中存在的那些(登录态/设备标识)，统计类 cookie 过期只会被丢弃，不触发刷新
+- 同步刷新和后台刷新都受 MIN_REFRESH_INTERVAL 限制：刚刷新过仍不可用时直接报错，不会每个请求都启动一次浏览器
+- 最早的过期时间前 REFRESH_AHEAD 秒开始在后台线程刷新，前台继续用当前 cookie；
+  只有存储为空或已有 cookie 过期时才同步等待刷新
+- 来源可替换：SeleniumCookieSource 启动无头 Chrome，StaticCookieSource 用于测试或手动粘贴的 cookie
+- 兼容旧的 {"cookie": 字符串, "timestamp": 时间} 格式
+- provider.auth 可设为 Session.auth：每个请求发出时才读取当前 Cookie，后台刷新后的 cookie 对之后的请求立即生效
+"""
+import json
+import os
+import threading
+import time
+
+from requests.auth import AuthBase
+
+from stock_cache import atomic_write_json
+
+COOKIE_STORE = "bilibili_cookie.json"
+SESSION_COOKIE_TTL = 8 * 3600   # 会话 cookie(无 expiry)的有效期，与原来的 8 小时一致
+REFRESH_AHEAD = 30 * 60         # 提前 30 分钟后台刷新
+MIN_REFRESH_INTERVAL = 60       # 两次刷新的最短间隔，防止 cookie 有效期短于 REFRESH_AHEAD 或来源异常时每次取用都刷新
+REQUIRED_COOKIES = ("SESSDATA", "bili_jct", "DedeUserID", "buvid3")  # 决定是否需要刷新的 cookie；都不存在时看全部
+
+
+class SeleniumCookieSource:
+    """无头 Chrome 打开页面后读取浏览器的 cookie(含 expiry)"""
+    name = "selenium"
+
+    def __init__(self, url: str = "https://www.bilibili.com/", wait: int = 5):
+        self.url = url
+        self.wait = wait
+
+    def fetch(self) -> list:
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+
+        chrome_options = Options()
+        chrome_options.add_argument('--headless')
+        chrome_options.add_argument('--disable-gpu')
+        chrome_options.add_argument('--no-sandbox')
+        driver = webdriver.Chrome(options=chrome_options)
+        try:
+            driver.get(self.url)
+            driver.implicitly_wait(self.wait)
+            return driver.get_cookies()
+        finally:
+            driver.quit()
+
+
+class StaticCookieSource:
+    """固定的 cookie：列表 [{'name', 'value', 'expiry'(可选)}] 或 'a=1; b=2' 形式的字符串"""
+    name = "static"
+
+    def __init__(self, cookies):
+        self.cookies = parse_cookie_string(cookies) if isinstance(cookies, str) else list(cookies)
+        self.calls = 0
+
+    def fetch(self) -> list:
+        self.calls += 1
+        return [dict(c) for c in self.cookies]
+
+
+def parse_cookie_string(cookie_str: str) -> list:
+    cookies = []
+    for part in cookie_str.split(';'):
+        name, sep, value = part.strip().partition('=')
+        if sep and name:
+            cookies.append({'name': name, 'value': value})
+    return cookies
+
+
+class CookieProvider:
+    """线程安全；存储文件被其他脚本刷新后(mtime 变化)自动重新读取"""
+
+    def __init__(self, source=None, store_path: str = COOKIE_STORE, session_ttl: float = SESSION_COOKIE_TTL,
+                 refresh_ahead: float = REFRESH_AHEAD, background: bool = True, clock=time.time,
+                 min_interval: float = MIN_REFRESH_INTERVAL, required=REQUIRED_COOKIES):
+        self.source = source or SeleniumCookieSource()
+        self.store_path = store_path
+        self.session_ttl = session_ttl
+        self.refresh_ahead = refresh_ahead
+        self.background = background
+        self.clock = clock
+        self.min_interval = min_interval
+        self.required = set(required or ())
+        self.refreshes = 0
+        self.auth = ProviderCookieAuth(self)
+        self._last_refresh = None
+        self._cookies = []
+        self._mtime = None
+        self._timer = None
+        self._refreshing = False
+        self._lock = threading.RLock()
+
+    # ---------- 存储 ----------
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.store_path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.store_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._mtime = mtime
+        if 'cookies' in data:
+            self._cookies = data['cookies']
+        elif 'cookie' in data:
+            # 旧格式：整串 cookie + 获取时间，全部按会话 cookie 处理
+            fetched_at = data.get('timestamp', 0)
+            self._cookies = [dict(c, expiry=fetched_at + self.session_ttl)
+                             for c in parse_cookie_string(data['cookie'])]
+
+    def _save(self):
+        atomic_write_json(self.store_path, {'source': self.source.name, 'fetched_at': self.clock(),
+                                            'cookies': self._cookies})
+        self._mtime = os.path.getmtime(self.store_path)
+
+    # ---------- 过期 ----------
+    def _valid(self, now: float) -> list:
+        return [c for c in self._cookies if c['expiry'] > now]
+
+    def _relevant(self) -> list:
+        named = [c for c in self._cookies if c['name'] in self.required]
+        return named or self._cookies
+
+    def earliest_expiry(self):
+        """决定刷新时机的 cookie(见 REQUIRED_COOKIES)中最早的过期时间，没有 cookie 时返回 None"""
+        with self._lock:
+            return min((c['expiry'] for c in self._relevant()), default=None)
+
+    # ---------- 刷新 ----------
+    def refresh(self):
+        """从来源重新获取，写回存储并安排下一次后台刷新"""
+        with self._lock:
+            self._last_refresh = self.clock()
+        cookies = self.source.fetch()
+        if not cookies:
+            raise RuntimeError(f"Cookie 来源({self.source.name})没有返回任何 cookie")
+        now = self.clock()
+        normalized = []
+        for c in cookies:
+            expiry = c.get('expiry')
+            normalized.append({'name': c['name'], 'value': c['value'],
+                               'expiry': float(expiry) if expiry else now + self.session_ttl})
+        with self._lock:
+            self._cookies = normalized
+            self.refreshes += 1
+            self._save()
+            self._schedule()
+
+    def _schedule(self):
+        if not self.background:
+            return
+        expiry = self.earliest_expiry()
+        if expiry is None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        delay = max(self.min_interval, expiry - self.refresh_ahead - self.clock())
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refreshed_recently(self) -> bool:
+        return self._last_refresh is not None and self.clock() - self._last_refresh < self.min_interval
+
+    def _background_refresh(self):
+        with self._lock:
+            if self._refreshing or self._refreshed_recently():
+                return
+            self._refreshing = True
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"后台刷新 Cookie 失败，继续使用当前 Cookie: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    # ---------- 对外 ----------
+    def cookies(self) -> list:
+        """当前可用的 cookie；存储为空或关键 cookie 已过期时同步刷新，临近过期时后台刷新
+        距上次刷新不足 min_interval 时不再同步刷新，直接抛 RuntimeError
+        """
+        with self._lock:
+            self._load()
+            now = self.clock()
+            expiry = self.earliest_expiry()
+            if expiry is None or expiry <= now:
+                if self._refreshed_recently():
+                    raise RuntimeError(f"Cookie 在 {self.min_interval:.0f} 秒内刚刷新过，仍没有可用的 cookie")
+                self.refresh()
+            elif expiry - self.refresh_ahead <= now and self.background and not self._refreshing \
+                    and not self._refreshed_recently():
+                threading.Thread(target=self._background_refresh, daemon=True).start()
+            elif self._timer is None:
+                self._schedule()
+            return self._valid(self.clock())
+
+    def cookie_header(self) -> str:
+        return '; '.join(f"{c['name']}={c['value']}" for c in self.cookies())
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+
+class ProviderCookieAuth(AuthBase):
+    """requests 认证钩子：请求发出前写入 provider 当前的 Cookie 头"""
+
+    def __init__(self, provider: CookieProvider):
+        self.provider = provider
+
+    def __call__(self, r):
+        r.headers['Cookie'] = self.provider.cookie_header()
+        return r
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(source=None, store_path: str = COOKIE_STORE) -> CookieProvider:
+    """同一个存储文件在进程内共用一个 CookieProvider"""
+    with _providers_lock:
+        provider = _providers.get(store_path)
+        if provider is None:
+            provider = CookieProvider(source, store_path)
+            _providers[store_path] = provider
+        return provider
@@ -2,8 +2,13 @@ import requests
 from multiprocessing import Pool
 import re
 import os
+import shutil
 from tqdm import tqdm
-from Crypto.Cipher import AES
+
+from download_metrics import metrics
+from hls_crypto import decrypt_cbc, sequence_iv
+from hls_playlist import parse_playlist
+from segment_downloader import stream_segments
 
 # 创建临时文件夹
 dirs = 'ts_list_need_to_merge/'
@@ -43,37 +48,37 @@ def parse_m3u8_text(m3u8_text):
     return method, key_url, ts_list
 
 
-def decrypt_content_and_save_file(filename, content, decrypter):
+def decrypt_content_and_save_file(filename, content, key, iv):
     with open(filename, mode='wb') as f:
-        f.write(decrypter.decrypt(content))
+        f.write(decrypt_cbc(key, iv, content))
 
 
 def merge_ts_to_mp4(filename, ts_file_list):
     with open(filename, mode='ab') as f1:
         for ts_file in ts_file_list:
             with open(ts_file, mode='rb') as f2:
-                f1.write(f2.read())
+                shutil.copyfileobj(f2, f1, 1024 * 1024)
     print(filename, '完成！')
 
 
-def process_one_url(ts_url, key):
-    decrypter = AES.new(key, AES.MODE_CBC)
+def process_one_url(ts_url, key, iv):
+    # iv: 播放列表没给 IV 时为媒体序号(见 hls_crypto.sequence_iv)
     filename = dirs + os.path.split(ts_url)[-1]
     content = requests.get(ts_url, headers=headers).content
-    decrypt_content_and_save_file(filename, content, decrypter)
+    decrypt_content_and_save_file(filename, content, key, iv)
     return filename
 
 
-def download_method_1(ts_list, key):
+def download_method_1(ts_list, key, media_sequence=0):
     # 普通次序一个一个下载，耗时11分钟
     ts_file_list = []
-    for ts_url in tqdm(ts_list):
-        filename = process_one_url(ts_url=ts_url, key=key)
+    for idx, ts_url in enumerate(tqdm(ts_list)):
+        filename = process_one_url(ts_url=ts_url, key=key, iv=sequence_iv(media_sequence + idx))
         ts_file_list.append(filename)
     return ts_file_list
 
 
-def download_method_2(ts_list, key, processes_nums=2):
+def download_method_2(ts_list, key, processes_nums=2, media_sequence=0):
     # 多进程下载， 耗时1分钟
     class CallBack:
         def __init__(self, nums) -> None:
@@ -86,14 +91,26 @@ def download_method_2(ts_list, key, processes_nums=2):
 
     callback = CallBack(len(ts_list))
     pool = Pool(processes=processes_nums)
-    for ts_url in ts_list:
-        pool.apply_async(process_one_url, (ts_url, key), error_callback=print, callback=callback.callback)
+    for idx, ts_url in enumerate(ts_list):
+        pool.apply_async(process_one_url, (ts_url, key, sequence_iv(media_sequence + idx)), error_callback=print,
+                         callback=callback.callback)
     pool.close()
     pool.join()
     callback.pbar.close()
     return [dirs + os.path.split(ts_url)[-1] for ts_url in ts_list]
 
 
+def download_and_merge(ts_list, key, filename, media_sequence=0, workers=10, buffer_segments=None, decrypt_workers=2):
+    # 线程池并发下载，解密在单独的线程池里按媒体序号生成 IV，按顺序直接追加到 filename，不落临时分段文件
+    def decrypt(idx, content):
+        return decrypt_cbc(key, sequence_iv(media_sequence + idx), content)
+
+    stream_segments(ts_list, filename, transform=decrypt, headers=headers, workers=workers,
+                    buffer_segments=buffer_segments, transform_workers=decrypt_workers)
+    print(filename, '完成！')
+    return filename
+
+
 if __name__ == "__main__":
     m3u8_url = 'https://play.bo262626.com/20231108/xV1bY9Cn/700kb/hls/index.m3u8'
     response = requests.get(m3u8_url, headers=headers)
@@ -104,6 +121,6 @@ if __name__ == "__main__":
     ts_list = ['https://play.bo262626.com' + item for item in ts_list]
 
     key = requests.get(key_url, headers=headers).content
-    ts_file_list = download_method_2(ts_list, key=key, processes_nums=10)
-
-    merge_ts_to_mp4('test.mp4', ts_file_list)
+    media_seq = parse_playlist(m3u8).media_sequence
+    download_and_merge(ts_list, key=key, filename='test.mp4', media_sequence=media_seq, workers=10)
+    metrics.report()
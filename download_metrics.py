@@ -0,0 +1,267 @@
+"""
+下载指标：各下载器共用的进程内记录器(线程安全)
+- metrics.request(url): 记录一次 HTTP 请求的字节数、首包耗时、总耗时、urllib3 重试次数与失败原因
+- metrics.stage(name): 记录 ffmpeg 合并、解密等非网络阶段的耗时
+- metrics.report(): 运行结束时打印汇总(总吞吐 MB/s、按主机的请求数/失败/重试/延迟、网络与各阶段的占用时间)，
+  并可把每条记录和汇总写成 JSON lines(参数 jsonl_path 或环境变量 DOWNLOAD_METRICS_LOG)
+- _bench(): 起一个本地 HTTP 测试服务器，对分块下载和分段下载在不同并发下跑一遍并输出报告
+注意：multiprocessing 子进程里的记录不会汇总回主进程
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+METRICS_LOG_ENV = 'DOWNLOAD_METRICS_LOG'
+
+
+class RequestRecord:
+    def __init__(self, url: str):
+        self.url = url
+        self.host = urlsplit(url).netloc
+        self.start = time.time()
+        self.ttfb = None
+        self.status = None
+        self.retries = 0
+        self.bytes = 0
+
+    def response(self, resp):
+        """拿到响应头时调用：记首包耗时、状态码和 urllib3 自动重试的次数"""
+        self.ttfb = time.time() - self.start
+        self.status = resp.status_code
+        retries = getattr(getattr(resp, 'raw', None), 'retries', None)
+        history = getattr(retries, 'history', None)
+        self.retries = len(history) if history else 0
+
+    def add_bytes(self, n: int):
+        self.bytes += n
+
+
+def _busy_seconds(intervals) -> float:
+    """区间并集的总长：并发请求重叠的时间只算一次"""
+    total = 0.0
+    end = None
+    for s, e in sorted(intervals):
+        if end is None or s > end:
+            total += e - s
+            end = e
+        elif e > end:
+            total += e - end
+            end = e
+    return total
+
+
+def _percentile(values, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class DownloadMetrics:
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.events = []
+
+    def _add(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def request(self, url: str):
+        rec = RequestRecord(url)
+        error = None
+        try:
+            yield rec
+        except BaseException as e:
+            error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            end = time.time()
+            self._add({'type': 'request', 'url': rec.url, 'host': rec.host, 'start': rec.start, 'end': end,
+                       'seconds': end - rec.start, 'ttfb': rec.ttfb, 'status': rec.status, 'bytes': rec.bytes,
+                       'retries': rec.retries, 'ok': error is None, 'error': error})
+
+    @contextmanager
+    def stage(self, name: str, detail: str = None):
+        start = time.time()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            end = time.time()
+            self._add({'type': 'stage', 'stage': name, 'detail': detail, 'start': start, 'end': end,
+                       'seconds': end - start, 'ok': error is None, 'error': error})
+
+    def summary(self) -> dict:
+        with self._lock:
+            events = list(self.events)
+        requests_ = [e for e in events if e['type'] == 'request']
+        stages = [e for e in events if e['type'] == 'stage']
+        total_bytes = sum(e['bytes'] for e in requests_)
+        network_busy = _busy_seconds((e['start'], e['end']) for e in requests_)
+        wall = (max(e['end'] for e in events) - min(e['start'] for e in events)) if events else 0.0
+
+        hosts = {}
+        for e in requests_:
+            h = hosts.setdefault(e['host'], {'requests': 0, 'failures': 0, 'retries': 0, 'bytes': 0,
+                                             'ttfb': [], 'intervals': []})
+            h['requests'] += 1
+            h['failures'] += not e['ok']
+            h['retries'] += e['retries']
+            h['bytes'] += e['bytes']
+            if e['ttfb'] is not None:
+                h['ttfb'].append(e['ttfb'])
+            h['intervals'].append((e['start'], e['end']))
+        per_host = {}
+        for host, h in sorted(hosts.items()):
+            busy = _busy_seconds(h['intervals'])
+            per_host[host] = {
+                'requests': h['requests'], 'failures': h['failures'], 'retries': h['retries'],
+                'mb': h['bytes'] / 1e6, 'mb_per_s': h['bytes'] / 1e6 / busy if busy else 0.0,
+                'ttfb_avg': sum(h['ttfb']) / len(h['ttfb']) if h['ttfb'] else None,
+                'ttfb_p95': _percentile(h['ttfb'], 0.95),
+            }
+
+        per_stage = {}
+        for name in sorted({e['stage'] for e in stages}):
+            items = [e for e in stages if e['stage'] == name]
+            per_stage[name] = {'count': len(items), 'failures': sum(not e['ok'] for e in items),
+                               'seconds': sum(e['seconds'] for e in items),
+                               'busy_seconds': _busy_seconds((e['start'], e['end']) for e in items)}
+
+        return {'wall_seconds': wall, 'requests': len(requests_), 'failures': sum(not e['ok'] for e in requests_),
+                'retries': sum(e['retries'] for e in requests_), 'mb': total_bytes / 1e6,
+                'network_busy_seconds': network_busy,
+                'mb_per_s': total_bytes / 1e6 / network_busy if network_busy else 0.0,
+                'hosts': per_host, 'stages': per_stage}
+
+    def format_report(self, summary: dict = None) -> str:
+        s = summary or self.summary()
+        lines = [f"下载统计: {s['requests']} 个请求, 失败 {s['failures']}, 重试 {s['retries']}, "
+                 f"{s['mb']:.1f} MB, 网络占用 {s['network_busy_seconds']:.1f}s, 平均 {s['mb_per_s']:.2f} MB/s, "
+                 f"总耗时 {s['wall_seconds']:.1f}s"]
+        for host, h in s['hosts'].items():
+            ttfb = f"首包 平均 {h['ttfb_avg'] * 1000:.0f}ms / p95 {h['ttfb_p95'] * 1000:.0f}ms" \
+                if h['ttfb_avg'] is not None else "首包 -"
+            lines.append(f"  {host}: {h['requests']} 请求, 失败 {h['failures']}, 重试 {h['retries']}, "
+                         f"{h['mb']:.1f} MB, {h['mb_per_s']:.2f} MB/s, {ttfb}")
+        for name, st in s['stages'].items():
+            lines.append(f"  [{name}] {st['count']} 次, 失败 {st['failures']}, 累计 {st['seconds']:.1f}s, "
+                         f"占用 {st['busy_seconds']:.1f}s")
+        return '\n'.join(lines)
+
+    def write_jsonl(self, path: str, summary: dict = None):
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'a', encoding='utf-8') as f:
+            for e in events:
+                f.write(json.dumps(e, ensure_ascii=False) + '\n')
+            f.write(json.dumps(dict(summary or self.summary(), type='summary', time=time.time()),
+                               ensure_ascii=False) + '\n')
+
+    def report(self, jsonl_path: str = None) -> dict:
+        """打印汇总；给了 jsonl_path(或设置了 DOWNLOAD_METRICS_LOG)时追加写入明细和汇总，返回汇总 dict"""
+        summary = self.summary()
+        if summary['requests'] or summary['stages']:
+            print(self.format_report(summary))
+        jsonl_path = jsonl_path or os.environ.get(METRICS_LOG_ENV)
+        if jsonl_path:
+            self.write_jsonl(jsonl_path, summary)
+        return summary
+
+
+metrics = DownloadMetrics()
+
+
+def start_fixture_server(file_size: int = 32 * 1024 * 1024, segment_size: int = 1024 * 1024, latency: float = 0.02,
+                         rate: float = None):
+    """本地测试服务器：/file 支持 Range，/seg/<n>.ts 为固定大小分段；latency 为每个请求的首包延迟，
+    rate 为单连接限速(字节/秒，None 不限)。返回 (server, base_url)，用完调用 server.shutdown()
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    payload = os.urandom(file_size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            time.sleep(latency)
+            path = self.path.split('?')[0]
+            status, extra = 200, {}
+            if path == '/file':
+                body = payload
+                rng = self.headers.get('Range')
+                if rng and rng.startswith('bytes='):
+                    start, _, end = rng[6:].partition('-')
+                    start, end = int(start), int(end) if end else file_size - 1
+                    body = payload[start:end + 1]
+                    status, extra = 206, {'Content-Range': f'bytes {start}-{end}/{file_size}'}
+            elif path.startswith('/seg/'):
+                n = int(path[5:].split('.')[0])
+                offset = (n * segment_size) % max(1, file_size - segment_size)
+                body = payload[offset:offset + segment_size]
+            else:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            for k, v in extra.items():
+                self.send_header(k, v)
+            self.end_headers()
+            view = memoryview(body)
+            step = 256 * 1024
+            for i in range(0, len(view), step):
+                self.wfile.write(view[i:i + step])
+                if rate:
+                    time.sleep(step / rate)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def _bench(file_mb: int = 32, segments: int = 64, latency: float = 0.02, rate: float = 16e6):
+    """本地服务器上比较 1 个与多个连接时分块下载/分段下载的吞吐，每组输出一份指标报告"""
+    import tempfile
+
+    from ranged_download import download_ranged
+    from segment_downloader import stream_segments
+
+    server, base = start_fixture_server(file_mb * 1024 * 1024, latency=latency, rate=rate)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for connections in (1, 4):
+                metrics.reset()
+                download_ranged(f'{base}/file', os.path.join(tmp, f'file_{connections}.bin'),
+                                connections=connections, piece_size=4 * 1024 * 1024, progress=False)
+                print(f'--- 分块下载 connections={connections}')
+                metrics.report()
+            urls = [f'{base}/seg/{i}.ts' for i in range(segments)]
+            for workers in (1, 8):
+                metrics.reset()
+                stream_segments(urls, os.path.join(tmp, f'seg_{workers}.ts'), workers=workers, progress=False)
+                print(f'--- 分段下载 workers={workers}')
+                metrics.report()
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    _bench()
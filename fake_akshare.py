@@ -0,0 +1,242 @@
+"""
+离线假 akshare 模块：用确定性随机数生成行情/财务/行业数据，接口签名与 akshare 保持一致，
+用于在无网络环境下跑通 stock_strategy 并做性能对比。
+
+启用方式: 设置环境变量 STOCK_FAKE_AKSHARE=1 后运行 stock_strategy.py
+模拟网络延迟: FAKE_AKSHARE_LATENCY=0.2 (秒/次调用，默认 0.2，接近真实接口耗时)
+模拟盘中变化: FAKE_AKSHARE_TICKS=1 时每次拉取实时快照都会随机改动一小部分股票的价量
+直接运行本文件: 对比串行与并发预取两种精选路径的耗时并校验输出一致
+"""
+import os
+import time
+import zlib
+from datetime import datetime
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+LATENCY = float(os.environ.get('FAKE_AKSHARE_LATENCY', '0.2'))
+TICKS = bool(os.environ.get('FAKE_AKSHARE_TICKS'))
+UNIVERSE_SIZE = 1700
+CANDIDATE_EVERY = 25  # 每 25 只构造一只能通过初筛的股票
+BASE_DATE = datetime(2020, 1, 1)
+SECTORS = [(f"BK{1000 + i}", f"行业{i}") for i in range(20)]
+
+
+def _sleep():
+    if LATENCY > 0:
+        time.sleep(LATENCY)
+
+
+def _rng(*keys):
+    seed = zlib.crc32('|'.join(str(k) for k in keys).encode('utf-8'))
+    return np.random.default_rng(seed)
+
+
+def _codes():
+    prefixes = ['600', '601', '603', '605']
+    codes = []
+    for i in range(UNIVERSE_SIZE):
+        codes.append(f"{prefixes[i % 4]}{i // 4:03d}")
+    return codes
+
+
+@lru_cache(maxsize=4)
+def _trade_days(end_date):
+    return pd.bdate_range(BASE_DATE, end_date)
+
+
+def _ohlcv(key, start_price):
+    days = _trade_days(datetime.now().date())
+    rng = _rng('ohlcv', key)
+    rets = rng.normal(0.0006, 0.018, len(days))
+    close = start_price * np.exp(np.cumsum(rets))
+    high = close * (1 + rng.uniform(0, 0.02, len(days)))
+    low = close * (1 - rng.uniform(0, 0.02, len(days)))
+    open_ = low + (high - low) * rng.uniform(0, 1, len(days))
+    volume = rng.integers(50_000, 500_000, len(days)).astype(float)
+    return days, open_, high, low, close, volume
+
+
+def _slice_dates(df, date_col, start_date, end_date):
+    dates = pd.to_datetime(df[date_col])
+    mask = np.ones(len(df), dtype=bool)
+    if start_date:
+        mask &= dates >= pd.to_datetime(start_date)
+    if end_date:
+        mask &= dates <= pd.to_datetime(end_date)
+    return df[mask].reset_index(drop=True)
+
+
+def stock_zh_a_spot_em():
+    _sleep()
+    rng = _rng('spot', datetime.now().strftime('%Y%m%d'))
+    codes = _codes()
+    n = len(codes)
+    price = rng.uniform(5, 60, n).round(2)
+    change = rng.normal(0.5, 3.0, n).round(2)
+    volume_ratio = rng.uniform(0.3, 3.0, n).round(2)
+    turnover = rng.uniform(0.5, 20.0, n).round(2)
+    mv = rng.uniform(10e8, 500e8, n)
+    low = price * (1 - rng.uniform(0, 0.05, n))
+    high = price * (1 + rng.uniform(0, 0.05, n))
+    for i in range(0, n, CANDIDATE_EVERY):
+        change[i] = round(rng.uniform(2.5, 6.5), 2)
+        volume_ratio[i] = round(rng.uniform(1.2, 2.5), 2)
+        turnover[i] = round(rng.uniform(6.0, 12.0), 2)
+        mv[i] = rng.uniform(60e8, 180e8)
+        low[i] = price[i] * 0.96
+        high[i] = price[i] * 1.005
+    volume = rng.integers(50_000, 800_000, n).astype(float)
+    if TICKS:
+        _tick(price, change, volume_ratio, turnover, volume)
+    return pd.DataFrame({
+        '序号': np.arange(1, n + 1),
+        '代码': codes,
+        '名称': [f"股票{c}" for c in codes],
+        '最新价': price,
+        '涨跌幅': change,
+        '成交量': volume,
+        '成交额': volume * price * 100,
+        '最高': high.round(2),
+        '最低': low.round(2),
+        '量比': volume_ratio,
+        '换手率': turnover,
+        '流通市值': mv,
+        '总市值': mv * 1.2,
+    })
+
+
+_spot_calls = [0]
+
+
+def _tick(price, change, volume_ratio, turnover, volume, ratio=0.03):
+    """第 k 次快照在基础快照上累积 k 轮随机扰动，每轮改动约 3% 的股票"""
+    _spot_calls[0] += 1
+    for k in range(1, _spot_calls[0]):
+        rng = _rng('tick', k)
+        idx = rng.choice(len(price), max(1, int(len(price) * ratio)), replace=False)
+        move = rng.normal(0, 0.8, len(idx))
+        change[idx] = (change[idx] + move).round(2)
+        price[idx] = (price[idx] * (1 + move / 100)).round(2)
+        volume_ratio[idx] = (volume_ratio[idx] * rng.uniform(1.0, 1.1, len(idx))).round(2)
+        turnover[idx] = (turnover[idx] * rng.uniform(1.0, 1.1, len(idx))).round(2)
+        volume[idx] *= rng.uniform(1.0, 1.1, len(idx))
+
+
+def stock_zh_a_hist(symbol, period='daily', start_date=None, end_date=None, adjust=''):
+    _sleep()
+    rng = _rng('base', symbol)
+    days, open_, high, low, close, volume = _ohlcv(symbol, rng.uniform(5, 60))
+    prev = np.concatenate([[close[0]], close[:-1]])
+    df = pd.DataFrame({
+        '日期': days.strftime('%Y-%m-%d'),
+        '股票代码': symbol,
+        '开盘': open_.round(2),
+        '收盘': close.round(2),
+        '最高': high.round(2),
+        '最低': low.round(2),
+        '成交量': volume,
+        '成交额': (volume * close * 100).round(2),
+        '振幅': ((high - low) / prev * 100).round(2),
+        '涨跌幅': ((close / prev - 1) * 100).round(2),
+        '涨跌额': (close - prev).round(2),
+        '换手率': rng.uniform(0.5, 15, len(days)).round(2),
+    })
+    return _slice_dates(df, '日期', start_date, end_date)
+
+
+def stock_financial_analysis_indicator(symbol, start_year=None):
+    _sleep()
+    rng = _rng('fund', symbol)
+    dates = [f"{y}-{md}" for y in (2023, 2024) for md in ('03-31', '06-30', '09-30', '12-31')]
+    return pd.DataFrame({
+        '日期': dates,
+        '净资产收益率加权(%)': rng.uniform(0, 25, len(dates)).round(2),
+        '销售净利率(%)': rng.uniform(-5, 30, len(dates)).round(2),
+    })
+
+
+def stock_zh_index_daily(symbol):
+    _sleep()
+    key = symbol.replace('sh', '').replace('sz', '')
+    days, open_, high, low, close, volume = _ohlcv('index' + key, 3000.0)
+    return pd.DataFrame({
+        'date': days.strftime('%Y-%m-%d'),
+        'open': open_.round(2),
+        'high': high.round(2),
+        'low': low.round(2),
+        'close': close.round(2),
+        'volume': volume * 1000,
+    })
+
+
+def index_zh_a_hist(symbol, period='daily', start_date=None, end_date=None):
+    df = stock_zh_index_daily(symbol)
+    df = df.rename(columns={'date': '日期', 'open': '开盘', 'high': '最高', 'low': '最低',
+                            'close': '收盘', 'volume': '成交量'})
+    return _slice_dates(df, '日期', start_date, end_date)
+
+
+def stock_board_industry_spot_em():
+    _sleep()
+    rng = _rng('sector', datetime.now().strftime('%Y%m%d'))
+    return pd.DataFrame({
+        '排名': np.arange(1, len(SECTORS) + 1),
+        '板块名称': [name for _, name in SECTORS],
+        '板块代码': [code for code, _ in SECTORS],
+        '涨跌幅': rng.normal(0.5, 1.5, len(SECTORS)).round(2),
+    })
+
+
+def stock_board_industry_cons_em(symbol):
+    _sleep()
+    idx = [code for code, _ in SECTORS].index(symbol) if symbol in [c for c, _ in SECTORS] else 0
+    codes = [c for i, c in enumerate(_codes()) if i % CANDIDATE_EVERY == 0 or i % len(SECTORS) == idx]
+    return pd.DataFrame({'代码': codes, '名称': [f"股票{c}" for c in codes]})
+
+
+def index_stock_cons(symbol):
+    _sleep()
+    codes = _codes()[::5]
+    return pd.DataFrame({'品种代码': codes, '品种名称': [f"股票{c}" for c in codes]})
+
+
+def tool_trade_date_hist_sina():
+    _sleep()
+    days = pd.bdate_range(BASE_DATE, pd.Timestamp.today() + pd.Timedelta(days=365))
+    return pd.DataFrame({'trade_date': days.date})
+
+
+def _bench_prefetch():
+    """串行 vs 并发预取 vs 本地仓库二次运行: 耗时对比 + 输出一致性校验"""
+    import tempfile
+    os.environ['STOCK_FAKE_AKSHARE'] = '1'
+    import stock_strategy as ss
+    runs = [('串行', False, 'a'), ('并发预取', True, 'b'), ('二次运行(本地仓库)', True, 'b')]
+    results, cost = {}, {}
+    origin = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, enabled, sub in runs:
+            run_dir = os.path.join(tmp, sub)
+            os.makedirs(run_dir, exist_ok=True)
+            os.environ['STOCK_CACHE_DIR'] = run_dir
+            os.chdir(run_dir)
+            try:
+                ss._fundamentals_caches.clear()  # 模拟新进程: 财务缓存重新从磁盘加载
+                ss.CONFIG['prefetch']['enabled'] = enabled
+                t0 = time.perf_counter()
+                results[label] = ss.run_stock_screener()
+                cost[label] = time.perf_counter() - t0
+            finally:
+                os.chdir(origin)
+    base = results['串行']
+    print()
+    for label, _, _ in runs:
+        same = base is not None and base.equals(results[label])
+        print(f"{label}: {cost[label]:.2f}s  输出与串行一致: {same}")
+
+
+if __name__ == '__main__':
+    _bench_prefetch()
@@ -0,0 +1,273 @@
+"""
+HLS 播放列表解析与原生下载：
+- 主播放列表(#EXT-X-STREAM-INF)解析出各码率，按带宽选择
+- 媒体播放列表逐段记录 时长 / 序号 / 密钥(支持 #EXT-X-KEY 轮换与 METHOD=NONE) / IV / #EXT-X-BYTERANGE / #EXT-X-MAP
+- 分段地址不限 .ts 后缀，相对路径按播放列表地址补全
+- download_hls: 解析 + 并发下载 + 按序解密写入单个文件(见 segment_downloader.stream_segments)
+只处理 AES-128 这种公开密钥的整段加密；SAMPLE-AES 等 DRM 方式抛 UnsupportedPlaylist，由调用方回退 ffmpeg
+"""
+import os
+import re
+from urllib.parse import urljoin
+
+from download_metrics import metrics
+from hls_crypto import decrypt_cbc, sequence_iv
+from segment_downloader import make_session, stream_segments
+
+REQUEST_TIMEOUT = 20
+
+_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+class UnsupportedPlaylist(Exception):
+    """播放列表无法原生下载(DRM、直播未结束等)"""
+
+
+def parse_attributes(text: str) -> dict:
+    """解析 METHOD=AES-128,URI="...",IV=0x... 形式的属性列表(引号内可含逗号)"""
+    return {k: v[1:-1] if v.startswith('"') else v for k, v in _ATTR_RE.findall(text)}
+
+
+def parse_byterange(text: str, last_end: int = 0) -> tuple:
+    """'<n>[@<o>]' -> (长度, 起始偏移)；省略偏移时接着上一段的结尾"""
+    length, _, offset = text.partition('@')
+    return int(length), int(offset) if offset else last_end
+
+
+class Key:
+    def __init__(self, method: str, uri: str = None, iv: bytes = None, keyformat: str = None):
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.keyformat = keyformat
+
+    def __repr__(self):
+        return f'Key({self.method}, {self.uri!r}, iv={self.iv.hex() if self.iv else None})'
+
+
+class Segment:
+    def __init__(self, uri: str, duration: float, sequence: int, key: Key = None, byterange: tuple = None,
+                 init_map: tuple = None, discontinuity: bool = False):
+        self.uri = uri
+        self.duration = duration
+        self.sequence = sequence
+        self.key = key
+        self.byterange = byterange        # (长度, 偏移) 或 None
+        self.init_map = init_map          # (uri, byterange) 或 None，fMP4 初始化段
+        self.discontinuity = discontinuity
+
+    @property
+    def iv(self) -> bytes:
+        """未显式给出 IV 时按 HLS 规范用媒体序号(16 字节大端)"""
+        if self.key is None:
+            return None
+        return self.key.iv if self.key.iv is not None else sequence_iv(self.sequence)
+
+    def __repr__(self):
+        return f'Segment({self.sequence}, {self.uri!r}, {self.duration}, key={self.key}, range={self.byterange})'
+
+
+class Variant:
+    def __init__(self, uri: str, bandwidth: int, resolution: str = None, codecs: str = None):
+        self.uri = uri
+        self.bandwidth = bandwidth
+        self.resolution = resolution
+        self.codecs = codecs
+
+    def __repr__(self):
+        return f'Variant({self.bandwidth}, {self.resolution}, {self.uri!r})'
+
+
+class MasterPlaylist:
+    def __init__(self, variants: list):
+        self.variants = variants
+
+    def select(self, max_bandwidth: int = None) -> Variant:
+        """不超过 max_bandwidth 的最高码率；都超过时取最低码率；max_bandwidth 为 None 取最高码率"""
+        if not self.variants:
+            raise UnsupportedPlaylist('主播放列表中没有可用码率')
+        ordered = sorted(self.variants, key=lambda v: v.bandwidth)
+        if max_bandwidth is None:
+            return ordered[-1]
+        within = [v for v in ordered if v.bandwidth <= max_bandwidth]
+        return within[-1] if within else ordered[0]
+
+
+class MediaPlaylist:
+    def __init__(self, segments: list, target_duration: float = None, media_sequence: int = 0,
+                 endlist: bool = False):
+        self.segments = segments
+        self.target_duration = target_duration
+        self.media_sequence = media_sequence
+        self.endlist = endlist
+
+    @property
+    def duration(self) -> float:
+        return sum(s.duration for s in self.segments)
+
+    @property
+    def keys(self) -> list:
+        """按出现顺序去重的密钥列表"""
+        seen = {}
+        for seg in self.segments:
+            if seg.key is not None and seg.key.uri not in seen:
+                seen[seg.key.uri] = seg.key
+        return list(seen.values())
+
+
+def parse_playlist(text: str, base_url: str = ''):
+    """解析 m3u8 文本，返回 MasterPlaylist 或 MediaPlaylist；所有 URI 按 base_url 补全为绝对地址"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or not lines[0].startswith('#EXTM3U'):
+        raise ValueError('不是 m3u8 播放列表')
+
+    if any(line.startswith('#EXT-X-STREAM-INF') for line in lines):
+        variants = []
+        pending = None
+        for line in lines:
+            if line.startswith('#EXT-X-STREAM-INF:'):
+                pending = parse_attributes(line.split(':', 1)[1])
+            elif not line.startswith('#') and pending is not None:
+                variants.append(Variant(urljoin(base_url, line), int(pending.get('BANDWIDTH', 0) or 0),
+                                        pending.get('RESOLUTION'), pending.get('CODECS')))
+                pending = None
+        return MasterPlaylist(variants)
+
+    segments = []
+    media_sequence = 0
+    target_duration = None
+    endlist = False
+    key = None
+    init_map = None
+    duration = 0.0
+    byterange = None
+    discontinuity = False
+    last_end = {}  # uri -> 上一段字节范围结尾，用于省略 @offset 的 BYTERANGE
+    for line in lines:
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            media_sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            target_duration = float(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',', 1)[0] or 0)
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            byterange = line.split(':', 1)[1]
+        elif line.startswith('#EXT-X-DISCONTINUITY') and not line.startswith('#EXT-X-DISCONTINUITY-SEQUENCE'):
+            discontinuity = True
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            method = attrs.get('METHOD', 'NONE')
+            if method == 'NONE':
+                key = None
+            else:
+                iv = attrs.get('IV')
+                if iv:
+                    iv = bytes.fromhex(iv[2:] if iv.lower().startswith('0x') else iv).rjust(16, b'\x00')
+                key = Key(method, urljoin(base_url, attrs['URI']) if attrs.get('URI') else None, iv or None,
+                          attrs.get('KEYFORMAT'))
+        elif line.startswith('#EXT-X-MAP:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            map_range = parse_byterange(attrs['BYTERANGE']) if attrs.get('BYTERANGE') else None
+            init_map = (urljoin(base_url, attrs['URI']), map_range)
+        elif line.startswith('#EXT-X-ENDLIST'):
+            endlist = True
+        elif not line.startswith('#'):
+            uri = urljoin(base_url, line)
+            seg_range = None
+            if byterange is not None:
+                seg_range = parse_byterange(byterange, last_end.get(uri, 0))
+                last_end[uri] = seg_range[1] + seg_range[0]
+            segments.append(Segment(uri, duration, media_sequence + len(segments), key, seg_range, init_map,
+                                    discontinuity))
+            duration, byterange, discontinuity = 0.0, None, False
+    return MediaPlaylist(segments, target_duration, media_sequence, endlist)
+
+
+def load_media_playlist(url: str, session=None, headers: dict = None, max_bandwidth: int = None) -> tuple:
+    """下载并解析播放列表，遇到主播放列表时按带宽选择码率再取一次
+    返回 (MediaPlaylist, 实际使用的播放列表地址)
+    """
+    session = session or make_session(headers)
+    for _ in range(3):  # 主 -> 媒体，最多跟两层
+        with metrics.request(url) as rec:
+            resp = session.get(url, timeout=REQUEST_TIMEOUT)
+            rec.response(resp)
+            resp.raise_for_status()
+            rec.add_bytes(len(resp.content))
+        playlist = parse_playlist(resp.text, resp.url or url)
+        if isinstance(playlist, MediaPlaylist):
+            return playlist, url
+        variant = playlist.select(max_bandwidth)
+        print(f'选择码率: {variant.bandwidth} {variant.resolution or ""} {variant.uri}')
+        url = variant.uri
+    raise UnsupportedPlaylist('主播放列表嵌套过深')
+
+
+def check_supported(playlist: MediaPlaylist):
+    if not playlist.segments:
+        raise UnsupportedPlaylist('播放列表中没有分段')
+    if not playlist.endlist:
+        raise UnsupportedPlaylist('直播流(无 #EXT-X-ENDLIST)')
+    for key in playlist.keys:
+        if key.method != 'AES-128' or not key.uri:
+            raise UnsupportedPlaylist(f'不支持的加密方式: {key.method}')
+
+
+def fetch_keys(playlist: MediaPlaylist, session) -> dict:
+    """每个密钥地址只取一次: {uri: key bytes}"""
+    keys = {}
+    for key in playlist.keys:
+        with metrics.request(key.uri) as rec:
+            resp = session.get(key.uri, timeout=REQUEST_TIMEOUT)
+            rec.response(resp)
+            resp.raise_for_status()
+            rec.add_bytes(len(resp.content))
+        keys[key.uri] = resp.content
+    return keys
+
+
+def decrypt_segment(segment: Segment, content: bytes, keys: dict):
+    """AES-128 整段解密(每段自己的密钥和 IV)，返回去填充后的 memoryview；未加密的分段原样返回"""
+    if segment.key is None:
+        return content
+    return decrypt_cbc(keys[segment.key.uri], segment.iv, content)
+
+
+def download_hls(url: str, out_path: str, session=None, headers: dict = None, workers: int = 8,
+                 max_bandwidth: int = None, buffer_segments: int = None, decrypt_workers: int = 2) -> str:
+    """原生下载 HLS: 选码率 -> 取密钥 -> 并发下载并按序解密写入 out_path(含 #EXT-X-MAP 初始化段)
+    out_path 没有扩展名时按分段格式补 .ts 或 .mp4(fMP4)，返回实际输出路径
+    decrypt_workers: 解密线程数(与下载线程分开)，0 表示在下载线程里直接解密
+    无法原生处理时抛 UnsupportedPlaylist
+    """
+    own_session = session is None
+    if own_session:
+        session = make_session(headers, pool_size=workers)
+    try:
+        playlist, _ = load_media_playlist(url, session, max_bandwidth=max_bandwidth)
+        check_supported(playlist)
+        keys = fetch_keys(playlist, session)
+        if not os.path.splitext(out_path)[1]:
+            out_path += '.mp4' if any(seg.init_map for seg in playlist.segments) else '.ts'
+
+        # 初始化段(fMP4)在其后第一个分段前写入一次；切换 MAP 时再写新的
+        items = []
+        last_map = None
+        for seg in playlist.segments:
+            if seg.init_map is not None and seg.init_map != last_map:
+                items.append((seg.init_map[0], seg.init_map[1], None))
+                last_map = seg.init_map
+            items.append((seg.uri, seg.byterange, seg))
+
+        def transform(i, content):
+            seg = items[i][2]
+            return content if seg is None else decrypt_segment(seg, content, keys)
+
+        print(f'{len(playlist.segments)} 个分段, 时长 {playlist.duration:.0f}s, 密钥 {len(keys)} 个')
+        stream_segments([item[0] for item in items], out_path, transform=transform, session=session,
+                        workers=workers, buffer_segments=buffer_segments, ranges=[item[1] for item in items],
+                        transform_workers=decrypt_workers if keys else None)
+    finally:
+        if own_session:
+            session.close()
+    return out_path
@@ -0,0 +1,167 @@
+"""
+通用任务队列：全局并发预算 + 每个主机的上限 + 优先级 + 持久化任务日志
+- 每个任务声明 cost(占用的连接数)和 host；调度时按 (priority, 提交顺序) 取第一个总预算和主机上限都放得下的任务，
+  小任务可以插进大任务留下的空档，不会出现“一个视频没下完，其余 worker 干等”
+- 任务日志是追加写的 jsonl，记录每个任务的最终状态；中断后用同一个日志重跑，已完成的任务直接跳过
+- 任务函数可以返回 Future(如交给合并池的 ffmpeg)：预算在函数返回时就释放，日志等 Future 完成再记
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, wait
+
+
+class Job:
+    def __init__(self, job_id: str, fn, priority=0, host: str = '', cost: int = 1, output=None, desc: str = None):
+        self.job_id = job_id
+        self.fn = fn
+        self.priority = priority
+        self.host = host
+        self.cost = max(1, cost)
+        self.output = output    # 日志记为完成且该文件存在时才跳过
+        self.desc = desc or job_id
+
+
+class JobJournal:
+    """追加写的任务日志，每行 {"id", "status", "time", ...}，同一 id 以最后一行为准"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self.records[record['id']] = record
+                    except (ValueError, KeyError, TypeError):
+                        continue  # 上次中断时写了半行
+
+    def is_done(self, job_id: str) -> bool:
+        record = self.records.get(job_id)
+        return record is not None and record.get('status') == 'done'
+
+    def record(self, job_id: str, status: str, **extra):
+        record = dict(extra, id=job_id, status=status, time=time.time())
+        with self._lock:
+            self.records[job_id] = record
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+class JobQueue:
+    """
+    budget: 同时占用的连接总数上限
+    host_limits: {host: 上限}，未列出的主机用 default_host_limit(None 表示只受总预算限制)
+    journal: JobJournal 或日志路径，None 表示不持久化
+    """
+
+    def __init__(self, budget: int = 16, host_limits: dict = None, default_host_limit: int = None, journal=None):
+        self.budget = max(1, budget)
+        self.host_limits = dict(host_limits or {})
+        self.default_host_limit = default_host_limit
+        self.journal = JobJournal(journal) if isinstance(journal, str) else journal
+        self.results = {}
+        self.skipped = []
+        self._pending = []
+        self._seq = 0
+        self._used = 0
+        self._host_used = {}
+        self._deferred = []
+        self._cond = threading.Condition()
+
+    def _host_limit(self, host: str) -> int:
+        limit = self.host_limits.get(host, self.default_host_limit)
+        return self.budget if limit is None else max(1, limit)
+
+    def is_done(self, job: Job) -> bool:
+        """日志里已完成且输出文件还在"""
+        return self.journal is not None and self.journal.is_done(job.job_id) \
+            and (job.output is None or os.path.exists(job.output))
+
+    def submit(self, job: Job) -> bool:
+        """加入队列；日志里已完成(且输出文件还在)的任务跳过并返回 False"""
+        if self.is_done(job):
+            self.skipped.append(job.job_id)
+            return False
+        with self._cond:
+            self._pending.append(((job.priority, self._seq), job))
+            self._seq += 1
+            self._pending.sort(key=lambda item: item[0])
+            self._cond.notify_all()
+        return True
+
+    def _cost(self, job: Job) -> int:
+        # 超过预算/主机上限的任务按上限计，保证它能单独运行
+        return min(job.cost, self.budget, self._host_limit(job.host))
+
+    def _take(self):
+        with self._cond:
+            while self._pending:
+                for i, (_, job) in enumerate(self._pending):
+                    cost = self._cost(job)
+                    if self._used + cost <= self.budget and \
+                            self._host_used.get(job.host, 0) + cost <= self._host_limit(job.host):
+                        del self._pending[i]
+                        self._used += cost
+                        self._host_used[job.host] = self._host_used.get(job.host, 0) + cost
+                        return job
+                self._cond.wait()
+            return None
+
+    def _release(self, job: Job):
+        with self._cond:
+            cost = self._cost(job)
+            self._used -= cost
+            self._host_used[job.host] -= cost
+            self._cond.notify_all()
+
+    def _finish(self, job: Job, error):
+        self.results[job.job_id] = error
+        if error is not None:
+            print(f"任务失败 {job.desc}: {error}")
+        if self.journal is not None:
+            if error is None:
+                self.journal.record(job.job_id, 'done', output=str(job.output) if job.output else None)
+            else:
+                self.journal.record(job.job_id, 'failed', error=str(error))
+
+    def _worker(self):
+        while True:
+            job = self._take()
+            if job is None:
+                return
+            try:
+                result = job.fn()
+            except Exception as e:
+                self._finish(job, e)
+            else:
+                if isinstance(result, Future):
+                    # 回调里记完日志再标记完成，run() 等的是这个标记
+                    finished = Future()
+                    with self._cond:
+                        self._deferred.append(finished)
+
+                    def on_done(f, job=job, finished=finished):
+                        self._finish(job, f.exception())
+                        finished.set_result(None)
+
+                    result.add_done_callback(on_done)
+                else:
+                    self._finish(job, None)
+            finally:
+                self._release(job)
+
+    def run(self) -> dict:
+        """运行到队列清空，返回 {job_id: None(成功) 或 异常}"""
+        with self._cond:
+            n = min(self.budget, len(self._pending))
+        threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wait(self._deferred)
+        return self.results
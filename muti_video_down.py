@@ -1,15 +1,14 @@
 import re
-import os
 import requests
-from pathlib import Path
 import shutil
 import subprocess
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
 import sys
 
+from bili_pipeline import audio_codec_args, download_batch
+from cookie_provider import get_provider
+from download_metrics import metrics
+from ranged_download import download_ranged, get_session
+
 
 # 检查依赖
 def check_dependencies():
@@ -26,32 +25,22 @@ def check_dependencies():
         sys.exit(1)
 
 
-# 使用 Selenium 自动获取 B 站 cookie
-def get_bilibili_cookie():
-    chrome_options = Options()
-    chrome_options.add_argument('--headless')  # 无头模式
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--no-sandbox')
-
+# 获取 B 站 cookie：共享的本地 cookie 存储(按每个 cookie 的过期时间)，临近过期时后台刷新，
+# 只有没有可用 cookie 时才启动无头 Chrome
+def get_cookie_auth():
     try:
-        driver = webdriver.Chrome(options=chrome_options)
-        driver.get('https://www.bilibili.com/')
-        driver.implicitly_wait(5)
-        cookies = driver.get_cookies()
-        driver.quit()
-        cookie_str = '; '.join([f"{c['name']}={c['value']}" for c in cookies])
-        return cookie_str
+        provider = get_provider()
+        provider.cookies()  # 先确认有可用 cookie，取不到时在开始下载前退出
+        return provider.auth
     except Exception as e:
         print(f"使用 Selenium 获取 Cookie 失败，请确保已安装 ChromeDriver 并与 Chrome 浏览器版本匹配。错误信息: {e}")
         sys.exit(1)
 
 
-# 构建请求头
+# 构建请求头(不含 Cookie，Cookie 由 get_cookie_auth 的钩子在每个请求发出时写入)
 def get_headers():
-    cookie = get_bilibili_cookie()
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-        "Cookie": cookie,
         "Referer": "https://www.bilibili.com/"
     }
     return headers
@@ -65,61 +54,20 @@ def extract_bvid(url: str):
     raise ValueError("未能解析到 BVID，请确认输入的是具体视频地址")
 
 
-# 获取视频播放信息
-def get_play_info(bvid: str, headers):
-    api = f"https://api.bilibili.com/x/player/pagelist?bvid={bvid}&jsonp=jsonp"
+# 下载文件(多连接 Range 分块写入预分配文件，中断后按 .dlstate.json 续传，完成后校验大小)
+# 所有文件共用同一个 Session，视频、音频和各分P之间复用连接
+def download_file(url: str, filename: str, headers, desc: str, auth=None):
     try:
-        resp = requests.get(api, headers=headers)
-        resp.raise_for_status()
-        data = resp.json()
-        if data["code"] != 0:
-            raise Exception(f"API请求失败: {data}")
-        return data["data"]
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"网络请求失败: {e}")
-
-
-# 获取视频下载地址
-def get_download_url(bvid: str, cid: int, headers):
-    api = f"https://api.bilibili.com/x/player/playurl?bvid={bvid}&cid={cid}&qn=80&fnval=16"
-    try:
-        resp = requests.get(api, headers=headers).json()
-        if resp["code"] != 0:
-            raise Exception(f"播放地址请求失败: {resp}")
-
-        try:
-            video_url = resp["data"]["dash"]["video"][0]["baseUrl"]
-            audio_url = resp["data"]["dash"]["audio"][0]["baseUrl"]
-            return video_url, audio_url
-        except KeyError:
-            durl = resp["data"]["durl"]
-            return durl[0]["url"], None
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"网络请求失败: {e}")
-
-
-# 下载文件
-def download_file(url: str, filename: str, headers, desc: str):
-    try:
-        with requests.get(url, headers=headers, stream=True) as r:
-            r.raise_for_status()
-            total_size = int(r.headers.get('content-length', 0))
-            block_size = 1024
-            with open(filename, "wb") as f, tqdm(
-                    total=total_size, unit='B', unit_scale=True, desc=desc, ncols=70
-            ) as t:
-                for chunk in r.iter_content(chunk_size=block_size):
-                    if chunk:
-                        f.write(chunk)
-                        t.update(len(chunk))
+        download_ranged(url, filename, session=get_session(headers, auth), desc=desc)
     except requests.exceptions.RequestException as e:
         raise Exception(f"下载文件失败: {e}")
 
 
-# 合并音视频
+# 合并音视频(音轨已是 AAC 时直接复制，不再转码)
 def merge_av(video_file: str, audio_file: str, output_file: str):
     ffmpeg_path = shutil.which("ffmpeg")
-    cmd = [ffmpeg_path, "-y", "-i", video_file, "-i", audio_file, "-c:v", "copy", "-c:a", "aac", output_file]
+    cmd = [ffmpeg_path, "-y", "-i", video_file, "-i", audio_file, "-c:v", "copy", *audio_codec_args(audio_file),
+           output_file]
     try:
         subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     except subprocess.CalledProcessError as e:
@@ -129,60 +77,28 @@ def merge_av(video_file: str, audio_file: str, output_file: str):
         raise
 
 
-def download_part(page, bvid, headers, output_dir):
-    cid = page["cid"]
-    part_title = page["part"]
-    safe_title = re.sub(r'[\\/:*?"<>|]', '_', part_title)
-    print(f"\n开始下载分P: {part_title} (CID={cid})")
-
-    try:
-        video_url, audio_url = get_download_url(bvid, cid, headers)
-        output_path = output_dir / f"{safe_title}.mp4"
-
-        if audio_url:
-            video_file = output_dir / f"{safe_title}_video.mp4"
-            audio_file = output_dir / f"{safe_title}_audio.mp4"
-
-            download_file(video_url, str(video_file), headers, f"{safe_title} - 视频")
-            download_file(audio_url, str(audio_file), headers, f"{safe_title} - 音频")
-
-            print(f"\n正在合并音视频: {output_path.name}")
-            merge_av(str(video_file), str(audio_file), str(output_path))
-
-            os.remove(video_file)
-            os.remove(audio_file)
-            print(f"合并完成并清理临时文件: {output_path.name}")
-        else:
-            download_file(video_url, output_path, headers, f"{safe_title}")
-            print(f"下载完成: {output_path.name}")
-
-    except Exception as e:
-        print(f"下载分P '{part_title}' 失败: {e}")
-
-
-# 主函数
+# 主函数：所有视频的分P进同一个全局队列，按总连接预算调度；中断后重跑按任务日志跳过已完成的分P
 def bilibili_downloader(urls: list):
     check_dependencies()
     headers = get_headers()
+    auth = get_cookie_auth()
 
+    bvids = []
     for url in urls:
         try:
-            bvid = extract_bvid(url)
-            print(f"\n--- 解析到视频 BV 号: {bvid} ---")
-            pages = get_play_info(bvid, headers)
-            print(f"该视频共有 {len(pages)} 个分P。")
-
-            output_dir = Path(bvid)
-            output_dir.mkdir(exist_ok=True)
-
-            # 使用多线程下载
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                futures = [executor.submit(download_part, page, bvid, headers, output_dir) for page in pages]
-                for future in as_completed(futures):
-                    future.result()
-
-        except Exception as e:
+            bvids.append(extract_bvid(url))
+        except ValueError as e:
             print(f"处理URL '{url}' 失败: {e}")
+    if not bvids:
+        return
+    print(f"\n--- 共 {len(bvids)} 个视频 ---")
+
+    results = download_batch(bvids, headers,
+                             download=lambda url, filename, desc: download_file(url, filename, headers, desc, auth),
+                             merge=merge_av, auth=auth)
+    failed = [job_id for job_id, error in results.items() if error is not None]
+    print(f"\n本次完成 {len(results) - len(failed)} 个分P，失败 {len(failed)} 个。")
+    metrics.report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,181 @@
+"""
+动态均值止盈/止跌策略的参数扫描：每只股票只取一次行情，价格序列放进共享内存，
+进程池中的各进程直接映射使用(不复制)，批量评估 window / down_factor / up_factor 组合，
+输出按收益率排序的结果表。
+
+用法示例:
+    python param_sweep.py --codes 600104,601127,600585 --start 2024-08-01 --end 2025-08-01 \
+        --windows 5:30 --down 0.85:0.99:0.01 --up 1.05:1.30:0.01 --random 1000
+    STOCK_FAKE_AKSHARE=1 时使用离线假数据
+"""
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from strategy_kernel import run_dynamic_max, run_principal_tracking, trailing_mean
+from 多股票测试和数据存Excel import FETCH_CONFIG, fetch_close_df
+
+# 策略名 -> (状态机, 均值预热方式, 收益基准)
+STRATEGIES = {
+    # 多股票测试和数据存Excel.py: 收益相对初始本金
+    'principal': (run_principal_tracking, 'price', 'init'),
+    # 动态止盈止跌2.py: 收益相对当前投入本金
+    'dynamic_max': (run_dynamic_max, 'partial', 'invest'),
+}
+
+
+def load_close_series(stock_codes, buy_date_str, end_date_str) -> dict:
+    """每只股票取一次区间收盘价(前复权)，与组合回测共用 fetch_close_df(东财令牌桶限速 + 指数退避重试)，
+    多线程并发取数；取数失败或无数据的股票跳过，结果按 stock_codes 顺序
+    """
+    stock_codes = list(dict.fromkeys(stock_codes))
+    with ThreadPoolExecutor(max_workers=FETCH_CONFIG["max_workers"]) as pool:
+        frames = pool.map(lambda code: fetch_close_df(code, buy_date_str, end_date_str, FETCH_CONFIG["max_retry"]),
+                          stock_codes)
+        return {code: df['Close'].to_numpy(dtype=float) for code, df in zip(stock_codes, frames) if not df.empty}
+
+
+def build_grid(windows, down_factors, up_factors, n_random: int = None, seed: int = 0) -> list:
+    """全组合网格；给定 n_random 时从网格中无放回随机抽取 n_random 组"""
+    grid = list(itertools.product(windows, down_factors, up_factors))
+    if n_random is not None and n_random < len(grid):
+        rng = np.random.default_rng(seed)
+        grid = [grid[i] for i in sorted(rng.choice(len(grid), n_random, replace=False))]
+    return grid
+
+
+# ---------------- 进程池工作端: 映射共享内存中的价格 ----------------
+_shm = None
+_prices = {}
+_avg_cache = {}
+
+
+def _init_worker(shm_name: str, layout: dict):
+    global _shm, _prices
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    buf = np.ndarray((sum(n for _, n in layout.values()),), dtype=np.float64, buffer=_shm.buf)
+    _prices = {code: buf[offset:offset + n] for code, (offset, n) in layout.items()}
+    _avg_cache.clear()
+
+
+def _evaluate(task):
+    """task: (策略名, 代码, [(window, down, up), ...], init_invest, max_invest) -> 结果行列表"""
+    strategy, code, combos, init_invest, max_invest = task
+    kernel, warmup, basis = STRATEGIES[strategy]
+    close = _prices[code]
+    last = float(close[-1])
+    rows = []
+    for window, down, up in combos:
+        key = (code, window, warmup)
+        avg = _avg_cache.get(key)
+        if avg is None:
+            avg = _avg_cache[key] = trailing_mean(close, window, warmup=warmup)
+        res = kernel(close, avg, init_invest, max_invest, down, up)
+        if strategy == 'principal':
+            final_value = res['shares'] * last + res['final_cash']
+            trades = sum(1 for a in res['action'][1:] if a)
+        else:
+            final_value = res['shares'] * last + res['cash']
+            trades = len(res['events'])
+        base = init_invest if basis == 'init' else res['total_invest']
+        rows.append({'代码': code, 'window': window, 'down_factor': down, 'up_factor': up,
+                     '期末总市值': final_value, '收益率(%)': (final_value - base) / base * 100 if base else np.nan,
+                     '交易次数': trades})
+    return rows
+
+
+def run_sweep(series: dict, grid: list, strategy: str = 'principal', init_invest=10000, max_invest=50000,
+              workers: int = None, chunk: int = 250) -> pd.DataFrame:
+    """在进程池中评估 股票 × 参数组合，返回按收益率降序的结果表
+    价格序列拼接后放入一块共享内存，子进程按偏移量映射，不做拷贝
+    """
+    if not series or not grid:
+        return pd.DataFrame()
+    layout, offset = {}, 0
+    for code, close in series.items():
+        layout[code] = (offset, len(close))
+        offset += len(close)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, offset) * 8)
+    try:
+        buf = np.ndarray((offset,), dtype=np.float64, buffer=shm.buf)
+        for code, close in series.items():
+            start, n = layout[code]
+            buf[start:start + n] = close
+        # 同一窗口的组合放在一起，便于子进程复用均值
+        grid = sorted(grid)
+        tasks = [(strategy, code, grid[i:i + chunk], init_invest, max_invest)
+                 for code in series for i in range(0, len(grid), chunk)]
+        rows = []
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                                 initargs=(shm.name, layout)) as executor:
+            for part in executor.map(_evaluate, tasks):
+                rows.extend(part)
+        del buf
+    finally:
+        shm.close()
+        shm.unlink()
+    result = pd.DataFrame(rows)
+    return result.sort_values('收益率(%)', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def summarize_sweep(result: pd.DataFrame) -> pd.DataFrame:
+    """按参数组合汇总各股票表现(平均/中位收益率、胜率、平均交易次数)，按平均收益率排序"""
+    if result.empty:
+        return result
+    grouped = result.groupby(['window', 'down_factor', 'up_factor'])
+    summary = grouped.agg(**{
+        '平均收益率(%)': ('收益率(%)', 'mean'),
+        '中位收益率(%)': ('收益率(%)', 'median'),
+        '盈利股票占比(%)': ('收益率(%)', lambda s: (s > 0).mean() * 100),
+        '平均交易次数': ('交易次数', 'mean'),
+    }).reset_index()
+    return summary.sort_values('平均收益率(%)', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def _parse_range(text: str, cast=float) -> list:
+    """'5,10,20' 或 'start:stop[:step]'(含 stop)"""
+    if ':' not in text:
+        return [cast(v) for v in text.split(',') if v]
+    parts = [float(v) for v in text.split(':')]
+    start, stop = parts[0], parts[1]
+    step = parts[2] if len(parts) > 2 else 1
+    values = np.arange(start, stop + step / 2, step)
+    return [cast(v) for v in values] if cast is int else [round(float(v), 6) for v in values]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='动态均值止盈/止跌策略参数扫描')
+    parser.add_argument('--codes', default="600104,000063,601127,300750,002982,000559,300251,002466,000895,600585")
+    parser.add_argument('--start', default="2024-08-01")
+    parser.add_argument('--end', default="2025-08-01")
+    parser.add_argument('--strategy', choices=list(STRATEGIES), default='principal')
+    parser.add_argument('--windows', default="5:30")
+    parser.add_argument('--down', default="0.85:0.99:0.01")
+    parser.add_argument('--up', default="1.05:1.30:0.01")
+    parser.add_argument('--random', type=int, default=1000, help='随机抽取的组合数，0 表示全网格')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--init-invest', type=float, default=10000)
+    parser.add_argument('--max-invest', type=float, default=50000)
+    parser.add_argument('--output', default="param_sweep_result.csv")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    series = load_close_series([c for c in args.codes.split(',') if c], args.start, args.end)
+    t1 = time.perf_counter()
+    grid = build_grid(_parse_range(args.windows, int), _parse_range(args.down), _parse_range(args.up),
+                      n_random=args.random or None)
+    result = run_sweep(series, grid, args.strategy, args.init_invest, args.max_invest, args.workers)
+    t2 = time.perf_counter()
+    print(f"取数 {len(series)} 只 {t1 - t0:.2f}s, 评估 {len(series)} x {len(grid)} = {len(result)} 次 {t2 - t1:.2f}s")
+    summary = summarize_sweep(result)
+    pd.options.display.float_format = '{:.2f}'.format
+    print("\n===== 参数组合排名(按各股票平均收益率) =====")
+    print(summary.head(20))
+    result.to_csv(args.output, index=False, encoding='utf-8-sig')
+    print(f"\n逐股票结果已保存: {args.output}")
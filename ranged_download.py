@@ -0,0 +1,169 @@
+"""
+多连接分块下载(HTTP Range)：
+- 先用 Range: bytes=0-0 探测总大小和是否支持分块，不支持时退回单连接流式下载
+- 预分配目标文件，按 piece_size 切块，线程池并发请求各块并写到各自偏移(每个线程独立文件句柄)
+- 旁路状态文件 <文件名>.dlstate.json 记录已完成的块，中断后重跑只补未完成的块；
+  B 站等 CDN 的地址带过期签名，状态按 url 路径(不含参数) + 总大小匹配
+- 完成后校验文件大小与总大小一致，再删除状态文件
+- get_session(headers, auth): 同一组请求头(和认证钩子)在进程内共用一个 Session，视频、音频和各分P复用同一个连接池
+"""
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit
+
+from tqdm import tqdm
+
+from download_metrics import metrics
+from segment_downloader import make_session
+
+REQUEST_TIMEOUT = 20
+PIECE_SIZE = 4 * 1024 * 1024      # 每块 4MB
+CHUNK_SIZE = 256 * 1024           # 单次读取/写入大小
+CONNECTIONS = 4
+SHARED_POOL_SIZE = 32             # 共享 Session 每个主机的连接池大小，需覆盖批量下载的总连接预算
+
+
+def probe(session, url: str) -> tuple:
+    """返回 (总大小或 None, 是否支持 Range)"""
+    with metrics.request(url) as rec, \
+            session.get(url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=REQUEST_TIMEOUT) as r:
+        rec.response(r)
+        r.raise_for_status()
+        content_range = r.headers.get('Content-Range', '')
+        if r.status_code == 206 and '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            return (int(total), True) if total.isdigit() else (None, False)
+        length = r.headers.get('Content-Length')
+        return (int(length) if length and length.isdigit() else None), False
+
+
+class DownloadState:
+    """已完成块的旁路状态文件"""
+
+    def __init__(self, filename: str, url: str, total: int, piece_size: int):
+        self.path = filename + '.dlstate.json'
+        self.key = {'url': urlsplit(url).path, 'total': total, 'piece_size': piece_size}
+        self.done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(self.path) and os.path.exists(filename) and os.path.getsize(filename) == total:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('key') == self.key:
+                    self.done = set(data.get('done', []))
+            except (OSError, ValueError):
+                pass
+
+    def mark(self, index: int):
+        with self._lock:
+            self.done.add(index)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'key': self.key, 'done': sorted(self.done)}, f)
+            os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _download_single(session, url: str, filename: str, desc: str, progress: bool) -> int:
+    with metrics.request(url) as rec, session.get(url, stream=True, timeout=REQUEST_TIMEOUT) as r:
+        rec.response(r)
+        r.raise_for_status()
+        total = int(r.headers.get('content-length', 0))
+        written = 0
+        with open(filename, 'wb') as f, tqdm(total=total, unit='B', unit_scale=True, desc=desc, ncols=70,
+                                             disable=not progress) as t:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    f.write(chunk)
+                    written += len(chunk)
+                    t.update(len(chunk))
+        rec.add_bytes(written)
+    if total and written != total:
+        raise IOError(f'大小不一致: 期望 {total} 字节，实际 {written} 字节')
+    return written
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(headers: dict = None, auth=None):
+    """同一组请求头在进程内共用一个下载 Session；auth 为 requests 认证钩子(如按请求读取最新 Cookie)"""
+    key = (tuple(sorted((headers or {}).items())), auth)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = make_session(headers, pool_size=SHARED_POOL_SIZE)
+            session.auth = auth
+            _sessions[key] = session
+        return session
+
+
+def download_ranged(url: str, filename: str, session=None, headers: dict = None, connections: int = CONNECTIONS,
+                    piece_size: int = PIECE_SIZE, desc: str = None, progress: bool = True) -> int:
+    """多连接分块下载 url 到 filename，返回文件大小；服务器不支持 Range 时单连接下载"""
+    filename = str(filename)
+    desc = desc or os.path.basename(filename)
+    own_session = session is None
+    if own_session:
+        session = make_session(headers, pool_size=connections)
+    try:
+        total, ranged = probe(session, url)
+        if not ranged or not total or connections <= 1:
+            return _download_single(session, url, filename, desc, progress)
+
+        pieces = [(start, min(start + piece_size, total) - 1) for start in range(0, total, piece_size)]
+        state = DownloadState(filename, url, total, piece_size)
+        if not state.done:
+            # 预分配(稀疏文件)，各块直接写到自己的偏移
+            with open(filename, 'wb') as f:
+                f.truncate(total)
+        todo = [i for i in range(len(pieces)) if i not in state.done]
+        done_bytes = sum(pieces[i][1] - pieces[i][0] + 1 for i in state.done)
+
+        pbar = tqdm(total=total, initial=done_bytes, unit='B', unit_scale=True, desc=desc, ncols=70,
+                    disable=not progress)
+
+        def fetch_piece(i):
+            start, end = pieces[i]
+            written = 0
+            with metrics.request(url) as rec, \
+                    session.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True,
+                                timeout=REQUEST_TIMEOUT) as r:
+                rec.response(r)
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise IOError('服务器未按 Range 返回分块')
+                with open(filename, 'r+b') as f:
+                    f.seek(start)
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+                            written += len(chunk)
+                            pbar.update(len(chunk))
+                rec.add_bytes(written)
+            if written != end - start + 1:
+                raise IOError(f'分块 {start}-{end} 不完整: {written} 字节')
+            state.mark(i)
+
+        try:
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                futures = [executor.submit(fetch_piece, i) for i in todo]
+                for future in as_completed(futures):
+                    future.result()
+        finally:
+            pbar.close()
+
+        size = os.path.getsize(filename)
+        if size != total or len(state.done) != len(pieces):
+            raise IOError(f'大小校验失败: 期望 {total} 字节，实际 {size} 字节')
+        state.clear()
+        return size
+    finally:
+        if own_session:
+            session.close()
@@ -0,0 +1,68 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """令牌桶限速器（线程安全）
+    rate: 每秒补充的令牌数（即平均每秒请求数），<=0 表示不限速
+    burst: 桶容量，允许的瞬时突发请求数
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate or 0)
+        self.burst = max(1, int(burst or 1))
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> float:
+        """不阻塞地取一个令牌：取到返回 0，否则返回还需等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """取一个令牌，令牌不足时阻塞等待"""
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host: str, rate: float, burst: int = 1) -> RateLimiter:
+    """按 host 取共享限速器，同一 host 在进程内只有一个令牌桶"""
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = RateLimiter(rate, burst)
+            _limiters[host] = limiter
+        return limiter
+
+
+def retry_call(func, *args, retries: int = 3, backoff: float = 0.5, before=None, **kwargs):
+    """调用 func，失败后按指数退避重试(backoff, 2*backoff, 4*backoff ...)
+    before: 每次调用前执行(如令牌桶 acquire)，重试同样计入限速
+    重试用尽时抛出最后一次的异常
+    """
+    retries = max(1, int(retries))
+    for attempt in range(retries):
+        if before is not None:
+            before()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            if attempt == retries - 1:
+                raise
+            time.sleep(backoff * (2 ** attempt))
@@ -0,0 +1,263 @@
+"""
+m3u8 等分段下载的公共组件：
+- 线程池 + 共享 requests.Session(keep-alive 连接池)，不再每段新建进程和 TCP 连接
+- download_segments: 每段一个文件，清单文件记录已完成分段(url/大小)，中断后重跑会跳过已完成且大小一致的分段
+- stream_segments: 分段并发下载，按顺序经有界重排窗口直接追加到最终文件，不落临时分段文件；
+  进度文件记录已写入的段数和字节数，中断后截断到该位置继续
+"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+from download_metrics import metrics
+
+REQUEST_TIMEOUT = 20
+MANIFEST_NAME = 'manifest.json'
+
+
+def make_session(headers: dict = None, pool_size: int = 16, retries: int = 3) -> requests.Session:
+    """带连接池和自动重试(连接错误/5xx/429)的 Session，线程间共享"""
+    session = requests.Session()
+    if headers:
+        session.headers.update(headers)
+    retry = Retry(total=retries, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET', 'HEAD']))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class SegmentManifest:
+    """已完成分段清单: {文件名: {"url": ..., "size": ...}}，每完成 save_every 段落盘一次"""
+
+    def __init__(self, path: str, save_every: int = 20):
+        self.path = path
+        self.save_every = save_every
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self.segments = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.segments = json.load(f).get('segments', {})
+            except (OSError, ValueError):
+                self.segments = {}
+
+    def is_done(self, name: str, url: str, file_path: str) -> bool:
+        entry = self.segments.get(name)
+        return (entry is not None and entry.get('url') == url and os.path.exists(file_path)
+                and os.path.getsize(file_path) == entry.get('size'))
+
+    def mark(self, name: str, url: str, size: int):
+        with self._lock:
+            self.segments[name] = {'url': url, 'size': size}
+            self._dirty += 1
+            if self._dirty >= self.save_every:
+                self._save_locked()
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'segments': self.segments}, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self._dirty = 0
+
+
+def fetch_segment(session: requests.Session, url: str, byterange: tuple = None, timeout=REQUEST_TIMEOUT) -> bytes:
+    """取一个分段；byterange=(长度, 偏移) 时只请求该字节范围"""
+    headers = None
+    if byterange is not None:
+        length, offset = byterange
+        headers = {'Range': f'bytes={offset}-{offset + length - 1}'}
+    with metrics.request(url) as rec:
+        resp = session.get(url, headers=headers, timeout=timeout)
+        rec.response(resp)
+        resp.raise_for_status()
+        content = resp.content
+        rec.add_bytes(len(content))
+    if byterange is not None and resp.status_code == 200:
+        # 服务器忽略 Range 返回了整个文件
+        content = content[byterange[1]:byterange[1] + byterange[0]]
+    return content
+
+
+def _timed(transform):
+    """transform(解密等)的耗时记入下载指标的 transform 阶段"""
+    if transform is None:
+        return None
+
+    def run(i, content):
+        with metrics.stage('transform'):
+            return transform(i, content)
+    return run
+
+
+def download_segments(urls, out_dir: str, filenames=None, transform=None, session: requests.Session = None,
+                      headers: dict = None, workers: int = 8, manifest_name: str = MANIFEST_NAME,
+                      progress: bool = True) -> list:
+    """并发下载 urls 到 out_dir，返回与 urls 同序的文件路径(失败的为 None)
+
+    filenames: 每段的文件名，默认 00000.ts 这样的序号名
+    transform: transform(index, content) -> bytes，写盘前处理(如解密)
+    已在清单中且文件大小一致的分段直接跳过，不再请求
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    transform = _timed(transform)
+    urls = list(urls)
+    if filenames is None:
+        filenames = [f'{i:05d}.ts' for i in range(len(urls))]
+    paths = [os.path.join(out_dir, name) for name in filenames]
+    manifest = SegmentManifest(os.path.join(out_dir, manifest_name))
+    own_session = session is None
+    if own_session:
+        session = make_session(headers, pool_size=workers)
+
+    results = list(paths)
+    todo = [i for i, (name, url, path) in enumerate(zip(filenames, urls, paths))
+            if not manifest.is_done(name, url, path)]
+    skipped = len(urls) - len(todo)
+    if skipped and progress:
+        print(f'清单中已完成 {skipped}/{len(urls)} 段，跳过')
+
+    def work(i):
+        content = fetch_segment(session, urls[i])
+        if transform is not None:
+            content = transform(i, content)
+        tmp = paths[i] + '.part'
+        with open(tmp, 'wb') as f:
+            f.write(content)
+        os.replace(tmp, paths[i])
+        manifest.mark(filenames[i], urls[i], len(content))
+
+    pbar = tqdm(total=len(urls), initial=skipped, disable=not progress)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(work, i): i for i in todo}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    results[i] = None
+                    print('下载或解密失败:', urls[i], e)
+                pbar.update(1)
+    finally:
+        pbar.close()
+        manifest.save()
+        if own_session:
+            session.close()
+    return results
+
+
+def _load_progress(path: str, fingerprint: str) -> dict:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+        if progress.get('fingerprint') == fingerprint:
+            return progress
+    except (OSError, ValueError):
+        pass
+    return {'fingerprint': fingerprint, 'next': 0, 'offset': 0}
+
+
+def _save_progress(path: str, progress: dict):
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    os.replace(tmp, path)
+
+
+def stream_segments(urls, out_path: str, transform=None, session: requests.Session = None, headers: dict = None,
+                    workers: int = 8, buffer_segments: int = None, progress: bool = True, ranges=None,
+                    transform_workers: int = None) -> str:
+    """并发下载 urls，按顺序处理后追加写入 out_path，返回 out_path
+
+    transform: transform(index, content) -> bytes，写入前处理(如解密)
+    ranges: 与 urls 同序的 (长度, 偏移) 或 None，用于 #EXT-X-BYTERANGE 分段
+    transform_workers: >0 时 transform(解密等 CPU 工作)放进单独的线程池，网络线程取完数据即去取下一段
+    buffer_segments: 已下载未写出的分段上限(含在途请求)，默认 2 * workers；
+        只有 [下一个待写段, 下一个待写段 + buffer_segments) 内的分段会被请求，
+        峰值内存约为 buffer_segments 个分段大小，与视频总长无关
+    out_path + '.progress.json' 记录已写入的段数/字节数(与 url 列表绑定)，中断后重跑从断点续写；
+    某段最终失败时抛出异常，已写入部分保留
+    """
+    urls = list(urls)
+    transform = _timed(transform)
+    window = max(1, buffer_segments or 2 * workers)
+    progress_path = out_path + '.progress.json'
+    ranges = list(ranges) if ranges is not None else [None] * len(urls)
+    fingerprint = hashlib.sha1('\n'.join(f'{u} {r}' if r else u for u, r in zip(urls, ranges))
+                               .encode('utf-8')).hexdigest()
+    state = _load_progress(progress_path, fingerprint)
+    if state['next'] >= len(urls) and os.path.exists(out_path) and os.path.getsize(out_path) == state['offset']:
+        if progress:
+            print(out_path, '已完成，跳过')
+        return out_path
+
+    start = state['next'] if os.path.exists(out_path) and os.path.getsize(out_path) >= state['offset'] else 0
+    if start == 0:
+        state.update(next=0, offset=0)
+    if start and progress:
+        print(f'从第 {start}/{len(urls)} 段继续')
+
+    own_session = session is None
+    if own_session:
+        session = make_session(headers, pool_size=workers)
+
+    transform_pool = ThreadPoolExecutor(max_workers=transform_workers) if transform and transform_workers else None
+
+    def work(i):
+        content = fetch_segment(session, urls[i], ranges[i])
+        if transform is None:
+            return content
+        if transform_pool is not None:
+            return transform_pool.submit(transform, i, content)
+        return transform(i, content)
+
+    pbar = tqdm(total=len(urls), initial=start, disable=not progress)
+    mode = 'r+b' if start else 'wb'
+    try:
+        with open(out_path, mode) as out, ThreadPoolExecutor(max_workers=workers) as executor:
+            # 截掉上次中断时可能多写的半段
+            out.seek(state['offset'])
+            out.truncate()
+            pending = {}
+            submitted = start
+            for i in range(start, len(urls)):
+                while submitted < min(len(urls), i + window):
+                    pending[submitted] = executor.submit(work, submitted)
+                    submitted += 1
+                try:
+                    data = pending.pop(i).result()
+                    if transform_pool is not None:
+                        data = data.result()
+                except Exception:
+                    for future in pending.values():
+                        future.cancel()
+                    raise
+                out.write(data)
+                state['next'] = i + 1
+                state['offset'] += len(data)
+                del data
+                out.flush()
+                _save_progress(progress_path, state)
+                pbar.update(1)
+    finally:
+        pbar.close()
+        if transform_pool is not None:
+            transform_pool.shutdown(cancel_futures=True)
+        if own_session:
+            session.close()
+    return out_path
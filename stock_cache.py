@@ -0,0 +1,274 @@
+"""
+本地缓存：进程内只加载一次、运行结束统一落盘，可在线程池中并发使用。
+"""
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+
+def atomic_write_json(path: str, data):
+    """先写临时文件再替换，避免中途崩溃或并发写入留下半个文件"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+class FundamentalsCache:
+    """财务指标缓存 {代码: {'date': 'YYYY-MM-DD', 'roe': .., 'net_margin': ..}}
+    - 首次访问时加载 json，之后全部在内存中读写
+    - 新取到的数据先记在内存里，flush() 时一次性原子写回
+    - cache_days: 超过该天数的记录视为过期，加载时剔除、查询时按未命中处理
+    """
+
+    def __init__(self, path: str, cache_days: int = 3):
+        self.path = path
+        self.cache_days = cache_days
+        self.hits = 0
+        self.misses = 0
+        self._data = None
+        self._session = {}  # 本进程内取数失败的结果，只在内存中复用，不落盘
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, entry: dict, today: datetime) -> bool:
+        ts = entry.get('date') if isinstance(entry, dict) else None
+        try:
+            return (today - datetime.strptime(ts, '%Y-%m-%d')).days < self.cache_days
+        except (TypeError, ValueError):
+            return False
+
+    def _ensure_loaded(self):
+        if self._data is not None:
+            return
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception:
+                data = {}
+        today = self._today()
+        self._data = {k: v for k, v in data.items() if self._is_fresh(v, today)}
+        # 有过期记录被剔除时，下次 flush 顺带写回
+        self._dirty = len(self._data) != len(data)
+
+    @staticmethod
+    def _today() -> datetime:
+        return datetime.strptime(datetime.now().strftime('%Y-%m-%d'), '%Y-%m-%d')
+
+    def get(self, symbol: str):
+        """命中返回 {'roe', 'net_margin'}，未命中或已过期返回 None"""
+        with self._lock:
+            self._ensure_loaded()
+            entry = self._data.get(symbol)
+            if entry is not None and self._is_fresh(entry, self._today()):
+                self.hits += 1
+                return {"roe": entry.get('roe', float('nan')), "net_margin": entry.get('net_margin', float('nan'))}
+            if symbol in self._session:
+                self.hits += 1
+                return dict(self._session[symbol])
+            self.misses += 1
+            return None
+
+    def put(self, symbol: str, value: dict, persist: bool = True):
+        with self._lock:
+            self._ensure_loaded()
+            if persist:
+                self._data[symbol] = {"date": datetime.now().strftime('%Y-%m-%d'),
+                                      "roe": value.get('roe'), "net_margin": value.get('net_margin')}
+                self._dirty = True
+            else:
+                self._session[symbol] = dict(value)
+
+    def flush(self):
+        """把本次运行新增/剔除的记录一次性写回磁盘"""
+        with self._lock:
+            if not self._dirty or self._data is None:
+                return
+            try:
+                atomic_write_json(self.path, self._data)
+                self._dirty = False
+            except Exception as e:
+                print(f"财务指标缓存写入失败: {e}")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data or {})}
+
+
+# ================== 通用 TTL 缓存(指数/成分股/行业等) ==================
+# 收盘后多久视为当日数据已定型(与 bar_store 一致)
+SESSION_CLOSE = (15, 30)
+
+
+def is_trade_day(day: date, trade_days=None) -> bool:
+    """trade_days 为交易日历('YYYY-MM-DD' 集合)；没有日历时按周一至周五(与 bar_store 一致)"""
+    if trade_days:
+        return day.strftime('%Y-%m-%d') in trade_days
+    return day.weekday() < 5
+
+
+def session_day(ts: datetime, trade_days=None) -> str:
+    """ts 所处的“交易时段日”: 最近一个已收盘的交易日(当日收盘前算前一个交易日)；
+    周末和节假日沿用节前最后一个交易日，收盘即为缓存失效的边界
+    """
+    day = ts.date()
+    if (ts.hour, ts.minute) < SESSION_CLOSE:
+        day -= timedelta(days=1)
+    for _ in range(30):  # 最长假期也不会超过 30 天，日历缺数据时避免死循环
+        if is_trade_day(day, trade_days):
+            break
+        day -= timedelta(days=1)
+    return day.strftime('%Y-%m-%d')
+
+
+class MemoryBackend:
+    """进程内字典"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str):
+        with self._lock:
+            return self._data.get((namespace, key))
+
+    def set(self, namespace: str, key: str, entry: dict):
+        with self._lock:
+            self._data[(namespace, key)] = entry
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+
+class DiskBackend:
+    """每个键一个 pickle 文件: <root>/<namespace>/<key>.pkl，原子写入"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, namespace: str, key: str) -> str:
+        folder = os.path.join(self.root, namespace)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, re.sub(r'[^\w.-]', '_', key) + '.pkl')
+
+    def get(self, namespace: str, key: str):
+        path = self._path(namespace, key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def set(self, namespace: str, key: str, entry: dict):
+        path = self._path(namespace, key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception as e:
+            print(f"缓存写入失败 {namespace}/{key}: {e}")
+
+    def delete(self, namespace: str, key: str):
+        try:
+            os.remove(self._path(namespace, key))
+        except OSError:
+            pass
+
+
+class TTLCache:
+    """按命名空间配置过期策略的分层缓存(读时逐层查找并回填上层，写时写入所有层)
+    policies: {namespace: {'expire': 'daily' | 'close' | 'never', 'max_age': 秒(可选)}}
+      daily: 自然日变化即失效(成分股等日频数据)
+      close: 跨过收盘边界即失效(日线行情：盘中取到的数据收盘后重新获取)；
+             按交易日判断，周末/节假日不失效。trade_days 为交易日历，None 时按周一至周五
+      max_age: 额外的最长存活时间，用于盘中快照
+    未配置的命名空间按 daily 处理
+    """
+
+    def __init__(self, backends, policies: dict = None, trade_days=None):
+        self.backends = list(backends)
+        self.policies = policies or {}
+        self.trade_days = set(trade_days) if trade_days else None
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+
+    def is_fresh(self, namespace: str, stored_at: float, now: datetime = None) -> bool:
+        now = now or datetime.now()
+        stored = datetime.fromtimestamp(stored_at)
+        policy = self.policies.get(namespace, {})
+        max_age = policy.get('max_age')
+        if max_age is not None and (now - stored).total_seconds() > max_age:
+            return False
+        expire = policy.get('expire', 'daily')
+        if expire == 'close':
+            return session_day(stored, self.trade_days) == session_day(now, self.trade_days)
+        if expire == 'daily':
+            return stored.date() == now.date()
+        return True
+
+    def _count(self, counter: dict, namespace: str):
+        with self._lock:
+            counter[namespace] = counter.get(namespace, 0) + 1
+
+    def _lookup(self, namespace: str, key: str):
+        for i, backend in enumerate(self.backends):
+            entry = backend.get(namespace, key)
+            if entry is None:
+                continue
+            if not self.is_fresh(namespace, entry['stored_at']):
+                backend.delete(namespace, key)
+                continue
+            for upper in self.backends[:i]:
+                upper.set(namespace, key, entry)
+            return entry
+        return None
+
+    def get(self, namespace: str, key: str, default=None):
+        entry = self._lookup(namespace, key)
+        if entry is None:
+            self._count(self.misses, namespace)
+            return default
+        self._count(self.hits, namespace)
+        return entry['value']
+
+    def set(self, namespace: str, key: str, value, **meta):
+        entry = dict(meta, stored_at=time.time(), value=value)
+        for backend in self.backends:
+            backend.set(namespace, key, entry)
+
+    def get_range(self, namespace: str, key: str, start: date, end: date, loader, date_col: str = 'date'):
+        """区间数据复用: 已缓存区间覆盖 [start, end] 时直接切片(如 160 日数据服务 120 日请求)
+        loader(start, end) -> DataFrame，未覆盖时按 已缓存与请求区间的并集 重新获取
+        """
+        entry = self._lookup(namespace, key)
+        if entry is not None and entry['start'] <= start and entry['end'] >= end:
+            self._count(self.hits, namespace)
+            df = entry['value']
+        else:
+            self._count(self.misses, namespace)
+            if entry is not None:
+                start_lo, end_hi = min(start, entry['start']), max(end, entry['end'])
+            else:
+                start_lo, end_hi = start, end
+            df = loader(start_lo, end_hi)
+            if df is None or df.empty:
+                return df
+            self.set(namespace, key, df, start=start_lo, end=end_hi)
+        dates = pd.to_datetime(df[date_col]).dt.date
+        return df[(dates >= start) & (dates <= end)].reset_index(drop=True)
+
+    def stats(self) -> dict:
+        return {ns: (self.hits.get(ns, 0), self.misses.get(ns, 0))
+                for ns in sorted(set(self.hits) | set(self.misses))}
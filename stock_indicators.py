@@ -0,0 +1,247 @@
+"""
+横截面技术指标引擎：把多只股票的日线拼成面板(日期 × 股票)，一次性用数组运算算出
+均线多头 / ATR% / 台阶放量 / 放量突破 / 涨停计数 / 波动收缩度 等标记。
+
+面板按“位置”右对齐(每只股票最后一根 bar 对齐到最后一行，历史较短的在前面补 NaN)，
+与 stock_strategy 中逐只股票用 iloc[-k:] 取窗口的口径完全一致。
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+from pandas.api.indexers import BaseIndexer
+
+
+def _pct_values(hist_df: pd.DataFrame) -> np.ndarray:
+    """与精选阶段相同的 涨跌幅% 口径：优先用 涨跌幅 列，否则用收盘价计算"""
+    if '涨跌幅%' in hist_df.columns:
+        return pd.to_numeric(hist_df['涨跌幅%'], errors='coerce').to_numpy(dtype=float)
+    if '涨跌幅' in hist_df.columns:
+        col = hist_df['涨跌幅']
+        if pd.api.types.is_numeric_dtype(col):
+            return col.to_numpy(dtype=float)
+        try:
+            return pd.to_numeric(col.astype(str).str.replace('%', ''), errors='coerce').to_numpy(dtype=float)
+        except Exception:
+            pass
+    return (hist_df['收盘'].pct_change() * 100).to_numpy(dtype=float)
+
+
+def _col_values(df: pd.DataFrame, col: str) -> np.ndarray:
+    try:
+        return df[col].to_numpy(dtype=float)
+    except (ValueError, TypeError):
+        return pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=float)
+
+
+def build_panel(hist_map: dict) -> dict:
+    """{代码: 日线DataFrame} -> 面板
+    返回: {'codes': [...], 'lengths': (N,), 'close'/'high'/'low'/'volume'/'pct': (N, T) 数组}
+    数组按 股票 × 时间 存放(行连续)，便于沿时间轴做与单只 Series 相同顺序的归约
+    """
+    codes = [c for c, df in hist_map.items() if df is not None and not df.empty]
+    lengths = np.array([len(hist_map[c]) for c in codes], dtype=int)
+    T = int(lengths.max()) if len(codes) else 0
+    panel = {'codes': codes, 'lengths': lengths}
+    for key in ['close', 'high', 'low', 'volume', 'pct']:
+        panel[key] = np.full((len(codes), T), np.nan)
+    src = {'close': '收盘', 'high': '最高', 'low': '最低', 'volume': '成交量'}
+    for i, code in enumerate(codes):
+        df = hist_map[code]
+        start = T - lengths[i]
+        for key, col in src.items():
+            panel[key][i, start:] = _col_values(df, col)
+        panel['pct'][i, start:] = _pct_values(df)
+    return panel
+
+
+class _RowWindowIndexer(BaseIndexer):
+    """把 (N, T) 面板按行展平后做滚动窗口：窗口不跨行，每行开头与单独一条 Series 一样从零累计"""
+
+    def get_window_bounds(self, num_values=0, min_periods=None, center=None, closed=None, step=None):
+        k = np.arange(num_values, dtype=np.int64)
+        row_start = (k // self.row_len) * self.row_len
+        start = np.maximum(row_start, k - self.window_size + 1)
+        return start, k + 1
+
+
+def _rolling_mean(arr: np.ndarray, window: int) -> np.ndarray:
+    """沿时间轴滚动均值，逐位与 Series.rolling(window).mean() 一致(同一 cython 内核、同样的累计顺序)"""
+    if arr.size == 0:
+        return arr.copy()
+    indexer = _RowWindowIndexer(window_size=window, row_len=arr.shape[1])
+    flat = pd.Series(arr.ravel()).rolling(indexer, min_periods=window).mean()
+    return flat.to_numpy().reshape(arr.shape)
+
+
+def panel_true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    """真实波幅 TR，缺失项跳过(同 DataFrame.max(axis=1) 口径)"""
+    prev_close = np.full_like(close, np.nan)
+    prev_close[:, 1:] = close[:, :-1]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.fmax(np.fmax(high - low, np.abs(high - prev_close)), np.abs(low - prev_close))
+
+
+def wilder_smooth(values, n: int, lengths=None) -> np.ndarray:
+    """Wilder 平滑(alpha=1/n 的递推滤波)，以首个完整 n 日均值为种子
+    values: 单只股票的 Series / 1-D 数组，或 (股票数, 时间) 的 2-D 面板
+    lengths: 面板每行的实际长度(右对齐，前面补 NaN)，缺省视为整行有效
+    种子之后一旦遇到缺失值即保持 NaN，与逐日循环 atr[i] = (atr[i-1]*(n-1) + tr[i]) / n 口径一致
+    """
+    arr = np.asarray(values, dtype=float)
+    one_d = arr.ndim == 1
+    arr = np.atleast_2d(arr)
+    N, T = arr.shape
+    if lengths is None:
+        lengths = np.full(N, T)
+    seed_pos = (T - np.asarray(lengths)) + n - 1
+    cols = np.arange(T)
+    after_seed = cols >= seed_pos[:, None]
+    seeded = np.where(after_seed, arr, np.nan)
+    rows = np.nonzero(seed_pos < T)[0]
+    seeded[rows, seed_pos[rows]] = _rolling_mean(arr, n)[rows, seed_pos[rows]]
+    # ewm(adjust=False) 即 y[t] = (1 - 1/n) * y[t-1] + x[t] / n，在 cython 中按列递推
+    out = pd.DataFrame(seeded.T).ewm(alpha=1.0 / n, adjust=False).mean().to_numpy().T.copy()
+    out[np.cumsum(np.isnan(seeded) & after_seed, axis=1) > 0] = np.nan
+    return out[0] if one_d else out
+
+
+def panel_atr(high, low, close, lengths, n: int, wilder: bool = False) -> np.ndarray:
+    """面板 ATR；Wilder 模式以每只股票首个完整 n 日均值为种子递推(对所有股票同时向量化)"""
+    tr = panel_true_range(high, low, close)
+    if not wilder:
+        return _rolling_mean(tr, n)
+    return wilder_smooth(tr, n, lengths)
+
+
+def compute_panel_flags(panel: dict, tech_conf: dict, em_conf: dict, use_wilder: bool = False) -> pd.DataFrame:
+    """一次性计算所有股票的技术标记，返回以代码为索引的 DataFrame
+    布尔标记列为 object 类型: True/False，数据不足时为 None(与逐只计算时一致)
+    """
+    codes = panel['codes']
+    lengths = panel['lengths']
+    close, high, low, vol, pct = panel['close'], panel['high'], panel['low'], panel['volume'], panel['pct']
+    N = len(codes)
+    if N == 0:
+        return pd.DataFrame(columns=['ATR', 'ATR%', 'ATR≤硬阈值', '均线多头', '台阶放量', '放量突破',
+                                     '涨停数', '波动收缩度'])
+    last_close = close[:, -1]
+
+    # ATR%
+    atr = panel_atr(high, low, close, lengths, tech_conf['atr_days'], wilder=use_wilder)
+    last_atr = atr[:, -1]
+    atr_valid = (last_close != 0) & ~np.isnan(last_close) & (last_atr != 0) & ~np.isnan(last_atr)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        atr_pct = np.where(atr_valid, last_atr / last_close * 100.0, np.nan)
+    hard_atr = np.where(atr_valid, atr_pct <= tech_conf['max_atr_pct'], None)
+
+    # 均线多头: MA 依次递减且收盘在最短均线之上
+    ma_last = np.column_stack([_rolling_mean(close, d)[:, -1] for d in tech_conf['ma_list']])
+    ma_ok_data = ~np.isnan(ma_last).any(axis=1) & ~np.isnan(last_close)
+    bull = last_close > ma_last[:, 0]
+    for k in range(1, ma_last.shape[1]):
+        bull &= ma_last[:, k - 1] > ma_last[:, k]
+    ma_bull = np.where(ma_ok_data, bull, None)
+
+    # 台阶放量: 最近 n+1 日两日均量严格递增，且无缺失
+    n = tech_conf['volume_step_days']
+    if close.shape[1] >= n + 1:
+        recent = vol[:, -(n + 1):]
+        ma2 = (recent[:, 1:] + recent[:, :-1]) / 2
+        stair = ~np.isnan(recent).any(axis=1) & (np.diff(ma2, axis=1) > 0).all(axis=1)
+    else:
+        stair = np.zeros(N, dtype=bool)
+    stair_ok = np.where(lengths >= n + 1, stair, None)
+
+    # 放量突破: 当日量 >= 前 (bd-1) 日均量 * 倍数
+    bd = tech_conf['volume_breakout_days']
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        if close.shape[1] >= bd:
+            avg_vol = np.nanmean(vol[:, -bd:-1], axis=1)
+        else:
+            avg_vol = np.full(N, np.nan)
+        breakout = vol[:, -1] >= avg_vol * tech_conf['volume_breakout_ratio']
+    breakout_ok = np.where(lengths >= bd + 1, breakout, None)
+
+    # 涨停计数
+    look = em_conf['limit_up_lookback']
+    with np.errstate(invalid='ignore'):
+        limit_up = (pct[:, -look:] >= em_conf['limit_up_threshold']).sum(axis=1).astype(float)
+
+    # 波动收缩度: 近 r 日 ATR 均值 / 之前 p 日 ATR 均值
+    vol_contraction = np.full(N, np.nan)
+    if em_conf.get('enable_vol_contraction'):
+        r_win = em_conf['vol_contraction_recent']
+        p_win = em_conf['vol_contraction_prev']
+        atr_cnt = (~np.isnan(atr)).sum(axis=1)
+        ok = (atr_cnt > 0) & (lengths >= r_win + p_win + 5) & (atr_cnt > (r_win + p_win // 2))
+        if ok.any() and atr.shape[1] >= r_win + p_win:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                recent_mean = np.nanmean(atr[:, -r_win:], axis=1)
+                prev_mean = np.nanmean(atr[:, -(r_win + p_win):-r_win], axis=1)
+            ok &= ~np.isnan(prev_mean) & (prev_mean != 0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                vol_contraction = np.where(ok, recent_mean / prev_mean, np.nan)
+
+    return pd.DataFrame({
+        'ATR': last_atr,
+        'ATR%': atr_pct,
+        'ATR≤硬阈值': hard_atr,
+        '均线多头': ma_bull,
+        '台阶放量': stair_ok,
+        '放量突破': breakout_ok,
+        '涨停数': limit_up,
+        '波动收缩度': vol_contraction,
+    }, index=pd.Index(codes, name='代码'))
+
+
+def _bench_wilder(n_symbols=1700, n_days=2500, n=14):
+    """Wilder 平滑: 与原逐日循环逐项比对 + 耗时对比"""
+    import time
+
+    def loop_atr(tr, n):
+        atr = tr.copy()
+        atr.iloc[0:n] = tr.iloc[0:n].rolling(window=n).mean()
+        for i in range(n, len(tr)):
+            atr.iloc[i] = (atr.iloc[i - 1] * (n - 1) + tr.iloc[i]) / n
+        return atr
+
+    rng = np.random.default_rng(0)
+    tr = np.abs(rng.normal(0.5, 0.2, (n_symbols, n_days)))
+    lengths = rng.integers(5, n_days + 1, n_symbols)
+    for i, length in enumerate(lengths):
+        tr[i, :n_days - length] = np.nan
+    tr[rng.integers(0, n_symbols, 20), rng.integers(0, n_days, 20)] = np.nan
+
+    sample = rng.choice(n_symbols, 50, replace=False)
+    t0 = time.perf_counter()
+    expected = {i: loop_atr(pd.Series(tr[i, n_days - lengths[i]:]), n).to_numpy() for i in sample}
+    loop_cost = (time.perf_counter() - t0) / len(sample)
+    t0 = time.perf_counter()
+    panel = wilder_smooth(tr, n, lengths)
+    panel_cost = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    single = {i: wilder_smooth(pd.Series(tr[i, n_days - lengths[i]:]), n) for i in sample}
+    single_cost = (time.perf_counter() - t0) / len(sample)
+
+    worst = 0.0
+    for i in sample:
+        got = panel[i, n_days - lengths[i]:]
+        assert np.array_equal(np.isnan(got), np.isnan(expected[i])), f"第 {i} 行缺失位置不一致"
+        assert np.array_equal(np.isnan(single[i]), np.isnan(expected[i])), f"第 {i} 行(单只)缺失位置不一致"
+        mask = ~np.isnan(got)
+        if mask.any():
+            worst = max(worst, float(np.max(np.abs(got[mask] - expected[i][mask]) / expected[i][mask])),
+                        float(np.max(np.abs(single[i][mask] - expected[i][mask]) / expected[i][mask])))
+    assert worst < 1e-12, f"最大相对误差 {worst}"
+    print(f"一致性: 抽样 {len(sample)} 只, 最大相对误差 {worst:.2e}")
+    print(f"逐日循环: {loop_cost * 1000:.1f} ms/只 (全部 {n_symbols} 只约 {loop_cost * n_symbols:.1f}s)")
+    print(f"递推滤波(单只): {single_cost * 1000:.2f} ms/只")
+    print(f"递推滤波(面板 {n_symbols}x{n_days}): {panel_cost * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    _bench_wilder()
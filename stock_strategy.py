@@ -1,12 +1,21 @@
 import pandas as pd
-import akshare as ak
 import numpy as np
 from datetime import datetime, timedelta
 import time
-from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 import os
-import json
 import argparse
+import threading
+from rate_limiter import get_limiter, retry_call
+from bar_store import BarStore
+from stock_cache import DiskBackend, FundamentalsCache, MemoryBackend, TTLCache
+from stock_indicators import build_panel, compute_panel_flags, wilder_smooth
+
+# 离线模式: STOCK_FAKE_AKSHARE=1 时使用本地假数据模块
+if os.environ.get('STOCK_FAKE_AKSHARE'):
+    import fake_akshare as ak
+else:
+    import akshare as ak
 
 # 新增: 列处理与列名适配工具函数
 # -------------------------------------------------
@@ -94,39 +103,92 @@ def pick_col(df: pd.DataFrame, candidates, alias=None):
     return None
 
 def get_cache_dir():
-    cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+    cache_dir = os.environ.get('STOCK_CACHE_DIR') or os.path.join(os.path.dirname(__file__), 'cache')
     os.makedirs(cache_dir, exist_ok=True)
     return cache_dir
 
 # ================== 新增函数: 财务指标与风险控制动态调参 ==================
-@lru_cache(maxsize=512)
+_fundamentals_caches = {}
+_fundamentals_caches_lock = threading.Lock()
+
+
+def get_fundamentals_cache() -> FundamentalsCache:
+    """按当前缓存目录取财务指标缓存(进程内只加载一次，由 flush_fundamentals_cache 统一写回)"""
+    cache_file = os.path.join(get_cache_dir(), 'fundamentals.json')
+    with _fundamentals_caches_lock:
+        cache = _fundamentals_caches.get(cache_file)
+        if cache is None:
+            cache = FundamentalsCache(cache_file, CONFIG.get('fundamental', {}).get('cache_days', 3))
+            _fundamentals_caches[cache_file] = cache
+        return cache
+
+
+_ttl_caches = {}
+
+
+def get_ttl_cache():
+    """按当前缓存目录取 TTL 缓存，未启用时返回 None"""
+    cconf = CONFIG.get('cache', {})
+    if not cconf.get('enabled'):
+        return None
+    root = os.path.join(get_cache_dir(), 'ttl')
+    cache = _ttl_caches.get(root)
+    if cache is None:
+        backends = []
+        for name in cconf.get('backends', ['memory', 'disk']):
+            if name == 'memory':
+                backends.append(MemoryBackend())
+            elif name == 'disk':
+                backends.append(DiskBackend(root))
+            else:
+                raise ValueError(f"未知缓存后端: {name}")
+        cache = TTLCache(backends, cconf.get('namespaces', {}))
+        cache.trade_days = load_trade_calendar(cache)
+        _ttl_caches[root] = cache
+    return cache
+
+
+def load_trade_calendar(cache) -> set:
+    """A 股交易日历('YYYY-MM-DD' 集合)，供 TTL 缓存按交易日判断收盘失效；缓存 30 天，取不到时返回 None(按工作日)"""
+    days = cache.get('trade_calendar', 'sina')
+    if days is not None:
+        return set(days)
+    try:
+        df = retry_call(ak.tool_trade_date_hist_sina, retries=2, before=lambda: throttle('tool_trade_date_hist_sina'))
+        days = sorted(pd.to_datetime(df['trade_date']).dt.strftime('%Y-%m-%d'))
+    except Exception as e:
+        print(f"获取交易日历失败，按工作日判断收盘失效: {e}")
+        return None
+    cache.set('trade_calendar', 'sina', days)
+    return set(days)
+
+
+def flush_fundamentals_cache():
+    cache = get_fundamentals_cache()
+    cache.flush()
+    st = cache.stats()
+    print(f"财务指标缓存: 命中 {st['hits']} / 未命中 {st['misses']}, 共 {st['size']} 条")
+
+
 def get_fundamental_indicator(symbol: str):
     cfg = CONFIG.get('fundamental', {})
     if not cfg.get('enabled', False):
         return {"roe": np.nan, "net_margin": np.nan}
-    # 文件缓存（按天）
-    cache_days = cfg.get('cache_days', 3)
-    cache_dir = get_cache_dir()
-    cache_file = os.path.join(cache_dir, 'fundamentals.json')
-    cache_data = {}
-    today = datetime.now().strftime('%Y-%m-%d')
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-        except Exception:
-            cache_data = {}
-    sym_cache = cache_data.get(symbol)
-    if sym_cache:
-        ts = sym_cache.get('date')
-        if ts and (datetime.strptime(today, '%Y-%m-%d') - datetime.strptime(ts, '%Y-%m-%d')).days < cache_days:
-            return {"roe": sym_cache.get('roe', np.nan), "net_margin": sym_cache.get('net_margin', np.nan)}
+    # 文件缓存（按天），进程内共享
+    cache = get_fundamentals_cache()
+    cached = cache.get(symbol)
+    if cached is not None:
+        return cached
+    failed = {"roe": np.nan, "net_margin": np.nan}
     try:
+        throttle('stock_financial_analysis_indicator')
         df = ak.stock_financial_analysis_indicator(symbol=symbol)
     except Exception:
-        return {"roe": np.nan, "net_margin": np.nan}
+        cache.put(symbol, failed, persist=False)
+        return failed
     if df is None or df.empty:
-        return {"roe": np.nan, "net_margin": np.nan}
+        cache.put(symbol, failed, persist=False)
+        return failed
     if '日期' in df.columns:
         df = df.sort_values('日期')
     row = df.iloc[-1]
@@ -139,12 +201,7 @@ def get_fundamental_indicator(symbol: str):
         return np.nan
     roe = pick_val(['净资产收益率加权(%)','净资产收益率(%)','ROE加权(%)','ROE(%)','净资产收益率-加权(%)'])
     net_margin = pick_val(['销售净利率(%)','净利率(%)','销售净利率','净利率'])
-    cache_data[symbol] = {"date": today, "roe": roe, "net_margin": net_margin}
-    try:
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
+    cache.put(symbol, {"roe": roe, "net_margin": net_margin})
     return {"roe": roe, "net_margin": net_margin}
 
 def apply_risk_control_dynamic(adj_filter: dict, index_hist: pd.DataFrame):
@@ -213,7 +270,10 @@ CONFIG = {
     "sector": {
         "enabled": True,
         "top_n": 5,
-        "debug": True  # 打印行业原始列名
+        "debug": True,  # 打印行业原始列名
+        "max_workers": 4,      # 成分股并发获取线程数(限速见 prefetch.host_rate.eastmoney_board)
+        "max_retry": 3,
+        "retry_backoff": 0.5   # 重试退避基数(秒)，依次 0.5 / 1 / 2 ...
     },
     # 3. 筛选参数
     "filter": {
@@ -263,9 +323,48 @@ CONFIG = {
         "min_roe": 8.0,          # ROE 下限(%)
         "min_net_margin": 5.0,   # 净利率下限(%)
         "cache_days": 3
+    },
+    # 8. 精选阶段并发预取（历史行情 + 财务指标）
+    "prefetch": {
+        "enabled": True,
+        "max_workers": 8,
+        # 按数据源 host 限速(次/秒)，<=0 不限速
+        "host_rate": {"eastmoney": 10.0, "sina": 5.0, "eastmoney_board": 4.0},
+        "host_burst": 4,
+    },
+    # 9. 本地日线仓库(cache/bars)，只补取缺失日期
+    "bar_store": {
+        "enabled": True,
+    },
+    # 10. 指数/成分股/行业 TTL 缓存(cache/ttl)
+    "cache": {
+        "enabled": True,
+        "backends": ["memory", "disk"],  # 按顺序查找，写入全部
+        "namespaces": {
+            "index_hist": {"expire": "close"},                 # 指数日线: 收盘后失效
+            "constituents": {"expire": "daily"},               # 指数成分股: 按自然日
+            "sector": {"expire": "close", "max_age": 600},     # 行业涨幅排名: 盘中最多复用 10 分钟
+            "sector_cons": {"expire": "daily"},                # 行业成分股: 按自然日
+            "trade_calendar": {"expire": "never", "max_age": 30 * 86400},  # 交易日历: 30 天
+        },
+    },
+    # 11. 盘中轮询(--mode watch)
+    "watch": {
+        "interval": 30,            # 轮询间隔(秒)
+        "context_refresh": 600,    # 行业/风控上下文刷新间隔(秒)，刷新后全部重算
+        "stop_time": "15:00",      # 到点自动结束
+        "output": "stock_watch_sh_main.csv",  # Top5 变化时覆盖写入
     }
 }
 
+# akshare 接口 -> 数据源 host，用于按 host 限速
+AK_HOST_MAP = {
+    "stock_zh_a_hist": "eastmoney",
+    "stock_financial_analysis_indicator": "sina",
+    "stock_board_industry_cons_em": "eastmoney_board",
+    "tool_trade_date_hist_sina": "sina",
+}
+
 
 # ==============================================================================
 # 辅助函数
@@ -280,18 +379,26 @@ def check_trading_time():
     return True
 
 
-def get_hist_data(symbol, days=100):
-    """获取历史数据并缓存"""
-    end_date = datetime.now().strftime('%Y%m%d')
-    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y%m%d')
-    
+def throttle(func_name: str):
+    """按接口所属 host 的令牌桶限速，未配置的接口不限速"""
+    host = AK_HOST_MAP.get(func_name)
+    if not host:
+        return
+    pconf = CONFIG.get('prefetch', {})
+    rate = pconf.get('host_rate', {}).get(host, 0)
+    get_limiter(host, rate, pconf.get('host_burst', 1)).acquire()
+
+
+def fetch_hist_remote(symbol, start_date, end_date, adjust="qfq"):
+    """从 akshare 拉取 [start_date, end_date] 日线(YYYYMMDD)，带重试"""
     # 增加重试机制
     max_retry = CONFIG["market_timing"].get("max_retry", 3)
     retry_delay = CONFIG["market_timing"].get("retry_delay", 1)
     
     for attempt in range(max_retry):
         try:
-            df = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date, end_date=end_date, adjust="qfq")
+            throttle('stock_zh_a_hist')
+            df = ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date, end_date=end_date, adjust=adjust)
             # 增加数据验证
             if not df.empty and len(df) > 0:
                 return df
@@ -308,6 +415,34 @@ def get_hist_data(symbol, days=100):
     return pd.DataFrame()
 
 
+_bar_stores = {}
+
+
+def get_bar_store():
+    """按当前缓存目录取本地日线仓库(同一目录进程内共享一个实例)"""
+    root = os.path.join(get_cache_dir(), 'bars')
+    store = _bar_stores.get(root)
+    if store is None:
+        store = BarStore(root, fetch_hist_remote)
+        _bar_stores[root] = store
+    return store
+
+
+def get_hist_range(symbol, start_date, end_date, adjust="qfq"):
+    """区间日线: 启用本地仓库时只补取缺失日期，否则直接走网络"""
+    if CONFIG.get('bar_store', {}).get('enabled'):
+        return get_bar_store().get(symbol, start_date, end_date, adjust)
+    return fetch_hist_remote(symbol, pd.to_datetime(start_date).strftime('%Y%m%d'),
+                             pd.to_datetime(end_date).strftime('%Y%m%d'), adjust)
+
+
+def get_hist_data(symbol, days=100):
+    """获取历史数据并缓存"""
+    end_date = datetime.now().strftime('%Y%m%d')
+    start_date = (datetime.now() - timedelta(days=days)).strftime('%Y%m%d')
+    return get_hist_range(symbol, start_date, end_date, adjust="qfq")
+
+
 def calculate_atr(df_hist, n, wilder=False):
     """计算 ATR (可选 Wilder 平滑)"""
     high_low = df_hist['最高'] - df_hist['最低']
@@ -316,11 +451,7 @@ def calculate_atr(df_hist, n, wilder=False):
     tr = pd.concat([high_low, high_prev_close, low_prev_close], axis=1).max(axis=1)
     if not wilder:
         return tr.rolling(window=n).mean()
-    atr = tr.copy()
-    atr.iloc[0:n] = tr.iloc[0:n].rolling(window=n).mean()  # 初始化
-    for i in range(n, len(tr)):
-        atr.iloc[i] = (atr.iloc[i-1] * (n - 1) + tr.iloc[i]) / n
-    return atr
+    return pd.Series(wilder_smooth(tr, n), index=tr.index)
 
 
 def is_stair_step_volume(df_hist, n):
@@ -334,19 +465,51 @@ def is_stair_step_volume(df_hist, n):
     return all(vol_ma2.iloc[i] > vol_ma2.iloc[i - 1] for i in range(1, len(vol_ma2)))
 
 
+def prefetch_stock_data(codes, days=200, with_fundamental=True):
+    """并发预取候选股的历史行情与财务指标(线程池 + 按 host 限速)
+    返回: {代码: {'hist': DataFrame, 'fund': dict 或 Exception}}
+    财务指标获取异常时保存异常对象，由精选阶段按串行路径同样的方式处理
+    """
+    pconf = CONFIG.get('prefetch', {})
+
+    def fetch_one(code):
+        hist = get_hist_data(code, days)
+        if not with_fundamental:
+            return code, {'hist': hist}
+        try:
+            fund = get_fundamental_indicator(str(code))
+        except Exception as e:
+            fund = e
+        return code, {'hist': hist, 'fund': fund}
+
+    result = {}
+    with ThreadPoolExecutor(max_workers=max(1, int(pconf.get('max_workers', 8)))) as executor:
+        for code, data in executor.map(fetch_one, codes):
+            result[code] = data
+    return result
+
+
 # ==============================================================================
 # 核心逻辑模块
 # ==============================================================================
 
-@lru_cache(maxsize=8)
 def get_index_hist_data(index_code: str, days: int = 160) -> pd.DataFrame:
-    """获取指数历史数据，增加多种代码形��与备用接口尝试。
+    """获取指数历史数据(走 TTL 缓存: 已缓存的更长区间直接切片复用，收盘后失效)"""
+    end_date = datetime.now().date()
+    start_date = end_date - timedelta(days=days)
+    cache = get_ttl_cache()
+    if cache is None:
+        return download_index_hist(index_code, start_date, end_date)
+    return cache.get_range('index_hist', str(index_code), start_date, end_date,
+                           lambda s, e: download_index_hist(index_code, s, e))
+
+
+def download_index_hist(index_code: str, start_date, end_date) -> pd.DataFrame:
+    """获取指数历史数据，增加多种代码形式与备用接口尝试。
     优先: stock_zh_index_daily(symbol) 依次尝试 原码 / 去前缀 / 仅数字。
     备用: index_zh_a_hist(symbol_without_prefix)
     统一输出列: 开盘 最高 最低 收盘 成交量
     """
-    end_date = datetime.now().date()
-    start_date = end_date - timedelta(days=days)
     max_retry = CONFIG["market_timing"].get("max_retry", 3)
     retry_delay = CONFIG["market_timing"].get("retry_delay", 1)
 
@@ -420,31 +583,21 @@ def get_index_hist_data(index_code: str, days: int = 160) -> pd.DataFrame:
     return pd.DataFrame()
 
 
-@lru_cache(maxsize=1)
 def get_hs300_constituents(force_refresh: bool = False) -> set:
     """获取沪深300成分股代码集合（6位数字）
     策略：
-      1. 若��在当日缓存且未强制刷新 -> 直接读取
+      1. 若存在当日缓存且未强制刷新 -> 直接读取
       2. 多符号、多接口依次尝试
          a) index_stock_cons(symbol=符号候选)
          b) index_zh_index_weight_csindex(symbol="000300", 最近一段时间)
       3. 成功后写入缓存
     返回: set[str]
     """
-    cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
-    os.makedirs(cache_dir, exist_ok=True)
-    cache_file = os.path.join(cache_dir, 'hs300_constituents.json')
-    today = datetime.now().strftime('%Y-%m-%d')
-
-    # 读取缓存
-    if not force_refresh and os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            if data.get('date') == today and isinstance(data.get('codes'), list) and data['codes']:
-                return set(data['codes'])
-        except Exception:
-            pass  # 忽略缓存读取���误
+    cache = get_ttl_cache()
+    if cache is not None and not force_refresh:
+        cached = cache.get('constituents', 'hs300')
+        if cached:
+            return set(cached)
 
     def normalize_codes(df: pd.DataFrame, possible_cols) -> set:
         if df is None or df.empty:
@@ -498,11 +651,8 @@ def get_hs300_constituents(force_refresh: bool = False) -> set:
 
     # 缓存结果
     if collected:
-        try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump({'date': today, 'codes': sorted(list(collected))}, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"写入缓存失败: {e}")
+        if cache is not None:
+            cache.set('constituents', 'hs300', sorted(collected))
         return collected
 
     # 输出错误信息（保留最近几条）
@@ -514,23 +664,15 @@ def get_hs300_constituents(force_refresh: bool = False) -> set:
     return set()
 
 
-@lru_cache(maxsize=1)
 def get_zz500_constituents(force_refresh: bool = False) -> set:
     """获取中证500(000905)成分股集合，逻辑同沪深300。
-    缓存文件: cache/zz500_constituents.json
+    缓存: constituents/zz500
     """
-    cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
-    os.makedirs(cache_dir, exist_ok=True)
-    cache_file = os.path.join(cache_dir, 'zz500_constituents.json')
-    today = datetime.now().strftime('%Y-%m-%d')
-    if not force_refresh and os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            if data.get('date') == today and data.get('codes'):
-                return set(data['codes'])
-        except Exception:
-            pass
+    cache = get_ttl_cache()
+    if cache is not None and not force_refresh:
+        cached = cache.get('constituents', 'zz500')
+        if cached:
+            return set(cached)
     def normalize_codes(df: pd.DataFrame, cols) -> set:
         if df is None or df.empty: return set()
         for c in cols:
@@ -569,11 +711,8 @@ def get_zz500_constituents(force_refresh: bool = False) -> set:
         except Exception as e:
             errors.append(f"zz500 weight err={e}")
     if collected:
-        try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump({'date': today, 'codes': sorted(list(collected))}, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"写入zz500缓存失败: {e}")
+        if cache is not None:
+            cache.set('constituents', 'zz500', sorted(collected))
         return collected
     if errors:
         print("获取中证500成分异常详情(截取):")
@@ -625,14 +764,42 @@ def check_market_regime():
     return sec_logic
 
 
+def fetch_sector_cons(sector_code: str) -> list:
+    """单个行业板块的成分股代码(按日缓存；令牌桶限速 + 指数退避重试)"""
+    cache = get_ttl_cache()
+    if cache is not None:
+        cached = cache.get('sector_cons', sector_code)
+        if cached is not None:
+            return cached
+    sconf = CONFIG['sector']
+    cons_df = retry_call(ak.stock_board_industry_cons_em, symbol=sector_code,
+                         retries=sconf.get('max_retry', 3), backoff=sconf.get('retry_backoff', 0.5),
+                         before=lambda: throttle('stock_board_industry_cons_em'))
+    codes = []
+    if cons_df is not None and not cons_df.empty:
+        cons_df = drop_duplicate_columns(cons_df)
+        code_c = pick_col(cons_df, ['代码','证券代码','股票代码'], '成分代码')
+        if code_c:
+            codes = cons_df[code_c].astype(str).tolist()
+    # 空结果(接口失败或返回空表)不缓存，下次调用重新请求
+    if cache is not None and codes:
+        cache.set('sector_cons', sector_code, codes)
+    return codes
+
+
 def get_strong_sectors():
     """获取强势行业板块及其成分股(自适应列名)"""
     if not CONFIG["sector"]["enabled"]:
         print("强势行业过滤已禁用。")
         return None, None
     print("正在获取强势行业板块...")
+    cache = get_ttl_cache()
     try:
-        sector_spot_df = ak.stock_board_industry_spot_em()
+        sector_spot_df = cache.get('sector', 'board_spot') if cache is not None else None
+        if sector_spot_df is None:
+            sector_spot_df = ak.stock_board_industry_spot_em()
+            if cache is not None and sector_spot_df is not None and not sector_spot_df.empty:
+                cache.set('sector', 'board_spot', sector_spot_df)
         if sector_spot_df is None or sector_spot_df.empty:
             print("行业数据为空")
             return None, None
@@ -657,23 +824,18 @@ def get_strong_sectors():
         strong_stocks = set(); stock_to_sector = {}
         print("\n当日强势板块 Top", CONFIG["sector"]["top_n"], ":")
         for _, row in top_sectors.iterrows():
-            sector_name = row['板块名称']
-            sector_code = str(row['板块代码'])
-            print(f"  - {sector_name} (平均涨幅: {row['平均涨跌幅']:.2f}%)")
+            print(f"  - {row['板块名称']} (平均涨幅: {row['平均涨跌幅']:.2f}%)")
+        # 各板块成分并发获取，按排名顺序合并(与逐个获取时的行业归属一致)
+        sector_codes = [str(c) for c in top_sectors['板块代码']]
+        with ThreadPoolExecutor(max_workers=max(1, int(CONFIG['sector'].get('max_workers', 4)))) as executor:
+            futures = [executor.submit(fetch_sector_cons, code) for code in sector_codes]
+        for sector_name, sector_code, fut in zip(top_sectors['板块名称'], sector_codes, futures):
             try:
-                cons_df = ak.stock_board_industry_cons_em(symbol=sector_code)
-                if cons_df is None or cons_df.empty:
-                    continue
-                cons_df = drop_duplicate_columns(cons_df)
-                code_c = pick_col(cons_df, ['代码','证券代码','股票代码'], '成分代码')
-                if not code_c:
-                    continue
-                for sc in cons_df[code_c].astype(str):
+                for sc in fut.result():
                     strong_stocks.add(sc)
                     stock_to_sector[sc] = sector_name
             except Exception as e:
                 print(f"    * 成分获取失败 {sector_code}: {e}")
-            time.sleep(0.25)
         if not strong_stocks:
             print("未获取到成分股，行业过滤失效。")
             return None, None
@@ -708,46 +870,79 @@ def build_universe():
     return candidate, membership
 
 
-def run_stock_screener():
-    print("\n开始执行选股���略...")
-    universe_set, membership_map = build_universe()
+def sh_main_mask(codes: pd.Series) -> pd.Series:
+    """上证主板代码掩码(按 universe 配置排除科创板/创业板)"""
     uconf = CONFIG['universe']
-    print("正在获取所有A股实时行情并进行初步筛选...")
-    stock_spot_df = ak.stock_zh_a_spot_em()
-    if stock_spot_df is None or stock_spot_df.empty:
+    mask = codes.str.startswith(tuple(['600','601','603','605']))
+    if uconf.get('exclude_star'):
+        mask &= ~codes.str.startswith('688')
+    if uconf.get('exclude_chinext'):
+        mask &= ~codes.str.startswith(('300','301'))
+    return mask
+
+
+def scan_universe_technicals(days=200):
+    """对上证主板全部股票一次性计算技术标记(均线多头/ATR%/台阶放量/放量突破/涨停数/波动收缩度)。
+    行情走本地日线仓库，首次运行会补齐数据，之后主要耗时在指标引擎本身。
+    """
+    spot_df = ak.stock_zh_a_spot_em()
+    if spot_df is None or spot_df.empty:
         print("实时行情获取失败。")
-        return
+        return None
+    codes = spot_df.loc[sh_main_mask(spot_df['代码'].astype(str)), '代码'].astype(str).tolist()
+    print(f"上证主板全市场扫描: {len(codes)} 只")
+    t0 = time.time()
+    hist_map = {c: d['hist'] for c, d in prefetch_stock_data(codes, days, with_fundamental=False).items()}
+    t1 = time.time()
+    tech_df = compute_panel_flags(build_panel(hist_map), CONFIG['technique'], CONFIG['enhanced_metrics'],
+                                  CONFIG['technique'].get('use_wilder_atr', False))
+    t2 = time.time()
+    print(f"行情加载 {t1 - t0:.2f}s, 指标计算 {t2 - t1:.3f}s")
+    filename = f"scan_technical_sh_main_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    tech_df.to_csv(filename, encoding='utf-8-sig')
+    print(f"全市场技术标记已保存: {filename}")
+    return tech_df
+
+
+def prepare_spot(stock_spot_df: pd.DataFrame, universe_set):
+    """实时行情预处理: 去重列、识别关键列、按股票池截取
+    返回 (行情DataFrame, 列名映射)；失败时返回 (None, None)
+    """
+    uconf = CONFIG['universe']
     stock_spot_df = drop_duplicate_columns(stock_spot_df)
     # 动态识别关键列
-    col_change = pick_col(stock_spot_df, ['涨跌幅','涨跌幅(%)','涨幅'], '涨跌幅')
-    col_volume_ratio = pick_col(stock_spot_df, ['量比','量比(%)'], '量比')
-    col_turnover = pick_col(stock_spot_df, ['换手率','换手率(%)'], '换手率')
-    col_mv = pick_col(stock_spot_df, ['流通市值','流通市值(元)','市值','总市值'], '流通市值')
-    col_amount = pick_col(stock_spot_df, ['成交额','成交额(元)'], '成交额')
-    col_volume = pick_col(stock_spot_df, ['成交量','成交量(手)'], '成交量')
-    col_price = pick_col(stock_spot_df, ['最新价','现价','收盘价'], '最新价')
-    col_high = pick_col(stock_spot_df, ['最高','当日最高','最高价'], '最高')
-    col_low = pick_col(stock_spot_df, ['最低','当日最低','最低价'], '最低')
-    # 新增主力资金列
-    col_fund_flow = None  # 已按需求移除主力净流入相关逻辑
-    if not all([col_change,col_volume_ratio,col_turnover,col_mv,col_amount,col_volume,col_price]):
+    cols = {
+        'change': pick_col(stock_spot_df, ['涨跌幅','涨跌幅(%)','涨幅'], '涨跌幅'),
+        'volume_ratio': pick_col(stock_spot_df, ['量比','量比(%)'], '量比'),
+        'turnover': pick_col(stock_spot_df, ['换手率','换手率(%)'], '换手率'),
+        'mv': pick_col(stock_spot_df, ['流通市值','流通市值(元)','市值','总市值'], '流通市值'),
+        'amount': pick_col(stock_spot_df, ['成交额','成交额(元)'], '成交额'),
+        'volume': pick_col(stock_spot_df, ['成交量','成交量(手)'], '成交量'),
+        'price': pick_col(stock_spot_df, ['最新价','现价','收盘价'], '最新价'),
+        'high': pick_col(stock_spot_df, ['最高','当日最高','最高价'], '最高'),
+        'low': pick_col(stock_spot_df, ['最低','当日最低','最低价'], '最低'),
+    }
+    if not all(cols[k] for k in ['change','volume_ratio','turnover','mv','amount','volume','price']):
         print("行情列名缺失，无法继续。")
-        return
+        return None, None
+    # 日内强度 (靠近高位) = (价-低)/(高-低)
+    cols['intraday'] = '日内强度' if (cols['high'] and cols['low'] and cols['price']) else None
     # 仅上证主板过滤
     if uconf.get('sh_main_only'):
-        mask = stock_spot_df['代码'].str.startswith(tuple(['600','601','603','605']))
-        if uconf.get('exclude_star'):
-            mask &= ~stock_spot_df['代码'].str.startswith('688')
-        if uconf.get('exclude_chinext'):
-            mask &= ~stock_spot_df['代码'].str.startswith(('300','301'))
-        stock_spot_df = stock_spot_df[mask]
+        stock_spot_df = stock_spot_df[sh_main_mask(stock_spot_df['代码'])]
     else:
         if universe_set:
             stock_spot_df = stock_spot_df[stock_spot_df['代码'].isin(universe_set)]
     if stock_spot_df.empty:
         print("过滤后无上证主板股票。")
-        return
-    print(f"上证主板候选数: {len(stock_spot_df)}")
+        return None, None
+    return stock_spot_df, cols
+
+
+def load_screen_context():
+    """行情无关的筛选上下文: 强势行业 + 风险控制调参后的阈值 + 指数行情
+    风险控制触发终止时返回 None
+    """
     strong_stocks_set, stock_to_sector_map = get_strong_sectors()
     # 行业映射容错：接口可能返回 None
     if not isinstance(stock_to_sector_map, dict):
@@ -765,45 +960,55 @@ def run_stock_screener():
     apply_risk_control_dynamic(adj_filter, idx_hist_for_risk)
     if adj_filter.get('__abort__'):
         print("风险控制触发终止。")
-        return
+        return None
+    return {
+        'strong_stocks': strong_stocks_set,
+        'stock_to_sector': stock_to_sector_map,
+        'adj_filter': adj_filter,
+        'index_hist': get_index_hist_data(CONFIG['market_timing']['index_code'], days=120),
+    }
+
+
+def apply_prefilter(stock_spot_df: pd.DataFrame, cols: dict, ctx: dict):
+    """数值化 + 日内强度 + 初筛条件(全部向量化)，返回 (处理后的行情, 通过初筛的布尔掩码)"""
+    adj_filter = ctx['adj_filter']
+    strong_stocks_set = ctx['strong_stocks']
+    stock_spot_df = stock_spot_df.copy()
     # 转数值列
-    numeric_cols = [col_change,col_volume_ratio,col_turnover,col_mv,col_amount,col_volume,col_price]
-    if col_high: numeric_cols.append(col_high)
-    if col_low: numeric_cols.append(col_low)
+    numeric_cols = [cols[k] for k in ['change','volume_ratio','turnover','mv','amount','volume','price']]
+    if cols['high']: numeric_cols.append(cols['high'])
+    if cols['low']: numeric_cols.append(cols['low'])
     for c in numeric_cols:
         stock_spot_df[c] = pd.to_numeric(stock_spot_df[c], errors='coerce')
-    # ��内强度 (靠近高位) = (价-低)/(高-低)
-    intraday_strength = None
-    if col_high and col_low and col_price:
-        rng = (stock_spot_df[col_high] - stock_spot_df[col_low]).replace(0, np.nan)
-        stock_spot_df['日内强度'] = (stock_spot_df[col_price] - stock_spot_df[col_low]) / rng
-        intraday_strength = '日内强度'
+    if cols['intraday']:
+        rng = (stock_spot_df[cols['high']] - stock_spot_df[cols['low']]).replace(0, np.nan)
+        stock_spot_df['日内强度'] = (stock_spot_df[cols['price']] - stock_spot_df[cols['low']]) / rng
     # 使用调整后的参数构建条件
     conditions = (
-        (stock_spot_df[col_change] >= adj_filter['change_rate_min']) &
-        (stock_spot_df[col_change] <= adj_filter['change_rate_max']) &
-        (stock_spot_df[col_volume_ratio] >= adj_filter['volume_ratio_min']) &
-        (stock_spot_df[col_turnover] >= adj_filter['turnover_rate_min']) &
-        (stock_spot_df[col_turnover] <= adj_filter['turnover_rate_max']) &
-        (stock_spot_df[col_mv] >= adj_filter['market_cap_min']) &
-        (stock_spot_df[col_mv] <= adj_filter['market_cap_max']) &
+        (stock_spot_df[cols['change']] >= adj_filter['change_rate_min']) &
+        (stock_spot_df[cols['change']] <= adj_filter['change_rate_max']) &
+        (stock_spot_df[cols['volume_ratio']] >= adj_filter['volume_ratio_min']) &
+        (stock_spot_df[cols['turnover']] >= adj_filter['turnover_rate_min']) &
+        (stock_spot_df[cols['turnover']] <= adj_filter['turnover_rate_max']) &
+        (stock_spot_df[cols['mv']] >= adj_filter['market_cap_min']) &
+        (stock_spot_df[cols['mv']] <= adj_filter['market_cap_max']) &
         (~stock_spot_df['名称'].str.contains('ST')) &
         (~stock_spot_df['名称'].str.startswith('N'))
     )
-    if intraday_strength:
+    if cols['intraday']:
         conditions &= (stock_spot_df['日内强度'] >= adj_filter.get('intraday_strength_min', 0))
     if strong_stocks_set:
         conditions &= stock_spot_df['代码'].isin(strong_stocks_set)
-    pre_selected_df = stock_spot_df[conditions].copy()
-    if pre_selected_df.empty:
-        print("初步筛选后无符合条件的股票。")
-        return
-    print(f"初步筛选完成，共 {len(pre_selected_df)} 只股票进入精选阶段。")
-    # --- 新增：导出进入精选阶段股票快照 ---
+    return stock_spot_df, conditions
+
+
+def save_preselect_snapshot(pre_selected_df: pd.DataFrame, cols: dict):
+    """导出进入精选阶段股票快照"""
+    col_price, col_change = cols['price'], cols['change']
     snapshot_time = datetime.now()
     snapshot_filename = snapshot_time.strftime('%Y%m%d %H%M%S') + '.csv'
     snapshot_cols = ['代码','名称', col_price, col_change]
-    if intraday_strength: snapshot_cols.append('日内强度')
+    if cols['intraday']: snapshot_cols.append('日内强度')
     snapshot_df = pre_selected_df[snapshot_cols].copy()
     # 统一列名
     if col_price != '最新价':
@@ -818,184 +1023,166 @@ def run_stock_screener():
         print(f"进入精选阶段快照已保存: {snapshot_filename}")
     except Exception as e:
         print(f"保存精选阶段快照失败: {e}")
-    # --- 精选逻辑继续 ---
-    final_selection = []
-    # 移除过滤原因统计与剔除逻辑，改为对每只股票标注指标通过情况
-    index_hist_main = get_index_hist_data(CONFIG['market_timing']['index_code'], days=120)
+
+
+def load_candidate_data(codes) -> dict:
+    """精选阶段所需的历史行情(及财务指标): 并发预取或逐只获取
+    返回: {代码: {'hist': DataFrame[, 'fund': dict 或 Exception]}}
+    """
+    if CONFIG.get('prefetch', {}).get('enabled'):
+        t0 = time.time()
+        prefetched = prefetch_stock_data(codes, 200)
+        print(f"并发预取完成: {len(prefetched)} 只, 耗时 {time.time() - t0:.2f}s")
+        return prefetched
+    return {code: {'hist': get_hist_data(code, 200)} for code in codes}
+
+
+def compute_candidate_technicals(candidate_data: dict) -> pd.DataFrame:
+    hist_map = {code: data['hist'] for code, data in candidate_data.items()}
+    return compute_panel_flags(build_panel(hist_map), CONFIG['technique'], CONFIG['enhanced_metrics'],
+                               CONFIG['technique'].get('use_wilder_atr', False))
+
+
+def score_candidate(row, cols: dict, ctx: dict, data: dict, tech_df: pd.DataFrame, verbose: bool = True) -> dict:
+    """精选阶段: 对单只候选股标注各指标通过情况，返回结果记录
+    data: load_candidate_data 中该股票的条目；技术指标取自 tech_df(面板引擎统一算好)
+    """
+    col_change, col_volume_ratio, col_turnover = cols['change'], cols['volume_ratio'], cols['turnover']
+    col_mv, col_amount, col_volume, col_price = cols['mv'], cols['amount'], cols['volume'], cols['price']
+    adj_filter = ctx['adj_filter']
+    strong_stocks_set = ctx['strong_stocks']
+    index_hist_main = ctx['index_hist']
     rs_days = CONFIG['technique']['rs_days']
     atr_soft = CONFIG['technique']['max_atr_pct'] * CONFIG['technique'].get('atr_soft_margin', 1.0)
-    use_wilder = CONFIG['technique'].get('use_wilder_atr', False)
     rel_col_name = f'{rs_days}日相对强度(%)'
     em_conf = CONFIG['enhanced_metrics']
-    for _, row in pre_selected_df.iterrows():
-        stock_code = row['代码']; stock_name = row['名称']
+    stock_code = row['代码']; stock_name = row['名称']
+    if verbose:
         print(f"\n分析 -> {stock_name} ({stock_code})")
-        # 默认值
-        latest_price = safe_float(row[col_price])
-        atr_pct = np.nan
-        hard_atr_ok = None
-        rs_ok = None
-        rs_value = np.nan
-        amount = safe_float(row[col_amount]); vol = safe_float(row[col_volume])
-        vwap = np.nan; vwap_ok = None
-        ma_bull_ok = None
-        stair_ok = None
-        breakout_ok = None
-        limit_up_col = f"近{em_conf['limit_up_lookback']}日涨停数"; limit_up_count = np.nan
-        vol_contraction = np.nan
-        roe_v = np.nan; nm_v = np.nan; fundamental_ok = None
-        try:
-            # 历史数据与技术指标
-            hist_df = get_hist_data(stock_code, 200)
-            if hist_df is not None and not hist_df.empty:
-                for ma in CONFIG['technique']['ma_list']:
-                    hist_df[f'MA{ma}'] = hist_df['收盘'].rolling(window=ma).mean()
-                hist_df['ATR'] = calculate_atr(hist_df, CONFIG['technique']['atr_days'], wilder=use_wilder)
-                # 涨跌幅%
-                if '涨跌幅' in hist_df.columns and '涨跌幅%' not in hist_df.columns:
-                    try:
-                        hist_df['涨跌幅%'] = pd.to_numeric(hist_df['涨跌幅'].astype(str).str.replace('%',''), errors='coerce')
-                    except Exception:
-                        hist_df['涨跌幅%'] = hist_df['收盘'].pct_change()*100
-                elif '涨跌幅%' not in hist_df.columns:
-                    hist_df['涨跌幅%'] = hist_df['收盘'].pct_change()*100
-                latest = hist_df.iloc[-1]
-                close_val = safe_float(latest['收盘'])
-                atr_val = safe_float(latest.get('ATR', np.nan))
-                if close_val and not np.isnan(close_val) and atr_val and not np.isnan(atr_val):
-                    atr_pct = atr_val / close_val * 100.0
-                    hard_atr_ok = bool(atr_pct <= CONFIG['technique']['max_atr_pct'])
-                    # 宽松提示仅打印，不影响标记
-                    if not hard_atr_ok and atr_pct <= atr_soft:
-                        print(f"  * [宽松提醒] ATR边缘 {atr_pct:.2f}% > {CONFIG['technique']['max_atr_pct']}%")
-                # 相对强度
-                if len(hist_df['收盘']) >= rs_days and index_hist_main is not None and not index_hist_main.empty:
-                    rs_value, rs_ok = compute_relative_strength(hist_df, index_hist_main, rs_days)
-                # VWAP
-                if vol is not None and not np.isnan(vol) and vol > 0 and amount is not None and not np.isnan(amount):
-                    vwap_guess = amount / vol if vol != 0 else np.nan
-                    if latest_price and not np.isnan(latest_price) and latest_price * 0.7 <= vwap_guess <= latest_price * 1.3:
-                        vwap = vwap_guess
-                    else:
-                        vwap = amount / (vol * 100) if vol and vol * 100 != 0 else np.nan
-                    if vwap and not np.isnan(vwap) and latest_price and not np.isnan(latest_price):
-                        vwap_ok = latest_price >= vwap * 0.98
-                # 均线多头
-                try:
-                    ma_values = [safe_float(latest.get(f'MA{d}', np.nan)) for d in CONFIG['technique']['ma_list']]
-                    if all(v is not None and not np.isnan(v) for v in ma_values) and not np.isnan(safe_float(latest.get('收盘', np.nan))):
-                        ma_bull_ok = (ma_values[0] > ma_values[1] > ma_values[2] > ma_values[3] and safe_float(latest.get('收盘')) > ma_values[0])
-                except Exception:
-                    pass
-                # 台阶放量
-                try:
-                    stair_ok = is_stair_step_volume(hist_df, CONFIG['technique']['volume_step_days']) if len(hist_df) >= CONFIG['technique']['volume_step_days'] + 1 else None
-                except Exception:
-                    stair_ok = None
-                # 放量突破
-                try:
-                    if len(hist_df) >= CONFIG['technique']['volume_breakout_days'] + 1:
-                        avg_vol = hist_df['成交量'].iloc[-CONFIG['technique']['volume_breakout_days']:-1].mean()
-                        breakout_ok = bool(hist_df['成交量'].iloc[-1] >= avg_vol * CONFIG['technique']['volume_breakout_ratio'])
-                    else:
-                        breakout_ok = None
-                except Exception:
-                    breakout_ok = None
-                # 涨停计数
-                try:
-                    look = em_conf['limit_up_lookback']
-                    if len(hist_df) >= look:
-                        recent_pct = hist_df['涨跌幅%'].iloc[-look:]
-                    else:
-                        recent_pct = hist_df['涨跌幅%']
-                    limit_up_count = int((recent_pct >= em_conf['limit_up_threshold']).sum())
-                except Exception:
-                    limit_up_count = np.nan
-                # 波动收缩度
-                try:
-                    if em_conf.get('enable_vol_contraction') and hist_df['ATR'].notna().sum() > 0:
-                        r_win = em_conf['vol_contraction_recent']
-                        p_win = em_conf['vol_contraction_prev']
-                        if len(hist_df) >= r_win + p_win + 5 and hist_df['ATR'].notna().sum() > (r_win + p_win//2):
-                            recent_atr_mean = hist_df['ATR'].iloc[-r_win:].mean()
-                            prev_atr_mean = hist_df['ATR'].iloc[-(r_win + p_win):-r_win].mean()
-                            if prev_atr_mean and not np.isnan(prev_atr_mean) and prev_atr_mean != 0:
-                                vol_contraction = recent_atr_mean / prev_atr_mean
-                except Exception:
-                    vol_contraction = np.nan
-            # 基本面
-            fund = get_fundamental_indicator(str(stock_code))
-            roe_need = CONFIG['fundamental']['min_roe']
-            nm_need = CONFIG['fundamental']['min_net_margin']
-            roe_v = fund.get('roe', np.nan)
-            nm_v = fund.get('net_margin', np.nan)
-            if CONFIG['fundamental']['enabled']:
-                if (pd.isna(roe_v) or pd.isna(nm_v)):
-                    fundamental_ok = None
+    # 默认值
+    latest_price = safe_float(row[col_price])
+    atr_pct = np.nan
+    hard_atr_ok = None
+    rs_ok = None
+    rs_value = np.nan
+    amount = safe_float(row[col_amount]); vol = safe_float(row[col_volume])
+    vwap = np.nan; vwap_ok = None
+    ma_bull_ok = None
+    stair_ok = None
+    breakout_ok = None
+    limit_up_col = f"近{em_conf['limit_up_lookback']}日涨停数"; limit_up_count = np.nan
+    vol_contraction = np.nan
+    roe_v = np.nan; nm_v = np.nan; fundamental_ok = None
+    data = data or {}
+    try:
+        # 历史数据与技术指标(已由面板引擎统一算好)
+        hist_df = data.get('hist')
+        if hist_df is not None and not hist_df.empty and stock_code in tech_df.index:
+            tech = tech_df.loc[stock_code]
+            as_flag = lambda v: None if v is None else bool(v)
+            hard_atr_ok = as_flag(tech['ATR≤硬阈值'])
+            if hard_atr_ok is not None:
+                atr_pct = float(tech['ATR%'])
+                # 宽松提示仅打印，不影响标记
+                if verbose and not hard_atr_ok and atr_pct <= atr_soft:
+                    print(f"  * [宽松提醒] ATR边缘 {atr_pct:.2f}% > {CONFIG['technique']['max_atr_pct']}%")
+            # 相对强度
+            if len(hist_df['收盘']) >= rs_days and index_hist_main is not None and not index_hist_main.empty:
+                rs_value, rs_ok = compute_relative_strength(hist_df, index_hist_main, rs_days)
+            # VWAP
+            if vol is not None and not np.isnan(vol) and vol > 0 and amount is not None and not np.isnan(amount):
+                vwap_guess = amount / vol if vol != 0 else np.nan
+                if latest_price and not np.isnan(latest_price) and latest_price * 0.7 <= vwap_guess <= latest_price * 1.3:
+                    vwap = vwap_guess
                 else:
-                    fundamental_ok = bool(roe_v >= roe_need and nm_v >= nm_need)
-            else:
+                    vwap = amount / (vol * 100) if vol and vol * 100 != 0 else np.nan
+                if vwap and not np.isnan(vwap) and latest_price and not np.isnan(latest_price):
+                    vwap_ok = latest_price >= vwap * 0.98
+            # 均线多头 / 台阶放量 / 放量突破 / 涨停计数 / 波动收缩度
+            ma_bull_ok = as_flag(tech['均线多头'])
+            stair_ok = as_flag(tech['台阶放量'])
+            breakout_ok = as_flag(tech['放量突破'])
+            limit_up_count = int(tech['涨停数'])
+            vol_contraction = float(tech['波动收缩度'])
+        # 基本面
+        if 'fund' in data:
+            fund = data['fund']
+            if isinstance(fund, Exception):
+                raise fund
+        else:
+            fund = get_fundamental_indicator(str(stock_code))
+        roe_need = CONFIG['fundamental']['min_roe']
+        nm_need = CONFIG['fundamental']['min_net_margin']
+        roe_v = fund.get('roe', np.nan)
+        nm_v = fund.get('net_margin', np.nan)
+        if CONFIG['fundamental']['enabled']:
+            if (pd.isna(roe_v) or pd.isna(nm_v)):
                 fundamental_ok = None
-        except Exception as e:
-            print(f"  - [提示] 计算指标时出错: {e}")
-        # 预筛指标标记（用于展示）
-        prelim_flags = {
-            '涨幅区间': (row[col_change] >= adj_filter['change_rate_min']) and (row[col_change] <= adj_filter['change_rate_max']),
-            '量比≥下限': (row[col_volume_ratio] >= adj_filter['volume_ratio_min']),
-            '换手率区间': (row[col_turnover] >= adj_filter['turnover_rate_min']) and (row[col_turnover] <= adj_filter['turnover_rate_max']),
-            '流通市值区间': (row[col_mv] >= adj_filter['market_cap_min']) and (row[col_mv] <= adj_filter['market_cap_max']),
-            '非ST/非N': (not str(row['名称']).startswith('N')) and ('ST' not in str(row['名称'])),
-        }
-        if intraday_strength:
-            prelim_flags['日内强度≥阈值'] = (row['日内强度'] >= adj_filter.get('intraday_strength_min', 0))
-        if strong_stocks_set:
-            prelim_flags['强势行业'] = (stock_code in strong_stocks_set)
-        # 精选指标标记
-        final_flags = {
-            'ATR≤硬阈值': hard_atr_ok,
-            'RS优于指数': rs_ok,
-            '价≥VWAP(98%)': vwap_ok,
-            '均线多头': ma_bull_ok,
-            '台阶放量': stair_ok,
-            '放量突破': breakout_ok,
-            '基本面合格': fundamental_ok,
-        }
-        # 计算匹配率
-        all_flags = {**prelim_flags, **final_flags}
-        applicable_vals = [v for v in all_flags.values() if isinstance(v, bool)]
-        passed_cnt = int(sum(1 for v in applicable_vals if v))
-        total_cnt = int(len(applicable_vals))
-        match_rate = round((passed_cnt / total_cnt * 100.0), 2) if total_cnt > 0 else np.nan
-        # 新增：区间指标占比(从 涨幅区间 到 放量突破)
-        range_keys = ['涨幅区间','量比≥下限','换手率区间','流通市值区间','非ST/非N','日内强度≥阈值','强势行业','ATR≤硬阈值','RS优于指数','价≥VWAP(98%)','均线多头','台阶放量','放量突破']
-        range_bools = [all_flags[k] for k in range_keys if k in all_flags and isinstance(all_flags[k], bool)]
-        if range_bools:
-            range_rate = round(sum(1 for v in range_bools if v) / len(range_bools) * 100, 2)
+            else:
+                fundamental_ok = bool(roe_v >= roe_need and nm_v >= nm_need)
         else:
-            range_rate = np.nan
-        pretty_flags = {k: ('✓' if v else '✗') if isinstance(v, bool) else '-' for k, v in all_flags.items()}
-        # 记录
-        record = {
-            '代码': stock_code,
-            '名称': stock_name,
-            '最新价': latest_price,
-            '涨跌幅(%)': row[col_change],
-            '换手率(%)': row[col_turnover],
-            '量比': row[col_volume_ratio],
-            rel_col_name: rs_value,
-            'ATR%': atr_pct,
-            '流通市值(亿)': row[col_mv] / 10 ** 8,
-            limit_up_col: limit_up_count,
-            '波动收缩度': vol_contraction,
-            # '所属行业': stock_to_sector_map.get(stock_code, '未知'),
-            '区间指标占比(%)': range_rate,
-        }
-        record.update(pretty_flags)
-        final_selection.append(record)
-    # 不再打印或导出过滤原因统计
-    if not final_selection:
-        print("\n最终筛选结果：没有记录。")
-        return
+            fundamental_ok = None
+    except Exception as e:
+        if verbose:
+            print(f"  - [提示] 计算指标时出错: {e}")
+    # 预筛指标标记（用于展示）
+    prelim_flags = {
+        '涨幅区间': (row[col_change] >= adj_filter['change_rate_min']) and (row[col_change] <= adj_filter['change_rate_max']),
+        '量比≥下限': (row[col_volume_ratio] >= adj_filter['volume_ratio_min']),
+        '换手率区间': (row[col_turnover] >= adj_filter['turnover_rate_min']) and (row[col_turnover] <= adj_filter['turnover_rate_max']),
+        '流通市值区间': (row[col_mv] >= adj_filter['market_cap_min']) and (row[col_mv] <= adj_filter['market_cap_max']),
+        '非ST/非N': (not str(row['名称']).startswith('N')) and ('ST' not in str(row['名称'])),
+    }
+    if cols['intraday']:
+        prelim_flags['日内强度≥阈值'] = (row['日内强度'] >= adj_filter.get('intraday_strength_min', 0))
+    if strong_stocks_set:
+        prelim_flags['强势行业'] = (stock_code in strong_stocks_set)
+    # 精选指标标记
+    final_flags = {
+        'ATR≤硬阈值': hard_atr_ok,
+        'RS优于指数': rs_ok,
+        '价≥VWAP(98%)': vwap_ok,
+        '均线多头': ma_bull_ok,
+        '台阶放量': stair_ok,
+        '放量突破': breakout_ok,
+        '基本面合格': fundamental_ok,
+    }
+    # 计算匹配率
+    all_flags = {**prelim_flags, **final_flags}
+    applicable_vals = [v for v in all_flags.values() if isinstance(v, bool)]
+    passed_cnt = int(sum(1 for v in applicable_vals if v))
+    total_cnt = int(len(applicable_vals))
+    match_rate = round((passed_cnt / total_cnt * 100.0), 2) if total_cnt > 0 else np.nan
+    # 新增：区间指标占比(从 涨幅区间 到 放量突破)
+    range_keys = ['涨幅区间','量比≥下限','换手率区间','流通市值区间','非ST/非N','日内强度≥阈值','强势行业','ATR≤硬阈值','RS优于指数','价≥VWAP(98%)','均线多头','台阶放量','放量突破']
+    range_bools = [all_flags[k] for k in range_keys if k in all_flags and isinstance(all_flags[k], bool)]
+    if range_bools:
+        range_rate = round(sum(1 for v in range_bools if v) / len(range_bools) * 100, 2)
+    else:
+        range_rate = np.nan
+    pretty_flags = {k: ('✓' if v else '✗') if isinstance(v, bool) else '-' for k, v in all_flags.items()}
+    # 记录
+    record = {
+        '代码': stock_code,
+        '名称': stock_name,
+        '最新价': latest_price,
+        '涨跌幅(%)': row[col_change],
+        '换手率(%)': row[col_turnover],
+        '量比': row[col_volume_ratio],
+        rel_col_name: rs_value,
+        'ATR%': atr_pct,
+        '流通市值(亿)': row[col_mv] / 10 ** 8,
+        limit_up_col: limit_up_count,
+        '波动收缩度': vol_contraction,
+        # '所属行业': stock_to_sector_map.get(stock_code, '未知'),
+        '区间指标占比(%)': range_rate,
+    }
+    record.update(pretty_flags)
+    return record
+
+
+def build_result_table(final_selection: list) -> pd.DataFrame:
+    """精选记录 -> 结果表(去掉不展示的列，百分比列保留两位小数)"""
     result_df = pd.DataFrame(final_selection)
     # 删除“基本面合格”与旧的整体占比列（若存在）
     for col in ['基本面合格', '基本面合格✓占比(%)','所属行业']:
@@ -1014,20 +1201,158 @@ def run_stock_screener():
         for c in percent_cols:
             result_df[c] = pd.to_numeric(result_df[c], errors='coerce')
         result_df[percent_cols] = result_df[percent_cols].round(2)
-    pd.options.display.float_format = '{:.2f}'.format
-    # 新增：只导出“区间指标占比(%)”最高前五 (按倒序)
+    return result_df
+
+
+def select_top5(result_df: pd.DataFrame) -> pd.DataFrame:
+    """只导出“区间指标占比(%)”最高前五 (按倒序)"""
     export_df = result_df
     sort_col = '区间指标占比(%)'
     if sort_col in result_df.columns:
         export_df = result_df.sort_values(sort_col, ascending=False).head(5).copy()
     else:
         print(f"警告: 未找到列 {sort_col}，将导出全部。")
+    return export_df
+
+
+def run_stock_screener():
+    print("\n开始执行选股策略...")
+    universe_set, membership_map = build_universe()
+    print("正在获取所有A股实时行情并进行初步筛选...")
+    stock_spot_df = ak.stock_zh_a_spot_em()
+    if stock_spot_df is None or stock_spot_df.empty:
+        print("实时行情获取失败。")
+        return
+    stock_spot_df, cols = prepare_spot(stock_spot_df, universe_set)
+    if stock_spot_df is None:
+        return
+    print(f"上证主板候选数: {len(stock_spot_df)}")
+    ctx = load_screen_context()
+    if ctx is None:
+        return
+    stock_spot_df, conditions = apply_prefilter(stock_spot_df, cols, ctx)
+    pre_selected_df = stock_spot_df[conditions].copy()
+    if pre_selected_df.empty:
+        print("初步筛选后无符合条件的股票。")
+        return
+    print(f"初步筛选完成，共 {len(pre_selected_df)} 只股票进入精选阶段。")
+    # --- 新增：导出进入精选阶段股票快照 ---
+    save_preselect_snapshot(pre_selected_df, cols)
+    # --- 精选逻辑继续 ---
+    # 移除过滤原因统计与剔除逻辑，改为对每只股票标注指标通过情况
+    # 历史行情: 并发预取或逐只获取，随后整体计算技术指标
+    candidate_data = load_candidate_data(pre_selected_df['代码'].tolist())
+    tech_df = compute_candidate_technicals(candidate_data)
+    final_selection = [score_candidate(row, cols, ctx, candidate_data.get(row['代码']), tech_df)
+                       for _, row in pre_selected_df.iterrows()]
+    # 本次新取的财务指标一次性写回缓存
+    if CONFIG['fundamental'].get('enabled'):
+        flush_fundamentals_cache()
+    if get_ttl_cache() is not None:
+        print(f"TTL 缓存(命中, 未命中): {get_ttl_cache().stats()}")
+    # 不再打印或导出过滤原因统计
+    if not final_selection:
+        print("\n最终筛选结果：没有记录。")
+        return
+    result_df = build_result_table(final_selection)
+    pd.options.display.float_format = '{:.2f}'.format
+    # 新增：只导出“区间指标占比(%)”最高前五 (按倒序)
+    export_df = select_top5(result_df)
+    sort_col = '区间指标占比(%)'
     print("\n\n========================= 区间指标占比 Top5 =========================")
     print(export_df)
     print("====================================================================\n")
     filename = f"stock_selection_sh_main_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
     export_df.to_csv(filename, index=False, encoding='utf-8-sig')
     print(f"选股结果已保存到文件(Top5 by {sort_col}): {filename}")
+    return export_df
+
+
+def watch_stock_screener(interval: float = None, max_rounds: int = None):
+    """盘中轮询: 按间隔重新拉取实时快照，与上一轮比较后只重算有变化的股票
+    - 初筛掩码对全部股票向量化重算(毫秒级)，据此得到 新进入 / 移出 的候选
+    - 新进入的候选才取历史行情与财务指标(走本地仓库/缓存)，并补算技术指标
+    - 仍在候选中且行情有变化的股票只用已缓存的历史数据重新打分，不走网络
+    - 行业与风控上下文每隔 context_refresh 秒刷新一次，刷新后全部重算
+    """
+    wconf = CONFIG.get('watch', {})
+    interval = wconf.get('interval', 30) if interval is None else interval
+    watch_cols_keys = ['price', 'change', 'volume_ratio', 'turnover', 'mv', 'amount', 'volume', 'high', 'low']
+    universe_set, _ = build_universe()
+    ctx, ctx_time = None, 0.0
+    prev_spot = None
+    candidate_data = {}
+    tech_df = pd.DataFrame()
+    records = {}
+    last_top = None
+    rounds = 0
+    print(f"\n盘中轮询启动: 间隔 {interval}s")
+    while max_rounds is None or rounds < max_rounds:
+        stop_time = wconf.get('stop_time')
+        if stop_time and datetime.now().strftime('%H:%M') >= stop_time:
+            print(f"已过 {stop_time}，结束盘中轮询。")
+            break
+        rounds += 1
+        t0 = time.perf_counter()
+        try:
+            spot_df = ak.stock_zh_a_spot_em()
+        except Exception as e:
+            spot_df = None
+            print(f"实时行情获取失败: {e}")
+        spot_df, cols = (None, None) if spot_df is None or spot_df.empty else prepare_spot(spot_df, universe_set)
+        if spot_df is not None:
+            if ctx is None or time.time() - ctx_time >= wconf.get('context_refresh', 600):
+                ctx, ctx_time = load_screen_context(), time.time()
+                prev_spot, records = None, {}
+            if ctx is not None:
+                spot_df, conditions = apply_prefilter(spot_df, cols, ctx)
+                spot_df.index = pd.Index(spot_df['代码'])
+                conditions.index = spot_df.index
+                watch_cols = [cols[k] for k in watch_cols_keys if cols[k]]
+                if prev_spot is None:
+                    changed = set(spot_df.index)
+                else:
+                    prev = prev_spot[watch_cols].reindex(spot_df.index)
+                    cur = spot_df[watch_cols]
+                    diff = (cur != prev) & ~(cur.isna() & prev.isna())
+                    changed = set(spot_df.index[diff.any(axis=1)])
+                passing = [c for c in spot_df.index[conditions]]
+                entered = [c for c in passing if c not in records]
+                left = [c for c in records if not conditions.get(c, False)]
+                rescore = [c for c in passing if c in changed or c not in records]
+                need = [c for c in entered if c not in candidate_data]
+                if need:
+                    new_data = load_candidate_data(need)
+                    candidate_data.update(new_data)
+                    new_tech = compute_candidate_technicals(new_data)
+                    tech_df = new_tech if tech_df.empty else pd.concat([tech_df[~tech_df.index.isin(list(new_data))], new_tech])
+                for c in left:
+                    records.pop(c, None)
+                # 与一次性运行一样按 iterrows 取行，保证标量类型(及标记结果)一致
+                for c, row in spot_df.loc[rescore].iterrows():
+                    records[c] = score_candidate(row, cols, ctx, candidate_data.get(c), tech_df, verbose=False)
+                if need and CONFIG['fundamental'].get('enabled'):
+                    flush_fundamentals_cache()
+                prev_spot = spot_df
+                cost = time.perf_counter() - t0
+                print(f"[{datetime.now().strftime('%H:%M:%S')}] 第 {rounds} 轮: 行情变动 {len(changed)} 只, "
+                      f"新进 {len(entered)} / 移出 {len(left)} / 重算 {len(rescore)}, 候选 {len(records)} 只, 耗时 {cost:.3f}s")
+                if records:
+                    # 保持与一次性运行相同的候选顺序(行情表顺序)
+                    result_df = build_result_table([records[c] for c in passing])
+                    top_df = select_top5(result_df)
+                    if last_top is None or not top_df.equals(last_top):
+                        pd.options.display.float_format = '{:.2f}'.format
+                        print("\n========================= 区间指标占比 Top5(盘中) =========================")
+                        print(top_df)
+                        print("==========================================================================\n")
+                        filename = wconf.get('output', 'stock_watch_sh_main.csv')
+                        top_df.to_csv(filename, index=False, encoding='utf-8-sig')
+                        last_top = top_df
+        if max_rounds is not None and rounds >= max_rounds:
+            break
+        time.sleep(max(0.0, interval - (time.perf_counter() - t0)))
+    return last_top
 
 
 def compute_relative_strength(stock_hist: pd.DataFrame, index_hist: pd.DataFrame, days: int):
@@ -1263,7 +1588,7 @@ def compute_future_return(stock_code: str, base_price: float, base_date: datetim
     start = base_date.strftime('%Y%m%d')
     end = (base_date + timedelta(days=horizon+10)).strftime('%Y%m%d')
     try:
-        hist = ak.stock_zh_a_hist(symbol=stock_code, period='daily', start_date=start, end_date=end, adjust='qfq')
+        hist = get_hist_range(stock_code, start, end, adjust='qfq')
     except Exception:
         return np.nan, np.nan
     if hist is None or hist.empty or '日期' not in hist.columns or '收盘' not in hist.columns:
@@ -1283,15 +1608,113 @@ def compute_future_return(stock_code: str, base_price: float, base_date: datetim
     return ret, target['日期']
 
 
-def backtest_top5_performance(horizons=(1,2,5), show_output=True):
-    base_dir = os.path.dirname(__file__)
+def forward_positions(dates: np.ndarray, base_dates: np.ndarray, end_dates: np.ndarray, horizon: int) -> np.ndarray:
+    """对每个基准日，取 (基准日, 截止日] 内第 horizon 根 bar 的位置，不足 horizon 根取区间内最后一根；
+    区间内无数据为 -1。dates 需升序(datetime64[D])，与 compute_future_return 的取数口径一致
+    """
+    lo = np.searchsorted(dates, base_dates, side='right')
+    hi = np.searchsorted(dates, end_dates, side='right')
+    pos = np.where(hi - lo >= horizon, lo + horizon - 1, hi - 1)
+    return np.where(hi > lo, pos, -1)
+
+
+def load_forward_histories(spans: dict, max_horizon: int) -> dict:
+    """每只股票只取一次行情，覆盖其所有基准日所需的区间
+    spans: {代码: (最早基准日, 最晚基准日)}；返回 {代码: (日期数组 datetime64[D], 收盘数组)}
+    """
+    def fetch_one(item):
+        code, (first, last) = item
+        try:
+            hist = get_hist_range(code, first.strftime('%Y%m%d'),
+                                  (last + timedelta(days=max_horizon + 10)).strftime('%Y%m%d'), adjust='qfq')
+        except Exception:
+            hist = None
+        if hist is None or hist.empty or '日期' not in hist.columns or '收盘' not in hist.columns:
+            return code, None
+        dates = pd.to_datetime(hist['日期']).values.astype('datetime64[D]')
+        return code, (dates, pd.to_numeric(hist['收盘'], errors='coerce').to_numpy(dtype=float))
+
+    workers = max(1, int(CONFIG.get('prefetch', {}).get('max_workers', 8)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(executor.map(fetch_one, spans.items()))
+
+
+def evaluate_forward_returns(pairs: pd.DataFrame, horizons) -> pd.DataFrame:
+    """批量计算 Top5 记录的多日收益与指数收益
+    pairs: 列 代码 / 基线价 / 基准日期(date)；返回按 pairs 行顺序、每行依次展开 horizons 的结果
+    个股: 每只股票一次取数，按 searchsorted 定位目标 bar；指数: 整段只取一次
+    """
+    max_h = max(horizons)
+    base_days = pd.to_datetime(pairs['基准日期']).values.astype('datetime64[D]')
+    spans = {}
+    for code, price, d in zip(pairs['代码'], pairs['基线价'], pairs['基准日期']):
+        if price is None or np.isnan(price) or price == 0:
+            continue
+        first, last = spans.get(code, (d, d))
+        spans[code] = (min(first, d), max(last, d))
+    histories = load_forward_histories(spans, max_h)
+
+    # 指数: 覆盖最早基准日前 5 天至今的一段行情
+    idx_dates = idx_close = None
+    if len(pairs):
+        first_day = min(pairs['基准日期'])
+        idx_hist = get_index_hist_data(CONFIG['market_timing']['index_code'],
+                                       days=(datetime.now().date() - first_day).days + 5)
+        if isinstance(idx_hist, pd.DataFrame) and not idx_hist.empty and 'date' in idx_hist.columns:
+            idx_hist = idx_hist.sort_values('date')
+            idx_dates = pd.to_datetime(idx_hist['date']).values.astype('datetime64[D]')
+            idx_close = pd.to_numeric(idx_hist['收盘'], errors='coerce').to_numpy(dtype=float)
+
+    n = len(pairs)
+    out = {h: {'ret': np.full(n, np.nan), 'tgt': np.full(n, np.nan, dtype=object), 'idx': np.full(n, np.nan)}
+           for h in horizons}
+    # 个股: 按代码分组，每组一次 searchsorted
+    codes = pairs['代码'].to_numpy()
+    prices = pairs['基线价'].to_numpy(dtype=float)
+    for code, rows in pd.Series(np.arange(n)).groupby(codes).groups.items():
+        data = histories.get(code)
+        if data is None:
+            continue
+        dates, close = data
+        rows = np.asarray(rows)
+        for h in horizons:
+            pos = forward_positions(dates, base_days[rows], base_days[rows] + np.timedelta64(h + 10, 'D'), h)
+            ok = pos >= 0
+            tgt_close = np.where(ok, close[np.where(ok, pos, 0)], np.nan)
+            ok &= ~np.isnan(tgt_close) & (tgt_close != 0) & ~np.isnan(prices[rows]) & (prices[rows] != 0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ret = (tgt_close / prices[rows] - 1) * 100
+            out[h]['ret'][rows[ok]] = ret[ok]
+            out[h]['tgt'][rows[ok]] = [d.item() for d in dates[pos[ok]]]
+    # 指数: 基准价取 [基准日-5, 基准日] 最后一根，目标取 (基准日, 基准日+max_h+10] 内第 h 根
+    if idx_dates is not None:
+        base_pos = np.searchsorted(idx_dates, base_days, side='right') - 1
+        base_ok = (base_pos >= 0) & (idx_dates[np.maximum(base_pos, 0)] >= base_days - np.timedelta64(5, 'D'))
+        base_close = np.where(base_ok, idx_close[np.maximum(base_pos, 0)], np.nan)
+        for h in horizons:
+            pos = forward_positions(idx_dates, base_days, base_days + np.timedelta64(max_h + 10, 'D'), h)
+            tgt_close = np.where(pos >= 0, idx_close[np.maximum(pos, 0)], np.nan)
+            ok = (pos >= 0) & base_ok & (base_close != 0) & (tgt_close != 0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[h]['idx'] = np.where(ok, (tgt_close / base_close - 1) * 100, np.nan)
+
+    records = []
+    for i in range(n):
+        for h in horizons:
+            records.append({'H': h, 'H日收益(%)': out[h]['ret'][i], 'H日指数收益(%)': out[h]['idx'][i],
+                            'H目标日期': out[h]['tgt'][i]})
+    return pd.DataFrame(records)
+
+
+def backtest_top5_performance(horizons=(1,2,5), show_output=True, base_dir: str = None):
+    """历史 Top5 文件的多日收益回测(全部文件的个股/指数行情批量获取，每只股票与指数各只取一次)"""
+    base_dir = base_dir or os.path.dirname(__file__)
     items = list_top5_files(base_dir)
     if not items:
         print("无历史Top5文件可回测。")
         return
-    index_code = CONFIG['market_timing']['index_code']
-    perf_rows = []
-    summary_rows = []
+    # 收集全部文件的 (代码, 基准日期, 基线价)
+    pair_rows = []
     for d, fname, full in items:
         try:
             df = pd.read_csv(full)
@@ -1302,69 +1725,35 @@ def backtest_top5_performance(horizons=(1,2,5), show_output=True):
             continue
         df['最新价'] = pd.to_numeric(df['最新价'], errors='coerce')
         df = df.dropna(subset=['最新价'])
-        if df.empty:
-            continue
-        try:
-            idx_hist = ak.stock_zh_index_daily(symbol=index_code.replace('sh','').replace('sz',''))
-        except Exception:
-            idx_hist = None
-        idx_sub = None
-        if isinstance(idx_hist, pd.DataFrame) and not idx_hist.empty and 'date' in idx_hist.columns and 'close' in idx_hist.columns:
-            idx_hist['date'] = pd.to_datetime(idx_hist['date']).dt.date
-            idx_sub = idx_hist[(idx_hist['date'] >= (d - timedelta(days=5))) & (idx_hist['date'] <= (d + timedelta(days=max(horizons)+10)))]
         for _, r in df.iterrows():
-            code = str(r['代码']); base_price = safe_float(r['最新价']); name = r.get('名称','')
-            for h in horizons:
-                ret, tgt_date = compute_future_return(code, base_price, d, h)
-                idx_ret = np.nan
-                if idx_sub is not None and not idx_sub.empty:
-                    after_idx = idx_sub[idx_sub['date'] > d]
-                    if not after_idx.empty:
-                        if len(after_idx) >= h:
-                            idx_target = after_idx.iloc[h-1]
-                        else:
-                            idx_target = after_idx.iloc[-1]
-                        base_idx_series = idx_sub[idx_sub['date'] <= d]
-                        if not base_idx_series.empty:
-                            base_close = safe_float(base_idx_series.iloc[-1]['close'])
-                            tgt_close = safe_float(idx_target['close'])
-                            if base_close and tgt_close:
-                                idx_ret = (tgt_close / base_close - 1) * 100
-                alpha = ret - idx_ret if (not np.isnan(ret) and not np.isnan(idx_ret)) else np.nan
-                perf_rows.append({
-                    '基准日期': d,
-                    '文件': fname,
-                    '代码': code,
-                    '名称': name,
-                    '基线价': base_price,
-                    'H': h,
-                    'H日收益(%)': ret,
-                    'H日指数收益(%)': idx_ret,
-                    'H日超额收益(%)': alpha,
-                    'H目标日期': tgt_date
-                })
-        for h in horizons:
-            subset = [row for row in perf_rows if row['基准日期']==d and row['H']==h]
-            if not subset:
-                continue
-            rets = [row['H日收益(%)'] for row in subset if not np.isnan(row['H日收益(%)'])]
-            alphas = [row['H日超额收益(%)'] for row in subset if not np.isnan(row['H日超额收益(%)'])]
-            if rets:
-                summary_rows.append({
-                    '基准日期': d,
-                    'H': h,
-                    '样本数': len(rets),
-                    '平均收益(%)': round(np.mean(rets),2),
-                    '中位数收益(%)': round(np.median(rets),2),
-                    '胜率(>0%)': round(sum(r>0 for r in rets)/len(rets)*100,2),
-                    '>2%占比': round(sum(r>2 for r in rets)/len(rets)*100,2),
-                    '>5%占比': round(sum(r>5 for r in rets)/len(rets)*100,2),
-                    '平均超额(%)': round(np.mean(alphas),2) if alphas else np.nan
-                })
-    if not perf_rows:
+            pair_rows.append({'基准日期': d, '文件': fname, '代码': str(r['代码']), '名称': r.get('名称',''),
+                              '基线价': safe_float(r['最新价'])})
+    if not pair_rows:
         print("未生成任何绩效记录。")
         return
-    perf_df = pd.DataFrame(perf_rows)
+    pairs = pd.DataFrame(pair_rows)
+    t0 = time.time()
+    fwd = evaluate_forward_returns(pairs, horizons)
+    print(f"批量计算 {len(pairs)} 条记录 x {len(horizons)} 个周期, 涉及 {pairs['代码'].nunique()} 只股票, 耗时 {time.time() - t0:.2f}s")
+    perf_df = pd.concat([pairs.loc[pairs.index.repeat(len(horizons))].reset_index(drop=True), fwd], axis=1)
+    perf_df['H日超额收益(%)'] = perf_df['H日收益(%)'] - perf_df['H日指数收益(%)']
+    perf_df = perf_df[['基准日期','文件','代码','名称','基线价','H','H日收益(%)','H日指数收益(%)','H日超额收益(%)','H目标日期']]
+    summary_rows = []
+    for (d, h), subset in perf_df.groupby(['基准日期', 'H'], sort=True):
+        rets = subset['H日收益(%)'].dropna().tolist()
+        alphas = subset['H日超额收益(%)'].dropna().tolist()
+        if rets:
+            summary_rows.append({
+                '基准日期': d,
+                'H': h,
+                '样本数': len(rets),
+                '平均收益(%)': round(np.mean(rets),2),
+                '中位数收益(%)': round(np.median(rets),2),
+                '胜率(>0%)': round(sum(r>0 for r in rets)/len(rets)*100,2),
+                '>2%占比': round(sum(r>2 for r in rets)/len(rets)*100,2),
+                '>5%占比': round(sum(r>5 for r in rets)/len(rets)*100,2),
+                '平均超额(%)': round(np.mean(alphas),2) if alphas else np.nan
+            })
     summary_df = pd.DataFrame(summary_rows)
     for c in ['H日收益(%)','H日指数收益(%)','H日超额收益(%)']:
         if c in perf_df.columns:
@@ -1380,10 +1769,17 @@ def backtest_top5_performance(horizons=(1,2,5), show_output=True):
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='选股脚本运行模式')
-    parser.add_argument('--mode', choices=['run','backtest_top5'], default='run')
+    parser.add_argument('--mode', choices=['run','backtest_top5','scan','watch'], default='run')
+    parser.add_argument('--interval', type=float, default=None, help='watch 模式轮询间隔(秒)，默认取 CONFIG.watch.interval')
+    parser.add_argument('--rounds', type=int, default=None, help='watch 模式最多轮询次数，默认直到 stop_time')
     args = parser.parse_args()
     if args.mode == 'backtest_top5':
         backtest_top5_performance()
+    elif args.mode == 'scan':
+        scan_universe_technicals()
+    elif args.mode == 'watch':
+        if check_trading_time() and check_market_regime():
+            watch_stock_screener(args.interval, args.rounds)
     else:
         if check_trading_time():
             track_previous_top5()
@@ -0,0 +1,331 @@
+"""
+动态均值止盈/止跌回测的公共内核：均值一次性算好，持仓/现金状态机在普通数组上逐日推进。
+供 动态止盈止跌.py / 动态止盈止跌2.py / 多股票测试和数据存Excel.py 共用，结果与原先
+逐行 df.loc 取值、每天重新求均值的写法逐位一致。
+
+直接运行本文件: 与原逐行写法比对并测速，并自检共享本金上限(run_shared_principal_tracking)
+"""
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def trailing_mean(close, window: int, warmup: str = 'partial') -> np.ndarray:
+    """最近 window 日收盘均值(含当日)
+    warmup: 前 window-1 天的处理方式
+      'partial' - 用已有的全部数据求均值(即 df.loc[max(0, i-window+1):i].mean())
+      'price'   - 直接取当日价
+    每个窗口都按 Series.mean() 的方式单独求和再除以个数，保证与原写法逐位相同
+    """
+    close = np.asarray(close, dtype=float)
+    n = len(close)
+    avg = np.empty(n)
+    if n >= window:
+        avg[window - 1:] = sliding_window_view(close, window).sum(axis=1) / window
+    head = min(window - 1, n)
+    for i in range(head):
+        avg[i] = close[i] if warmup == 'price' else close[:i + 1].sum() / (i + 1)
+    return avg
+
+
+def run_avg_rebalance(close, avg, init_invest, max_invest) -> dict:
+    """动态止盈止跌.py 的状态机: 跌破均值 5% 按亏损额补仓(受最大投入限制)，高于均值 10% 卖出超出均值部分
+    返回逐日的交易前市值/投入、每日收盘后市值、补仓/止盈点(位置, 价格, 均值, 金额)和期末持仓
+    """
+    close = np.asarray(close, dtype=float).tolist()
+    avg = np.asarray(avg, dtype=float).tolist()
+    shares = init_invest / close[0]
+    cash = 0
+    total_invest = init_invest
+    value_before, invest_before, history_value = [], [], []
+    add_points, sell_points = [], []
+    for i, (price, avg_price) in enumerate(zip(close, avg)):
+        value = shares * price + cash
+        value_before.append(value)
+        invest_before.append(total_invest)
+        # 动态止跌
+        if price <= avg_price * 0.95:
+            target_value = shares * avg_price
+            loss = max(target_value - value, 0)
+            available_invest = max_invest - total_invest
+            invest_amount = min(loss, available_invest, cash + loss)
+            if invest_amount > 0:
+                add_shares = invest_amount / price
+                shares += add_shares
+                total_invest += invest_amount
+                cash -= max(0, invest_amount - loss)
+                add_points.append((i, price, avg_price, invest_amount))
+        # 动态止盈
+        elif price >= avg_price * 1.10:
+            target_value = shares * avg_price
+            profit = max(value - target_value, 0)
+            if profit > 0:
+                sell_shares = profit / price
+                shares -= sell_shares
+                cash += profit
+                sell_points.append((i, price, avg_price, profit))
+        history_value.append(shares * price + cash)
+    return {'value_before': value_before, 'invest_before': invest_before, 'history_value': history_value,
+            'add_points': add_points, 'sell_points': sell_points,
+            'shares': shares, 'cash': cash, 'total_invest': total_invest}
+
+
+def run_dynamic_max(close, avg, init_invest, max_invest, down_factor, up_factor) -> dict:
+    """动态止盈止跌2.py 的状态机: 补仓部分锁定不参与止盈，止盈套现回补可用额度
+    events: 按发生顺序的 (位置, '补仓'/'止盈', 金额, 股数, 交易后投入, 交易后可用额度)
+    """
+    close = np.asarray(close, dtype=float).tolist()
+    avg = np.asarray(avg, dtype=float).tolist()
+    shares = init_invest / close[0]
+    cash = 0
+    total_invest = init_invest
+    current_max_invest = max_invest
+    locked_shares = 0
+    value_before, invest_before, max_before, history_value = [], [], [], []
+    events = []
+    for i, (price, avg_price) in enumerate(zip(close, avg)):
+        value = shares * price + cash
+        value_before.append(value)
+        invest_before.append(total_invest)
+        max_before.append(current_max_invest)
+        # 止跌补仓
+        if price <= avg_price * down_factor:
+            loss = max(shares * avg_price - value, 0)
+            invest_amount = min(loss, current_max_invest)
+            if invest_amount > 0:
+                add_shares = invest_amount / price
+                shares += add_shares
+                locked_shares += add_shares
+                total_invest += invest_amount
+                current_max_invest -= invest_amount
+                events.append((i, '补仓', invest_amount, add_shares, total_invest, current_max_invest))
+        # 止盈卖出
+        tradable_shares = shares - locked_shares
+        if tradable_shares > 0 and price >= avg_price * up_factor:
+            target_value = tradable_shares * avg_price
+            profit = max(tradable_shares * price - target_value, 0)
+            if profit > 0:
+                sell_shares = profit / price
+                sell_shares = min(sell_shares, tradable_shares)
+                shares -= sell_shares
+                cash += profit
+                total_invest -= sell_shares * avg_price
+                current_max_invest += profit
+                events.append((i, '止盈', profit, sell_shares, total_invest, current_max_invest))
+        history_value.append(shares * price + cash)
+    return {'value_before': value_before, 'invest_before': invest_before, 'max_before': max_before,
+            'history_value': history_value, 'events': events,
+            'shares': shares, 'cash': cash, 'total_invest': total_invest}
+
+
+def run_principal_tracking(close, avg, init_invest, max_invest, down_factor, up_factor) -> dict:
+    """多股票测试和数据存Excel.py 的状态机: 首日满仓，跌破均值补剩余额度的 10%，高于均值卖出一半
+    返回逐日的 操作/详情/投入本金/股票市值/账户现金/账户总市值 列表及期末持仓
+    """
+    close = np.asarray(close, dtype=float).tolist()
+    avg = np.asarray(avg, dtype=float).tolist()
+    shares = 0.0
+    cash = init_invest
+    total_invested_principal = 0.0
+    actions, details, principal, stock_value, cash_list, total_value = [], [], [], [], [], []
+    for i, (price, avg_price) in enumerate(zip(close, avg)):
+        action = ""
+        detail = ""
+        # 初始买入
+        if i == 0:
+            buy_shares = cash / price
+            shares += buy_shares
+            total_invested_principal += cash
+            cash = 0
+            action = "初始买入"
+            detail = f"买入={buy_shares:.2f}股"
+        # 动态均值止跌补仓
+        elif price <= avg_price * down_factor and total_invested_principal < max_invest:
+            add_invest_amount = (max_invest - total_invested_principal) / 10  # 每次最多补仓剩余最大投资额的10%
+            if add_invest_amount > 0:
+                add_shares = add_invest_amount / price
+                shares += add_shares
+                total_invested_principal += add_invest_amount
+                action = "止跌补仓"
+                detail = f"补仓={add_invest_amount:.2f}"
+        # 动态均值止盈卖出
+        elif price >= avg_price * up_factor and shares > 0:
+            sell_ratio = 0.5  # 卖出持仓的50%
+            sell_shares = shares * sell_ratio
+            if sell_shares > 0:
+                sell_value = sell_shares * price
+                cash += sell_value
+                shares -= sell_shares
+                # 调整已投入本金，以反映卖出
+                avg_cost = total_invested_principal / (shares + sell_shares)
+                total_invested_principal = shares * avg_cost
+                action = "止盈卖出"
+                detail = f"卖出={sell_shares:.2f}股"
+        actions.append(action)
+        details.append(detail)
+        principal.append(total_invested_principal)
+        stock_value.append(shares * price)
+        cash_list.append(cash)
+        total_value.append(shares * price + cash)
+    return {'action': actions, 'detail': details, 'principal': principal, 'stock_value': stock_value,
+            'cash': cash_list, 'total_value': total_value,
+            'shares': shares, 'final_cash': cash, 'total_invested_principal': total_invested_principal}
+
+
+def run_shared_principal_tracking(series, init_invest, max_invest, portfolio_max_invest, down_factor,
+                                  up_factor) -> list:
+    """多只股票共用一个组合投入本金上限的 run_principal_tracking
+    series: [(day, close, avg)]，day 为该股票各交易日在合并日历中的序号(升序)
+    按合并日历逐日推进，同一天内按 series 顺序处理；每次买入前检查全部股票的投入本金之和，
+    买入额取 min(原买入额, portfolio_max_invest - 组合已投入本金)，额度不足时记"额度不足"；
+    止盈卖出降低投入本金后，腾出的额度可被任何一只股票使用
+    首日未投出的部分留在该股票的账户现金里。返回与 series 一一对应的结果，格式同 run_principal_tracking
+    """
+    n = len(series)
+    days = [np.asarray(day, dtype=np.int64).tolist() for day, _, _ in series]
+    closes = [np.asarray(close, dtype=float).tolist() for _, close, _ in series]
+    avgs = [np.asarray(avg, dtype=float).tolist() for _, _, avg in series]
+    pos = [0] * n
+    shares = [0.0] * n
+    cash = [float(init_invest)] * n
+    principal = [0.0] * n
+    out = [{'action': [], 'detail': [], 'principal': [], 'stock_value': [], 'cash': [], 'total_value': []}
+           for _ in range(n)]
+    combined = 0.0
+    n_days = max((d[-1] + 1 for d in days if d), default=0)
+    for today in range(n_days):
+        for k in range(n):
+            i = pos[k]
+            if i >= len(days[k]) or days[k][i] != today:
+                continue
+            pos[k] += 1
+            price, avg_price = closes[k][i], avgs[k][i]
+            available = portfolio_max_invest - combined
+            action = ""
+            detail = ""
+            if i == 0:
+                amount = min(cash[k], available)
+                if amount > 0:
+                    buy_shares = amount / price
+                    shares[k] += buy_shares
+                    principal[k] += amount
+                    cash[k] -= amount
+                    action = "初始买入"
+                    detail = f"买入={buy_shares:.2f}股"
+                else:
+                    action = "额度不足"
+            elif price <= avg_price * down_factor and principal[k] < max_invest:
+                add_invest_amount = min((max_invest - principal[k]) / 10, available)
+                if add_invest_amount > 0:
+                    shares[k] += add_invest_amount / price
+                    principal[k] += add_invest_amount
+                    action = "止跌补仓"
+                    detail = f"补仓={add_invest_amount:.2f}"
+                else:
+                    action = "额度不足"
+            elif price >= avg_price * up_factor and shares[k] > 0:
+                sell_shares = shares[k] * 0.5
+                cash[k] += sell_shares * price
+                avg_cost = principal[k] / shares[k]
+                shares[k] -= sell_shares
+                principal[k] = shares[k] * avg_cost
+                action = "止盈卖出"
+                detail = f"卖出={sell_shares:.2f}股"
+            combined = sum(principal)
+            rec = out[k]
+            rec['action'].append(action)
+            rec['detail'].append(detail)
+            rec['principal'].append(principal[k])
+            rec['stock_value'].append(shares[k] * price)
+            rec['cash'].append(cash[k])
+            rec['total_value'].append(shares[k] * price + cash[k])
+    for k in range(n):
+        out[k].update(shares=shares[k], final_cash=cash[k], total_invested_principal=principal[k])
+    return out
+
+
+def _bench(n_days=2500, window=10, repeat=3):
+    """与原逐行 df.loc 写法(多股票测试和数据存Excel.py 版本)比对逐日记录并测速"""
+    import time
+
+    rng = np.random.default_rng(7)
+    dates = pd.bdate_range('2015-01-01', periods=n_days)
+    close = np.round(20 * np.exp(np.cumsum(rng.normal(0, 0.02, n_days))), 2)
+    df = pd.DataFrame({'Date': dates, 'Close': close})
+    init_invest, max_invest, down_factor, up_factor = 10000, 50000, 0.95, 1.15
+
+    def reference():
+        shares, cash, principal = 0.0, init_invest, 0.0
+        rows = []
+        for i in range(len(df)):
+            price = df.loc[i, 'Close']
+            avg_price = df.loc[i - window + 1:i, 'Close'].mean() if i >= window - 1 else price
+            action = ""
+            if i == 0:
+                shares += cash / price; principal += cash; cash = 0; action = "初始买入"
+            elif price <= avg_price * down_factor and principal < max_invest:
+                add = (max_invest - principal) / 10
+                if add > 0:
+                    shares += add / price; principal += add; action = "止跌补仓"
+            elif price >= avg_price * up_factor and shares > 0:
+                sell = shares * 0.5
+                if sell > 0:
+                    cash += sell * price; shares -= sell
+                    principal = shares * (principal / (shares + sell)); action = "止盈卖出"
+            rows.append((avg_price, action, principal, shares * price, cash, shares * price + cash))
+        return rows
+
+    def kernel():
+        avg = trailing_mean(close, window, warmup='price')
+        res = run_principal_tracking(close, avg, init_invest, max_invest, down_factor, up_factor)
+        return list(zip(avg.tolist(), res['action'], res['principal'], res['stock_value'], res['cash'],
+                        res['total_value']))
+
+    t0 = time.perf_counter()
+    expected = reference()
+    ref_cost = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        got = kernel()
+    kernel_cost = (time.perf_counter() - t0) / repeat
+    assert got == expected, "内核结果与逐行写法不一致"
+    trades = sum(1 for r in got if r[1])
+    print(f"{n_days} 个交易日, {trades} 次操作, 逐日记录完全一致")
+    print(f"逐行 df.loc: {ref_cost * 1000:.1f} ms, 内核: {kernel_cost * 1000:.2f} ms, 加速 {ref_cost / kernel_cost:.0f}x")
+
+
+def _check_shared_cap(n_stocks=6, n_days=750, portfolio_max_invest=60000):
+    """共享本金上限的自检：不设上限时与逐只模拟逐位一致；设上限时组合投入本金每天都不超过上限"""
+    rng = np.random.default_rng(11)
+    init_invest, max_invest, window, down_factor, up_factor = 10000, 50000, 5, 0.95, 1.15
+    series, single = [], []
+    for k in range(n_stocks):
+        start = int(rng.integers(0, n_days // 3))
+        day = np.arange(start, n_days)
+        day = day[rng.random(len(day)) > 0.05]  # 随机停牌
+        close = np.round(20 * np.exp(np.cumsum(rng.normal(0, 0.02, len(day)))), 2)
+        avg = trailing_mean(close, window, warmup='price')
+        series.append((day, close, avg))
+        single.append(run_principal_tracking(close, avg, init_invest, max_invest, down_factor, up_factor))
+
+    uncapped = run_shared_principal_tracking(series, init_invest, max_invest, float('inf'), down_factor, up_factor)
+    for got, expected in zip(uncapped, single):
+        assert got == expected, "不设组合上限时与逐只模拟不一致"
+
+    capped = run_shared_principal_tracking(series, init_invest, max_invest, portfolio_max_invest,
+                                           down_factor, up_factor)
+    combined = np.zeros(n_days)
+    for (day, _, _), res in zip(series, capped):
+        principal = np.full(n_days, np.nan)
+        principal[day] = res['principal']
+        combined += pd.Series(principal).ffill().fillna(0).to_numpy()
+    peak = combined.max()
+    assert peak <= portfolio_max_invest + 1e-6, f"组合投入本金 {peak:.2f} 超过上限 {portfolio_max_invest}"
+    short = sum(r['action'].count("额度不足") for r in capped)
+    print(f"{n_stocks} 只股票共享上限 {portfolio_max_invest}: 投入本金峰值 {peak:.2f}, 额度不足 {short} 次; "
+          f"不设上限时与逐只模拟逐位一致")
+
+
+if __name__ == '__main__':
+    _bench()
+    _check_shared_cap()
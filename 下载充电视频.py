@@ -1,10 +1,13 @@
 import re
 import os
-import requests
 from pathlib import Path
 import shutil
 import subprocess
 
+from bili_api import get_api
+from download_metrics import metrics
+from ranged_download import download_ranged, get_session
+
 
 # ----------------- MODIFIED START -----------------
 
@@ -34,49 +37,22 @@ def extract_bvid(url: str):
     raise ValueError("未能解析到 BVID，请确认输入的是具体视频地址")
 
 
-# 获取视频播放信息
+# 获取视频播放信息(共享 Session + 本地缓存，见 bili_api)
 def get_play_info(bvid: str, headers):
-    api = f"https://api.bilibili.com/x/player/pagelist?bvid={bvid}&jsonp=jsonp"
-    resp = requests.get(api, headers=headers)
-    resp.raise_for_status()  # 确保请求成功
-    data = resp.json()
-    if data["code"] != 0:
-        raise Exception(f"获取视频分页信息失败: {data.get('message', '未知错误')}")
-    return data["data"]
+    return get_api(headers).get_pagelist(bvid)
 
 
-# 获取视频下载地址
+# 获取视频下载地址，缓存到签名过期前
+# qn=112 为 1080P 高码率, qn=80 为 1080P 高清，可在 BiliAPI(qn=...) 调整；fnval=16 表示请求DASH格式的流
 def get_download_url(bvid: str, cid: int, headers):
-    # qn=112 为 1080P 高码率, qn=80 为 1080P 高清。可以按需调整
-    # fnval=16 表示请求DASH格式的流
-    api = f"https://api.bilibili.com/x/player/playurl?bvid={bvid}&cid={cid}&qn=80&fnval=16"
-    resp = requests.get(api, headers=headers)
-    resp.raise_for_status()
-    resp_json = resp.json()
-    if resp_json["code"] != 0:
-        raise Exception(f"获取播放地址失败: {resp_json.get('message', '未知错误')}")
+    return get_api(headers).get_playurl(bvid, cid)
 
-    try:
-        video_url = resp_json["data"]["dash"]["video"][0]["baseUrl"]
-        audio_url = resp_json["data"]["dash"]["audio"][0]["baseUrl"]
-        return video_url, audio_url
-    except (KeyError, IndexError):
-        # 兼容一些老视频可能没有DASH格式
-        durl = resp_json["data"]["durl"]
-        if durl:
-            return durl[0]["url"], None
-        raise Exception("无法解析到有效的视频下载地址")
-
-
-# 下载文件
+
+# 下载文件: 多连接 Range 分块并发下载，中断后重跑按 .dlstate.json 续传，完成后校验大小
+# 所有文件共用同一个 Session，视频、音频和各分P之间复用连接
 def download_file(url: str, filename: str, headers):
     print(f"开始下载: {Path(filename).name}")
-    with requests.get(url, headers=headers, stream=True) as r:
-        r.raise_for_status()
-        with open(filename, "wb") as f:
-            for chunk in r.iter_content(chunk_size=1024 * 1024):  # 1MB per chunk
-                if chunk:
-                    f.write(chunk)
+    download_ranged(url, filename, session=get_session(headers))
     print(f"下载完成: {Path(filename).name}")
 
 
@@ -97,7 +73,8 @@ def merge_av(video_file: str, audio_file: str, output_file: str):
         output_file
     ]
     # 使用 subprocess.PIPE 来捕获输出，避免在控制台打印过多ffmpeg信息
-    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    with metrics.stage("ffmpeg", Path(output_file).name):
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
     if result.returncode != 0:
         print("FFmpeg 错误信息:", result.stderr)
     print("合并完成！")
@@ -151,6 +128,8 @@ def bilibili_downloader(url: str, cookie: str):
 
     except Exception as e:
         print(f"发生错误: {e}")
+    finally:
+        metrics.report()
 
 
 if __name__ == "__main__":
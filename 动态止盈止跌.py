@@ -2,6 +2,8 @@ import akshare as ak
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from strategy_kernel import run_avg_rebalance, trailing_mean
+
 def simulate_avg_strategy_with_plot(stock_code, buy_date_str, end_date_str, init_invest=10000, max_invest=50000, window=5):
     """
     动态均值止盈/止跌策略回测，支持最大投入金额和止盈资金再投入，图上标注均值和交易点
@@ -27,56 +29,19 @@ def simulate_avg_strategy_with_plot(stock_code, buy_date_str, end_date_str, init
         print("买入日不在交易日范围内")
         return
 
-    # 初始化
-    buy_price = df.loc[0, 'Close']
-    shares = init_invest / buy_price
-    cash = 0
-    total_invest = init_invest
-    history_value = []
-
-    add_points = []  # 补仓
-    sell_points = []  # 止盈
-    avg_list = []  # 每日均值
-
-    for i in range(len(df)):
-        price = df.loc[i, 'Close']
-
-        # 计算前 window 个交易日均值
-        if i < window:
-            avg_price = df.loc[:i, 'Close'].mean()
-        else:
-            avg_price = df.loc[i-window+1:i, 'Close'].mean()
-        avg_list.append(avg_price)
-
-        value = shares * price + cash
-
-        # 输出核对信息
-        print(f"{df.loc[i, 'Date'].date()} 当前价={price:.2f}, {window}日均值={avg_price:.2f}, 当前市值={value:.2f}, 总投入={total_invest:.2f}")
-
-        # 动态止跌
-        if price <= avg_price * 0.95:
-            target_value = shares * avg_price
-            loss = max(target_value - value, 0)
-            available_invest = max_invest - total_invest
-            invest_amount = min(loss, available_invest, cash + loss)
-            if invest_amount > 0:
-                add_shares = invest_amount / price
-                shares += add_shares
-                total_invest += invest_amount
-                cash -= max(0, invest_amount - loss)
-                add_points.append((df.loc[i, 'Date'], price, avg_price, invest_amount))
+    # 前 window 个交易日均值(一次算好) + 逐日状态机
+    avg_list = trailing_mean(df['Close'], window, warmup='partial').tolist()
+    res = run_avg_rebalance(df['Close'], avg_list, init_invest, max_invest)
+    shares, cash, total_invest = res['shares'], res['cash'], res['total_invest']
+    history_value = res['history_value']
 
-        # 动态止盈
-        elif price >= avg_price * 1.10:
-            target_value = shares * avg_price
-            profit = max(value - target_value, 0)
-            if profit > 0:
-                sell_shares = profit / price
-                shares -= sell_shares
-                cash += profit
-                sell_points.append((df.loc[i, 'Date'], price, avg_price, profit))
+    # 输出核对信息
+    for date, price, avg_price, value, invest in zip(df['Date'], df['Close'], avg_list,
+                                                     res['value_before'], res['invest_before']):
+        print(f"{date.date()} 当前价={price:.2f}, {window}日均值={avg_price:.2f}, 当前市值={value:.2f}, 总投入={invest:.2f}")
 
-        history_value.append(shares * price + cash)
+    add_points = [(df.loc[i, 'Date'], price, avg_price, amount) for i, price, avg_price, amount in res['add_points']]  # 补仓
+    sell_points = [(df.loc[i, 'Date'], price, avg_price, profit) for i, price, avg_price, profit in res['sell_points']]  # 止盈
 
     # 绘图
     plt.figure(figsize=(14,6))
@@ -116,4 +81,5 @@ def simulate_avg_strategy_with_plot(stock_code, buy_date_str, end_date_str, init
     print(f"总收益: {profit:.2f}, 收益率: {profit_rate:.2f}% (相对于初始本金)")
 
 # 示例调用
-simulate_avg_strategy_with_plot("000006", "2024-08-01", "2025-08-01", init_invest=10000, max_invest=50000, window=5)
+if __name__ == "__main__":
+    simulate_avg_strategy_with_plot("000006", "2024-08-01", "2025-08-01", init_invest=10000, max_invest=50000, window=5)
@@ -2,6 +2,8 @@ import akshare as ak
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from strategy_kernel import run_dynamic_max, trailing_mean
+
 def simulate_strategy_dynamic_max_correct(stock_code, buy_date_str, end_date_str,
                                           init_invest=10000, max_invest=50000, window=5,down_max_invest=0.2,up_max_invest=0.2):
     """
@@ -28,57 +30,27 @@ def simulate_strategy_dynamic_max_correct(stock_code, buy_date_str, end_date_str
         print("买入日不在交易日范围内")
         return
 
-    # 初始化
-    shares = init_invest / df.loc[0, 'Close']
-    cash = 0
-    total_invest = init_invest
-    current_max_invest = max_invest
-    locked_shares = 0  # 补仓锁定股份
-    history_value = []
+    # 前 window 日均值(一次算好) + 逐日状态机
+    avg_list = trailing_mean(df['Close'], window, warmup='partial').tolist()
+    res = run_dynamic_max(df['Close'], avg_list, init_invest, max_invest, down_max_invest, up_max_invest)
+    shares, cash, total_invest = res['shares'], res['cash'], res['total_invest']
+    history_value = res['history_value']
 
     add_points = []
     sell_points = []
-    avg_list = []
-
-    for i in range(len(df)):
-        price = df.loc[i, 'Close']
-
-        # 前 window 日均值
-        avg_price = df.loc[max(0, i-window+1):i, 'Close'].mean()
-        avg_list.append(avg_price)
-
-        value = shares * price + cash
-        print(f"{df.loc[i, 'Date'].date()} 当前价={price:.2f}, {window}日均值={avg_price:.2f}, 市值={value:.2f}, 当前投入={total_invest:.2f}, max_invest可用={current_max_invest:.2f}")
-
-        # 止跌补仓
-        if price <= avg_price * down_max_invest:
-            loss = max(shares * avg_price - value, 0)
-            invest_amount = min(loss, current_max_invest)
-            if invest_amount > 0:
-                add_shares = invest_amount / price
-                shares += add_shares
-                locked_shares += add_shares
-                total_invest += invest_amount
-                current_max_invest -= invest_amount
-                add_points.append((df.loc[i, 'Date'], price, avg_price, invest_amount, total_invest, current_max_invest))
-                print(f"  → 止跌补仓: 补仓金额={invest_amount:.2f}, 当前价格={price:.2f}, 均值={avg_price:.2f}, 更新投入={total_invest:.2f}, max_invest可用={current_max_invest:.2f}")
-
-        # 止盈卖出
-        tradable_shares = shares - locked_shares
-        if tradable_shares > 0 and price >= avg_price * up_max_invest:
-            target_value = tradable_shares * avg_price
-            profit = max(tradable_shares * price - target_value, 0)
-            if profit > 0:
-                sell_shares = profit / price
-                sell_shares = min(sell_shares, tradable_shares)
-                shares -= sell_shares
-                cash += profit
-                total_invest -= sell_shares * avg_price
-                current_max_invest += profit
-                sell_points.append((df.loc[i, 'Date'], price, avg_price, profit, total_invest, current_max_invest))
-                print(f"  → 止盈卖出: 套现金额={profit:.2f}, 卖出股份={sell_shares:.4f}, 当前价格={price:.2f}, 均值={avg_price:.2f}, 更新投入={total_invest:.2f}, max_invest可用={current_max_invest:.2f}")
-
-        history_value.append(shares * price + cash)
+    events = iter(res['events'])
+    event = next(events, None)
+    for i, (date, price, avg_price) in enumerate(zip(df['Date'], df['Close'], avg_list)):
+        print(f"{date.date()} 当前价={price:.2f}, {window}日均值={avg_price:.2f}, 市值={res['value_before'][i]:.2f}, 当前投入={res['invest_before'][i]:.2f}, max_invest可用={res['max_before'][i]:.2f}")
+        while event is not None and event[0] == i:
+            _, kind, amount, n_shares, invest_after, max_after = event
+            if kind == '补仓':
+                add_points.append((date, price, avg_price, amount, invest_after, max_after))
+                print(f"  → 止跌补仓: 补仓金额={amount:.2f}, 当前价格={price:.2f}, 均值={avg_price:.2f}, 更新投入={invest_after:.2f}, max_invest可用={max_after:.2f}")
+            else:
+                sell_points.append((date, price, avg_price, amount, invest_after, max_after))
+                print(f"  → 止盈卖出: 套现金额={amount:.2f}, 卖出股份={n_shares:.4f}, 当前价格={price:.2f}, 均值={avg_price:.2f}, 更新投入={invest_after:.2f}, max_invest可用={max_after:.2f}")
+            event = next(events, None)
 
     # # 绘图
     # plt.figure(figsize=(14,6))
@@ -110,5 +82,6 @@ def simulate_strategy_dynamic_max_correct(stock_code, buy_date_str, end_date_str
     print(f"总收益: {total_profit:.2f}, 收益率: {profit_rate:.2f}%")
 
 # 示例调用
-simulate_strategy_dynamic_max_correct("601318", "2024-08-01", "2025-08-01",
-                                      init_invest=10000, max_invest=50000, window=5, down_max_invest=0.95, up_max_invest=1.15)
+if __name__ == "__main__":
+    simulate_strategy_dynamic_max_correct("601318", "2024-08-01", "2025-08-01",
+                                          init_invest=10000, max_invest=50000, window=5, down_max_invest=0.95, up_max_invest=1.15)
@@ -1,6 +1,56 @@
-import akshare as ak
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
 import pandas as pd
 
+from backtest_output import open_writer
+from rate_limiter import get_limiter, retry_call
+from strategy_kernel import run_principal_tracking, run_shared_principal_tracking, trailing_mean
+
+# 离线模式: STOCK_FAKE_AKSHARE=1 时使用本地假数据模块
+if os.environ.get('STOCK_FAKE_AKSHARE'):
+    import fake_akshare as ak
+else:
+    import akshare as ak
+
+# 组合回测的并发取数配置(东财日线接口限速)
+FETCH_CONFIG = {
+    "max_workers": 8,    # 取数线程数
+    "rate": 10.0,        # 每秒请求数
+    "max_retry": 3,
+    "retry_backoff": 0.5,
+}
+
+
+def fetch_close_df(stock_code, buy_date_str, end_date_str, retries=1):
+    """获取区间内前复权收盘价，返回 Date/Close 两列；失败或无数据返回空 DataFrame"""
+    limiter = get_limiter('eastmoney', FETCH_CONFIG['rate'], burst=FETCH_CONFIG['max_workers'])
+    try:
+        df = retry_call(ak.stock_zh_a_hist, symbol=stock_code, period="daily",
+                        start_date=buy_date_str.replace("-", ""), end_date=end_date_str.replace("-", ""),
+                        adjust="qfq", retries=retries,
+                        backoff=FETCH_CONFIG['retry_backoff'], before=limiter.acquire)
+    except Exception as e:
+        print(f"{stock_code}: 获取数据失败 - {e}")
+        return pd.DataFrame()
+
+    if df.empty:
+        print(f"{stock_code}: 未获取到数据")
+        return pd.DataFrame()
+
+    df = df[['日期', '收盘']].copy()
+    df.rename(columns={'日期': 'Date', '收盘': 'Close'}, inplace=True)
+    df['Date'] = pd.to_datetime(df['Date'])
+    df.sort_values('Date', inplace=True)
+
+    start_date = pd.to_datetime(buy_date_str)
+    end_date = pd.to_datetime(end_date_str)
+
+    df = df[(df['Date'] >= start_date) & (df['Date'] <= end_date)].reset_index(drop=True)
+    if df.empty:
+        print(f"{stock_code}: 买入日不在交易日范围内")
+    return df
+
 
 def simulate_strategy_dynamic_max_correct(stock_code, buy_date_str, end_date_str,
                                           init_invest=10000, max_invest=50000,
@@ -21,106 +71,37 @@ def simulate_strategy_dynamic_max_correct(stock_code, buy_date_str, end_date_str
     返回:
         pd.DataFrame: 包含交易明细和账户状态的DataFrame.
     """
-    # 获取历史数据
-    try:
-        df = ak.stock_zh_a_hist(
-            symbol=stock_code,
-            period="daily",
-            start_date=buy_date_str.replace("-", ""),
-            end_date=end_date_str.replace("-", ""),
-            adjust="qfq"
-        )
-    except Exception as e:
-        print(f"{stock_code}: 获取数据失败 - {e}")
-        return pd.DataFrame()
-
+    df = fetch_close_df(stock_code, buy_date_str, end_date_str)
     if df.empty:
-        print(f"{stock_code}: 未获取到数据")
         return pd.DataFrame()
+    return simulate_close_df(df, init_invest, max_invest, window, down_factor, up_factor)
 
-    df = df[['日期', '收盘']].copy()
-    df.rename(columns={'日期': 'Date', '收盘': 'Close'}, inplace=True)
-    df['Date'] = pd.to_datetime(df['Date'])
-    df.sort_values('Date', inplace=True)
 
-    start_date = pd.to_datetime(buy_date_str)
-    end_date = pd.to_datetime(end_date_str)
+def simulate_close_df(df, init_invest=10000, max_invest=50000, window=5, down_factor=0.95, up_factor=1.15):
+    """在已取好的 Date/Close 数据上跑策略，返回交易明细 DataFrame(最后一行为期末统计)"""
+    # 均价一次算好(不足 window 日时取当日价)，状态机在数组上逐日推进
+    avg = trailing_mean(df['Close'], window, warmup='price')
+    res = run_principal_tracking(df['Close'], avg, init_invest, max_invest, down_factor, up_factor)
+    return build_records(df, avg, res, init_invest, window)
 
-    df = df[(df['Date'] >= start_date) & (df['Date'] <= end_date)].reset_index(drop=True)
-    if df.empty:
-        print(f"{stock_code}: 买入日不在交易日范围内")
-        return pd.DataFrame()
 
-    # 初始化账户状态
-    shares = 0.0
-    cash = init_invest
-    total_invested_principal = 0.0
-
-    records = []
-
-    for i in range(len(df)):
-        date = df.loc[i, 'Date']
-        price = df.loc[i, 'Close']
-
-        # 计算均价
-        if i >= window - 1:
-            avg_price = df.loc[i - window + 1:i, 'Close'].mean()
-        else:
-            avg_price = price  # 或其他策略，这里简化处理
-
-        action = ""
-        detail = ""
-
-        # 初始买入
-        if i == 0:
-            buy_shares = cash / price
-            shares += buy_shares
-            total_invested_principal += cash
-            cash = 0
-            action = "初始买入"
-            detail = f"买入={buy_shares:.2f}股"
-
-        # 动态均值止跌补仓
-        elif price <= avg_price * down_factor and total_invested_principal < max_invest:
-            # 简单计算补仓金额，可以调整为更复杂的策略
-            add_invest_amount = (max_invest - total_invested_principal) / 10  # 每次最多补仓剩余最大投资额的10%
-            if add_invest_amount > 0:
-                add_shares = add_invest_amount / price
-                shares += add_shares
-                total_invested_principal += add_invest_amount
-                action = "止跌补仓"
-                detail = f"补仓={add_invest_amount:.2f}"
-
-        # 动态均值止盈卖出
-        elif price >= avg_price * up_factor and shares > 0:
-            # 卖出部分股份以实现盈利
-            sell_ratio = 0.5  # 卖出持仓的50%
-            sell_shares = shares * sell_ratio
-            if sell_shares > 0:
-                sell_value = sell_shares * price
-                cash += sell_value
-                shares -= sell_shares
-
-                # 调整已投入本金，以反映卖出
-                avg_cost = total_invested_principal / (shares + sell_shares)
-                total_invested_principal = shares * avg_cost
-
-                action = "止盈卖出"
-                detail = f"卖出={sell_shares:.2f}股"
-
-        current_value = shares * price + cash
-
-        records.append({
-            "日期": date,
-            "收盘价": price,
-            f"{window}日均值": avg_price,
-            "操作": action,
-            "详情": detail,
-            "投入本金": total_invested_principal,
-            "股票市值": shares * price,
-            "账户现金": cash,
-            "账户总市值": current_value
-        })
+def build_records(df, avg, res, init_invest, window):
+    """把内核结果整理成交易明细 DataFrame(最后一行为期末统计)"""
+    shares, cash = res['shares'], res['final_cash']
+    total_invested_principal = res['total_invested_principal']
+    avg_price = avg[-1]
+
+    records = pd.DataFrame({
+        "日期": df['Date'],
+        "收盘价": df['Close'],
+        f"{window}日均值": avg,
+        "操作": res['action'],
+        "详情": res['detail'],
+        "投入本金": res['principal'],
+        "股票市值": res['stock_value'],
+        "账户现金": res['cash'],
+        "账户总市值": res['total_value'],
+    }).to_dict('records')
 
     # 期末统计
     final_value = shares * df.iloc[-1]['Close'] + cash
@@ -143,11 +124,13 @@ def simulate_strategy_dynamic_max_correct(stock_code, buy_date_str, end_date_str
 
 
 def simulate_multiple_stocks_to_excel(stock_codes, buy_date_str, end_date_str, filename="回测结果.xlsx",
-                                      init_invest=10000, max_invest=50000, window=5, down_factor=0.95, up_factor=1.15):
+                                      init_invest=10000, max_invest=50000, window=5, down_factor=0.95, up_factor=1.15,
+                                      backend=None):
     """
     多股票回测，并写入 Excel，不同股票一个 sheet
+    backend: 输出后端(xlsx/xlsx_stream/parquet/feather/csv.gz，见 backtest_output)，None 时按扩展名推断
     """
-    with pd.ExcelWriter(filename, engine="openpyxl") as writer:
+    with open_writer(filename, backend) as writer:
         for code in stock_codes:
             df = simulate_strategy_dynamic_max_correct(
                 stock_code=code,
@@ -160,20 +143,120 @@ def simulate_multiple_stocks_to_excel(stock_codes, buy_date_str, end_date_str, f
                 up_factor=up_factor
             )
             if not df.empty:
-                df.to_excel(writer, sheet_name=code, index=False)
-                print(f"{code} 已写入 Excel")
-    print(f"\n所有股票结果已保存到 {filename}")
+                writer.write(code, df)
+                print(f"{code} 已写入")
+    print(f"\n所有股票结果已保存到 {writer.path}")
+
+
+def combine_equity_curve(results, init_invest):
+    """各股票逐日账户按日期对齐后求和，得到组合资金曲线
+    某股票尚未开始交易的日期记 0，停牌日沿用前一交易日的状态；
+    组合收益率只按当日已建仓股票的初始资金计算，尚未开始的股票不计入分母
+    """
+    cols = ["投入本金", "股票市值", "账户现金", "账户总市值"]
+    frames = []
+    for code, df in results.items():
+        daily = df[df["操作"] != "期末统计"].set_index("日期")[cols]
+        frames.append(daily[~daily.index.duplicated(keep="last")])
+    dates = pd.Index(sorted(set().union(*(f.index for f in frames))), name="日期")
+    combined = sum(f.reindex(dates).ffill().fillna(0) for f in frames)
+    combined["已建仓股票数"] = sum(f.reindex(dates)["账户总市值"].ffill().notna() for f in frames).astype(int)
+    total_init = (init_invest * combined["已建仓股票数"]).replace(0, float("nan"))
+    combined["组合收益率(%)"] = (combined["账户总市值"] - total_init) / total_init * 100
+    return combined.reset_index()
+
+
+def simulate_shared_cap(frames, init_invest, max_invest, portfolio_max_invest, window=5, down_factor=0.95,
+                        up_factor=1.15):
+    """frames: {代码: Date/Close 数据}，按合并交易日历联合模拟，所有股票共用 portfolio_max_invest 的投入本金额度
+    返回 {代码: 交易明细 DataFrame}
+    """
+    codes = list(frames)
+    calendar = pd.Index(sorted(set().union(*(frames[c]['Date'] for c in codes))))
+    avgs = {c: trailing_mean(frames[c]['Close'], window, warmup='price') for c in codes}
+    series = [(calendar.get_indexer(frames[c]['Date']), frames[c]['Close'], avgs[c]) for c in codes]
+    results = run_shared_principal_tracking(series, init_invest, max_invest, portfolio_max_invest,
+                                            down_factor, up_factor)
+    return {c: build_records(frames[c], avgs[c], res, init_invest, window) for c, res in zip(codes, results)}
+
+
+def simulate_portfolio_to_excel(stock_codes, buy_date_str, end_date_str, filename="组合回测结果.xlsx",
+                                init_invest=10000, max_invest=50000, window=5, down_factor=0.95, up_factor=1.15,
+                                portfolio_max_invest=None, max_workers=None, backend=None):
+    """
+    组合回测: 多线程并发取数(按 FETCH_CONFIG 限速/重试)，每只股票取到即交给进程池模拟，
+    模拟结果按完成顺序逐个写出，最后追加"组合"表(合并资金曲线)
+    股票多、区间长时建议 backend='parquet' / 'csv.gz' / 'xlsx_stream'(见 backtest_output)
+
+    portfolio_max_invest: 组合共享的投入本金上限，None 表示不设上限
+        设置后各股票不再独立模拟：取完全部数据后按合并交易日历联合推进，每次买入前检查组合已投入本金，
+        超出的部分不买(记"额度不足")，止盈卖出腾出的额度任何股票都可使用；同一天内按 stock_codes 顺序优先
+    max_workers: 模拟进程数，默认 CPU 核数(仅不设组合上限时使用)
+    返回: 组合资金曲线 DataFrame
+    """
+    stock_codes = list(dict.fromkeys(stock_codes))
+    shared = portfolio_max_invest is not None
+    results = {}
+    with ThreadPoolExecutor(max_workers=FETCH_CONFIG["max_workers"]) as fetch_pool, \
+            ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as sim_pool, \
+            open_writer(filename, backend) as writer:
+        # 取数和模拟放在同一个等待集合里: 取到一只就提交模拟，模拟完一只就写一只
+        pending = {fetch_pool.submit(fetch_close_df, code, buy_date_str, end_date_str,
+                                     FETCH_CONFIG["max_retry"]): ("fetch", code) for code in stock_codes}
+        fetched = {}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                kind, code = pending.pop(future)
+                df = future.result()
+                if df.empty:
+                    continue
+                if kind == "fetch" and shared:
+                    fetched[code] = df
+                elif kind == "fetch":
+                    sim_future = sim_pool.submit(simulate_close_df, df, init_invest, max_invest,
+                                                 window, down_factor, up_factor)
+                    pending[sim_future] = ("simulate", code)
+                else:
+                    results[code] = df
+                    writer.write(code, df)
+                    print(f"{code} 已写入")
+        if shared and fetched:
+            # 共享额度需要所有股票按日期联合推进，只能在取完数据后统一模拟
+            fetched = {code: fetched[code] for code in stock_codes if code in fetched}
+            results = simulate_shared_cap(fetched, init_invest, max_invest, portfolio_max_invest,
+                                          window, down_factor, up_factor)
+            for code, df in results.items():
+                writer.write(code, df)
+                print(f"{code} 已写入")
+        if not results:
+            print("没有可用的回测结果")
+            return pd.DataFrame()
+        combined = combine_equity_curve(results, init_invest)
+        writer.write("组合", combined)
+
+    last = combined.iloc[-1]
+    peak = combined['投入本金'].max()
+    print(f"\n组合: {len(results)}/{len(stock_codes)} 只股票, 单只最大投入={max_invest:.2f}, 投入本金峰值={peak:.2f}")
+    if shared:
+        if peak > portfolio_max_invest + 1e-6:
+            raise RuntimeError(f"组合投入本金 {peak:.2f} 超过上限 {portfolio_max_invest}")
+        print(f"组合投入本金上限={portfolio_max_invest:.2f}")
+    print(f"期末总市值={last['账户总市值']:.2f}, 组合收益率={last['组合收益率(%)']:.2f}%")
+    print(f"所有股票结果已保存到 {writer.path}")
+    return combined
 
 
 # 示例调用
-simulate_multiple_stocks_to_excel(
-    stock_codes=["600104", "000063", "601127", "300750", "002982", "000559", "300251", "002466", "000895", "600585"],
-    buy_date_str="2024-08-01",
-    end_date_str="2025-08-01",
-    filename="stocks_backtest_revised.xlsx",
-    init_invest=10000,
-    max_invest=50000,
-    window=10,
-    down_factor=0.95,
-    up_factor=1.15
-)
\ No newline at end of file
+if __name__ == "__main__":
+    simulate_multiple_stocks_to_excel(
+        stock_codes=["600104", "000063", "601127", "300750", "002982", "000559", "300251", "002466", "000895", "600585"],
+        buy_date_str="2024-08-01",
+        end_date_str="2025-08-01",
+        filename="stocks_backtest_revised.xlsx",
+        init_invest=10000,
+        max_invest=50000,
+        window=10,
+        down_factor=0.95,
+        up_factor=1.15
+    )
\ No newline at end of file